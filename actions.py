@@ -25,79 +25,82 @@ class Actions:
         if self.getGovernmentStatus() == role:
             self.logger.log(25, f'{self.username} is {self.gu.gameState.phase}') 
             await func(self)
+            return True
+        return False
 
     async def votingPhase(self):
         self.logger.log(25, f'phase: {self.gu.gameState.phase}')
-        await self.sio.emit('selectedVoting', { 'vote':self.strategy.vote(), 'uid':self.gu.general.uid })
+        await self.sio.emit('selectedVoting', { 'vote':await self.strategy.vote(), 'uid':self.gu.general.uid })
+        return True
 
     async def selectingChancellorPhase(self):
         async def presidentSelectedChancellor(self):
-            await self.sio.emit('presidentSelectedChancellor', { 'chancellorIndex':self.strategy.selectChancellor(), 'uid':self.gu.general.uid }) 
+            await self.sio.emit('presidentSelectedChancellor', { 'chancellorIndex':await self.strategy.selectChancellor(), 'uid':self.gu.general.uid }) 
         
-        await self.governmentAction('isPendingPresident', presidentSelectedChancellor)
+        return await self.governmentAction('isPendingPresident', presidentSelectedChancellor)
 
     async def presidentSelectingPolicyPhase(self):
         async def selectedPresidentPolicy(self):
-            await self.sio.emit('selectedPresidentPolicy', {'selection':self.strategy.presidentSelectPolicy(), 'uid':self.gu.general.uid })
+            await self.sio.emit('selectedPresidentPolicy', {'selection':await self.strategy.presidentSelectPolicy(), 'uid':self.gu.general.uid })
         
-        await self.governmentAction('isPresident', selectedPresidentPolicy)
+        return await self.governmentAction('isPresident', selectedPresidentPolicy)
 
     async def chancellorSelectingPolicyPhase(self):
         async def selectedChancellorPolicy(self):
-            await self.sio.emit('selectedChancellorPolicy', {'selection':self.strategy.chancellorSelectPolicy(), 'uid':self.gu.general.uid })
+            await self.sio.emit('selectedChancellorPolicy', {'selection':await self.strategy.chancellorSelectPolicy(), 'uid':self.gu.general.uid })
         
-        await self.governmentAction('isChancellor', selectedChancellorPolicy)
+        return await self.governmentAction('isChancellor', selectedChancellorPolicy)
 
     async def deckpeekPhase(self):
         async def selectedPolicies(self):
             await self.sio.emit('selectedPolicies', { 'uid':self.gu.general.uid })
         
-        await self.governmentAction('isPresident', selectedPolicies)
+        return await self.governmentAction('isPresident', selectedPolicies)
 
     async def peekdropPhase(self):
         async def selectedPolicies(self):
             await self.sio.emit('selectedPolicies', { 'uid':self.gu.general.uid })
 
-        await self.governmentAction('isPresident', selectedPolicies)
+        return await self.governmentAction('isPresident', selectedPolicies)
 
     async def executionPhase(self):
         async def selectedPlayerToExecute(self):
-            await self.sio.emit('selectedPlayerToExecute', { 'playerIndex':self.strategy.selectPlayerToExecute(), 'uid':self.gu.general.uid })
+            await self.sio.emit('selectedPlayerToExecute', { 'playerIndex':await self.strategy.selectPlayerToExecute(), 'uid':self.gu.general.uid })
         
-        await self.governmentAction('isPresident', selectedPlayerToExecute)
+        return await self.governmentAction('isPresident', selectedPlayerToExecute)
 
     async def chancellorVoteOnVetoPhase(self):
         async def selectedChancellorVoteOnVeto(self):
-            await self.sio.emit('selectedChancellorVoteOnVeto', { 'vote':self.strategy.chancellorVoteOnVeto(), 'uid':self.gu.general.uid })
+            await self.sio.emit('selectedChancellorVoteOnVeto', { 'vote':await self.strategy.chancellorVoteOnVeto(), 'uid':self.gu.general.uid })
         
-        await self.governmentAction('isChancellor', selectedChancellorVoteOnVeto)
+        return await self.governmentAction('isChancellor', selectedChancellorVoteOnVeto)
 
     async def presidentVoteOnVetoPhase(self):
         async def selectedPresidentVoteOnVeto(self):
-            await self.sio.emit('selectedPresidentVoteOnVeto', { 'vote':self.strategy.presidentVoteOnVeto(), 'uid':self.gu.general.uid })
+            await self.sio.emit('selectedPresidentVoteOnVeto', { 'vote':await self.strategy.presidentVoteOnVeto(), 'uid':self.gu.general.uid })
 
-        await self.governmentAction('isPresident', selectedPresidentVoteOnVeto)
+        return await self.governmentAction('isPresident', selectedPresidentVoteOnVeto)
 
     async def selectPartyMembershipInvestigatePhase(self):
         async def selectPartyMembershipInvestigate(self):
-            await self.sio.emit('selectPartyMembershipInvestigate', { 'playerIndex':self.strategy.selectPartyMembershipInvestigate(), 'uid':self.gu.general.uid })
+            await self.sio.emit('selectPartyMembershipInvestigate', { 'playerIndex':await self.strategy.selectPartyMembershipInvestigate(), 'uid':self.gu.general.uid })
 
-        await self.governmentAction('isPresident', selectPartyMembershipInvestigate)
+        return await self.governmentAction('isPresident', selectPartyMembershipInvestigate)
 
     async def selectPartyMembershipInvestigateReversePhase(self):
         async def selectPartyMembershipInvestigateReverse(self):
-             await self.sio.emit('selectPartyMembershipInvestigateReverse', { 'playerIndex':self.strategy.selectPartyMembershipInvestigateReverse(), 'uid':self.gu.general.uid })
+             await self.sio.emit('selectPartyMembershipInvestigateReverse', { 'playerIndex':await self.strategy.selectPartyMembershipInvestigateReverse(), 'uid':self.gu.general.uid })
 
-        await self.governmentAction('isPresident', selectPartyMembershipInvestigateReverse)
+        return await self.governmentAction('isPresident', selectPartyMembershipInvestigateReverse)
 
     async def specialElectionPhase(self):
         async def selectedSpecialElection(self):
-            await self.sio.emit('selectedSpecialElection', { 'playerIndex':self.strategy.selectedSpecialElection(), 'uid':self.gu.general.uid })
+            await self.sio.emit('selectedSpecialElection', { 'playerIndex':await self.strategy.selectedSpecialElection(), 'uid':self.gu.general.uid })
 
-        await self.governmentAction('isPresident', selectedSpecialElection)
+        return await self.governmentAction('isPresident', selectedSpecialElection)
 
     async def presidentVoteOnBurnPhase(self):
         async def selectedPresidentVoteOnBurn(self):
-             await self.sio.emit('selectedPresidentVoteOnBurn', { 'vote':self.strategy.selectedPresidentVoteOnBurn(), 'uid':self.gu.general.uid })
+             await self.sio.emit('selectedPresidentVoteOnBurn', { 'vote':await self.strategy.selectedPresidentVoteOnBurn(), 'uid':self.gu.general.uid })
 
-        await self.governmentAction('isPresident', selectedPresidentVoteOnBurn)
+        return await self.governmentAction('isPresident', selectedPresidentVoteOnBurn)
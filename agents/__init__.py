@@ -1,5 +1,5 @@
 from .agent import Agent
-from .pimc_agent import PIMCAgent100, PIMCAgent10000
+from .pimc_agent import PIMCAgent100, PIMCAgent10000, PIMCAgentBatch
 from .selfish_agent import SelfishAgent
 from .random_agent import RandomAgent
-from .soismcts_agent import SOISMCTSAgent100, SOISMCTSAgent10000
+from .soismcts_agent import SOISMCTSAgent100, SOISMCTSAgent10000, SOISMCTSAgentAdaptive, SOISMCTSAgentPondering
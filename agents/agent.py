@@ -28,6 +28,18 @@ class Agent:
     def get_action(self, state: SecretHitlerState, legal_actions: List):
         raise NotImplementedError
 
+    def ponder(self, state: SecretHitlerState):
+        """
+        Called with the new state when other players are to move, agents may prepare their next decisions
+        """
+        pass
+
+    def close(self):
+        """
+        Called once the game is over, agents release what they hold for it
+        """
+        pass
+
     def handle_transition(self, old_state: SecretHitlerState, new_state: SecretHitlerState, old_hidden_state: HiddenSecretHitlerState,
                           new_hidden_state: HiddenSecretHitlerState, moves, observation=None):
         self.filter_hidden_roles_on_terminal(old_state, new_state, old_hidden_state, moves)
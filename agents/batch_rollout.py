@@ -0,0 +1,330 @@
+import numpy as np
+from typing import List
+
+from secrethitler import SecretHitlerState, HiddenSecretHitlerState, Phase, Party, SecretRole, Power, GameEndReason, \
+    SECRET_HITLER_POWERS, SECRET_HITLER_PLAYER_COUNT, NUM_LIB_POLICY, NUM_FAS_POLICY, DECK_SIZE, LIB_POLICY_WIN, \
+    FAS_POLICY_WIN, CHAOS, HITLER_ZONE
+
+NOMINATION, VOTE, PRESIDENT_SELECT, CHANCELLOR_SELECT, POWER, END, VETO = \
+    (Phase.nomination.value, Phase.vote.value, Phase.presidentSelectPolicy.value, Phase.chancellorSelectPolicy.value,
+     Phase.presidentPower.value, Phase.end.value, Phase.veto.value)
+LIBERAL, FASCIST = Party.liberal.value, Party.fascist.value
+NO_WINNER = -1
+NONE = -1  # empty player slot, e.g. no chancellor
+# cards kept by the president when discarding the card at index i
+KEPT_CARDS = np.array([[1, 2], [0, 2], [0, 1]])
+CARD_WEIGHTS = 1 << np.arange(DECK_SIZE, dtype=np.int64)
+
+
+class RolloutBatch:
+    """
+    Many (SecretHitlerState, HiddenSecretHitlerState) determinizations stored as struct-of-arrays and played
+    out in lockstep with uniformly random moves, following the rules of SecretHitlerState.transition.
+
+    The draw pile is a bit string per game, bit 0 being the top card and a set bit a liberal policy.
+    Only the draw pile and the proposed policies are tracked, the discard pile is implied by the policy counts
+    since a reshuffle always rebuilds the deck from every policy that has not been enacted.
+    """
+    def __init__(self, num_players: int, size: int):
+        self.num_players = num_players
+        self.size = size
+        self.powers = np.array([power.value for power in SECRET_HITLER_POWERS[num_players]])
+        self.phase = np.full(size, NOMINATION, dtype=np.int8)
+        self.fas_policy = np.zeros(size, dtype=np.int8)
+        self.lib_policy = np.zeros(size, dtype=np.int8)
+        self.chaos = np.zeros(size, dtype=np.int8)
+        self.president = np.zeros(size, dtype=np.int8)
+        self.chancellor = np.full(size, NONE, dtype=np.int8)
+        self.se_prev_pres = np.full(size, NONE, dtype=np.int8)
+        self.prev_president = np.full(size, NONE, dtype=np.int8)
+        self.prev_chancellor = np.full(size, NONE, dtype=np.int8)
+        self.president_veto = np.ones(size, dtype=bool)
+        self.alive = np.ones((size, num_players), dtype=bool)
+        self.roles = np.zeros((size, num_players), dtype=np.int8)
+        self.deck = np.zeros(size, dtype=np.int64)
+        self.deck_size = np.zeros(size, dtype=np.int8)
+        self.proposed = np.zeros((size, 3), dtype=np.int8)
+        self.winner = np.full(size, NO_WINNER, dtype=np.int8)
+        self.end_reason = np.full(size, NO_WINNER, dtype=np.int8)
+        self.selfish = np.zeros((size, num_players), dtype=bool)  # seats playing like SelfishAgent
+        self.rng = None
+
+    @classmethod
+    def from_states(cls, game_states: List[SecretHitlerState], hidden_states: List[HiddenSecretHitlerState]):
+        """
+        Encodes determinizations that share a starting number of players
+        """
+        num_players = game_states[0].starting_num_players
+        batch = cls(num_players, len(game_states))
+        for i, (state, hidden_state) in enumerate(zip(game_states, hidden_states)):
+            assert state.starting_num_players == num_players, 'all games in a batch need the same number of players'
+            batch.phase[i] = state.phase.value
+            batch.fas_policy[i] = state.fas_policy
+            batch.lib_policy[i] = state.lib_policy
+            batch.chaos[i] = state.chaos
+            batch.president[i] = state.president
+            batch.chancellor[i] = NONE if state.chancellor is None else state.chancellor
+            batch.se_prev_pres[i] = NONE if state.se_prev_pres is None else state.se_prev_pres
+            if state.prev_gov is not None:
+                batch.prev_president[i] = NONE if state.prev_gov[0] is None else state.prev_gov[0]
+                batch.prev_chancellor[i] = state.prev_gov[1]
+            batch.president_veto[i] = state.president_veto
+            batch.alive[i] = False
+            batch.alive[i, state.alive_players] = True
+            batch.roles[i] = [role.value for role in hidden_state.hidden_roles]
+            # the deck is popped from the right, so the last card is the top one
+            top_first = [policy.value for policy in reversed(hidden_state.policy_deck.deck)]
+            batch.deck[i] = int(np.dot(top_first, CARD_WEIGHTS[:len(top_first)]))
+            batch.deck_size[i] = len(top_first)
+            batch.proposed[i, :len(hidden_state.proposed_policies)] = \
+                [policy.value for policy in hidden_state.proposed_policies]
+            if state.is_terminal():
+                batch.winner[i] = state.game_end.value
+                batch.end_reason[i] = state.game_end_reason.value
+        return batch
+
+    @classmethod
+    def start(cls, num_players: int, roles: np.ndarray, rng: np.random.Generator = None):
+        """
+        New games with the given role values, random first presidents and freshly shuffled decks
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        batch = cls(num_players, len(roles))
+        batch.roles[:] = roles
+        batch.president[:] = rng.integers(0, num_players, size=len(roles))
+        batch.rng = rng
+        batch._reshuffle_if_short(np.arange(len(roles)), DECK_SIZE)
+        return batch
+
+    def repeat(self, n: int):
+        """
+        Returns a batch in which every game is repeated n times, for several playouts of the same determinization
+        """
+        batch = self.__class__(self.num_players, self.size * n)
+        for name, value in self.__dict__.items():
+            if isinstance(value, np.ndarray) and name != 'powers':
+                setattr(batch, name, np.repeat(value, n, axis=0))
+        return batch
+
+    def run(self, rng: np.random.Generator = None, max_steps=1000) -> np.ndarray:
+        """
+        Plays every game to the end and returns the terminal value of each player, shape (size, num_players)
+        """
+        self.rng = np.random.default_rng() if rng is None else rng
+        for _ in range(max_steps):
+            if not (self.winner == NO_WINNER).any():
+                break
+            self.step()
+        assert (self.winner != NO_WINNER).all(), 'rollouts did not finish'
+        return self.terminal_values()
+
+    def terminal_values(self) -> np.ndarray:
+        num_lib, num_fas = SECRET_HITLER_PLAYER_COUNT[self.num_players]
+        liberal_win = (self.winner == LIBERAL)[:, None]
+        lib_amount = np.where(liberal_win, 1.0, -1.0)
+        fas_amount = np.where(liberal_win, -float(num_lib) / num_fas, float(num_lib) / num_fas)
+        return np.where(self.roles == SecretRole.liberal.value, lib_amount, fas_amount)
+
+    def step(self):
+        """
+        Advances every unfinished game by one transition
+        """
+        active = self.winner == NO_WINNER
+        groups = [(np.flatnonzero(active & (self.phase == phase)), handler) for phase, handler in [
+            (NOMINATION, self._nomination), (VOTE, self._vote), (PRESIDENT_SELECT, self._president_select),
+            (CHANCELLOR_SELECT, self._chancellor_select), (VETO, self._veto), (POWER, self._power)]]
+        for rows, handler in groups:
+            if len(rows) != 0:
+                handler(rows)
+
+    # ---- transitions -------------------------------------------------------------------------------------
+
+    def _nomination(self, rows):
+        players = np.arange(self.num_players)
+        eligible = self.alive[rows] & (players != self.president[rows, None]) \
+            & (players != self.prev_president[rows, None]) & (players != self.prev_chancellor[rows, None])
+        self.chancellor[rows] = _uniform_pick(eligible, self.rng)
+        self.phase[rows] = VOTE
+
+    def _vote(self, rows):
+        alive = self.alive[rows]
+        ja_votes = ((self.rng.random(alive.shape) < 0.5) & alive).sum(axis=1)
+        passed = ja_votes > alive.sum(axis=1) / 2
+        self._vote_pass(rows[passed])
+        self._vote_fail(rows[~passed])
+
+    def _vote_pass(self, rows):
+        hitler_elected = (self.fas_policy[rows] >= HITLER_ZONE) & \
+            (self.roles[rows, self.chancellor[rows]] == SecretRole.hitler.value)
+        self._end(rows[hitler_elected], FASCIST, GameEndReason.hitler_elected)
+        rows = rows[~hitler_elected]
+        self.prev_president[rows] = np.where(self.alive[rows].sum(axis=1) > 5, self.president[rows], NONE)
+        self.prev_chancellor[rows] = self.chancellor[rows]
+        self.proposed[rows] = self._draw(rows, 3)
+        self.phase[rows] = PRESIDENT_SELECT
+
+    def _vote_fail(self, rows):
+        self._advance_president(rows)
+        chaos = self.chaos[rows] + 1 >= CHAOS
+        self._chaos(rows[chaos])
+        rows = rows[~chaos]
+        self.chancellor[rows] = NONE
+        self.chaos[rows] += 1
+        self.phase[rows] = NOMINATION
+
+    def _president_select(self, rows):
+        discard = self.rng.integers(0, 3, size=len(rows))
+        selfish = self.selfish[rows, self.president[rows]]
+        if selfish.any():
+            # discard a policy of the other party when there is one
+            other_party = self._party(rows[selfish], self.president[rows[selfish]]) ^ 1
+            is_other = self.proposed[rows[selfish]] == other_party[:, None]
+            discard[selfish] = np.where(is_other.any(axis=1), np.argmax(is_other, axis=1), discard[selfish])
+        self.proposed[rows, :2] = np.take_along_axis(self.proposed[rows], KEPT_CARDS[discard], axis=1)
+        self.phase[rows] = CHANCELLOR_SELECT
+
+    def _chancellor_select(self, rows):
+        can_veto = (self.fas_policy[rows] == FAS_POLICY_WIN - 1) & self.president_veto[rows]
+        choice = (self.rng.random(len(rows)) * np.where(can_veto, 3, 2)).astype(np.int64)
+        selfish = self.selfish[rows, self.chancellor[rows]]
+        if selfish.any():
+            # enact a policy of their own party when there is one, never veto
+            own = self.proposed[rows[selfish], :2] == self._party(rows[selfish], self.chancellor[rows[selfish]])[:, None]
+            choice[selfish] = np.argmax(own, axis=1)
+        veto = choice == 2
+        self.phase[rows[veto]] = VETO
+        rows, choice = rows[~veto], choice[~veto]
+
+        policy = self.proposed[rows, choice]
+        self._enact(rows, policy)
+        self.chaos[rows] = 0
+        self.chancellor[rows] = NONE
+        self.president_veto[rows] = True
+        rows, policy = rows[self.winner[rows] == NO_WINNER], policy[self.winner[rows] == NO_WINNER]
+        power = (policy == FASCIST) & (self.powers[self.fas_policy[rows]] != Power.none.value)
+        self.phase[rows[power]] = POWER
+        self._advance_president(rows[~power])
+        self.phase[rows[~power]] = NOMINATION
+
+    def _veto(self, rows):
+        veto = self.rng.random(len(rows)) < 0.5
+        rejected = rows[~veto]
+        self.phase[rejected] = CHANCELLOR_SELECT
+        self.president_veto[rejected] = False
+
+        rows = rows[veto]
+        self._advance_president(rows)
+        self.chancellor[rows] = NONE
+        chaos = self.chaos[rows] + 1 >= CHAOS
+        self._chaos(rows[chaos])
+        # a successful veto without chaos does not move the election tracker, as in SecretHitlerState
+        self.phase[rows[~chaos]] = NOMINATION
+
+    def _power(self, rows):
+        power = self.powers[self.fas_policy[rows]]
+        players = np.arange(self.num_players)
+        targets = np.full(len(rows), NONE)
+        targeted = power != Power.deckpeek.value
+        if targeted.any():
+            candidates = self.alive[rows[targeted]] & (players != self.president[rows[targeted], None])
+            targets[targeted] = _uniform_pick(candidates, self.rng)
+
+        deckpeek = rows[power == Power.deckpeek.value]
+        self._reshuffle_if_short(deckpeek, 3)
+        self._advance_president(deckpeek)
+
+        investigate = rows[power == Power.investigate.value]
+        self._advance_president(investigate)
+
+        special = power == Power.specialelection.value
+        self.se_prev_pres[rows[special]] = self.president[rows[special]]
+        self.president[rows[special]] = targets[special]
+
+        bullet = power == Power.bullet.value
+        shot_rows, shot = rows[bullet], targets[bullet]
+        hitler_killed = self.roles[shot_rows, shot] == SecretRole.hitler.value
+        self._end(shot_rows[hitler_killed], LIBERAL, GameEndReason.hitler_killed)
+        shot_rows, shot = shot_rows[~hitler_killed], shot[~hitler_killed]
+        # prev_gov keeps the previous president only if more than five players were alive before the shot
+        small = self.alive[shot_rows].sum(axis=1) <= 5
+        self.prev_president[shot_rows[small]] = NONE
+        self.alive[shot_rows, shot] = False
+        self._advance_president(shot_rows)
+
+        self.phase[rows[self.winner[rows] == NO_WINNER]] = NOMINATION
+
+    # ---- helpers -----------------------------------------------------------------------------------------
+
+    def _party(self, rows, players) -> np.ndarray:
+        return (self.roles[rows, players] == SecretRole.liberal.value).astype(np.int8)
+
+    def _advance_president(self, rows):
+        start = np.where(self.se_prev_pres[rows] != NONE, self.se_prev_pres[rows], self.president[rows]) + 1
+        seats = (start[:, None] + np.arange(self.num_players)) % self.num_players
+        first_alive = np.argmax(np.take_along_axis(self.alive[rows], seats, axis=1), axis=1)
+        self.president[rows] = seats[np.arange(len(rows)), first_alive]
+        self.se_prev_pres[rows] = NONE
+
+    def _chaos(self, rows):
+        policy = self._draw(rows, 1)[:, 0]
+        self._enact(rows, policy)
+        self.chaos[rows] = 0
+        self.prev_president[rows] = NONE
+        self.prev_chancellor[rows] = NONE
+        self.phase[rows[self.winner[rows] == NO_WINNER]] = NOMINATION
+
+    def _enact(self, rows, policy):
+        self.fas_policy[rows] += policy == FASCIST
+        self.lib_policy[rows] += policy == LIBERAL
+        self._end(rows[self.fas_policy[rows] == FAS_POLICY_WIN], FASCIST, GameEndReason.six_fascist_policies)
+        self._end(rows[self.lib_policy[rows] == LIB_POLICY_WIN], LIBERAL, GameEndReason.five_liberal_policies)
+
+    def _end(self, rows, party, reason: GameEndReason):
+        self.winner[rows] = party
+        self.end_reason[rows] = reason.value
+        self.phase[rows] = END
+
+    def _draw(self, rows, n) -> np.ndarray:
+        """
+        Pops n cards from the top of each deck, returned top first
+        """
+        self._reshuffle_if_short(rows, n)
+        cards = (self.deck[rows, None] >> np.arange(n)) & 1
+        self.deck[rows] >>= n
+        self.deck_size[rows] -= n
+        return cards.astype(np.int8)
+
+    def _reshuffle_if_short(self, rows, n):
+        rows = rows[self.deck_size[rows] < n]
+        if len(rows) == 0:
+            return
+        remaining_lib = NUM_LIB_POLICY - self.lib_policy[rows]
+        remaining = remaining_lib + NUM_FAS_POLICY - self.fas_policy[rows]
+        positions = np.arange(DECK_SIZE)
+        cards = (positions < remaining_lib[:, None]).astype(np.int64)
+        keys = np.where(positions < remaining[:, None], self.rng.random((len(rows), DECK_SIZE)), np.inf)
+        shuffled = np.take_along_axis(cards, np.argsort(keys, axis=1), axis=1)
+        self.deck[rows] = shuffled @ CARD_WEIGHTS
+        self.deck_size[rows] = remaining
+
+
+def _uniform_pick(mask: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Picks a uniformly random True column in each row of mask
+    """
+    counts = mask.sum(axis=1)
+    threshold = (rng.random(len(mask)) * counts).astype(np.int64)
+    return np.argmax(np.cumsum(mask, axis=1) > threshold[:, None], axis=1)
+
+
+def simulate_batch(game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState, num_playouts: int,
+                   rng: np.random.Generator = None, selfish: bool = False) -> np.ndarray:
+    """
+    Mean terminal values of num_playouts random playouts of one determinization, played in lockstep.
+    With selfish every player makes policy choices like SelfishAgent. Without rng the playouts are seeded from
+    numpy's global generator, so that they follow np.random.seed like the single playouts of the searches.
+    """
+    rng = np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64)) if rng is None else rng
+    batch = RolloutBatch.from_states([game_state], [hidden_state]).repeat(num_playouts)
+    batch.selfish[:] = selfish
+    return batch.run(rng).mean(axis=0)
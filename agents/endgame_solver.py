@@ -0,0 +1,355 @@
+import logging
+from collections import namedtuple
+from typing import List, Tuple
+
+import numpy as np
+
+from .mcts_common import determinization_iterator
+from secrethitler import SecretHitlerState, HiddenSecretHitlerState, Phase, Party, SecretRole, Power, \
+    PolicyChoiceAction, VetoAction, NominateChancellorAction, SECRET_HITLER_POWERS, SECRET_HITLER_PLAYER_COUNT, \
+    NUM_LIB_POLICY, NUM_FAS_POLICY, LIB_POLICY_WIN, FAS_POLICY_WIN, CHAOS, HITLER_ZONE
+
+logger = logging.getLogger(__name__)
+
+LIBERAL, FASCIST = Party.liberal.value, Party.fascist.value
+LIBERAL_WIN, FASCIST_WIN = 1.0, 0.0
+# vetoes do not advance the election tracker in SecretHitlerState, so a game can go on forever; such lines are
+# scored as draws
+UNENDING_VALUE = 0.5
+
+# Compact perfect-information state. The draw pile is a known top part, top card first, above a uniformly
+# shuffled rest of which only the counts are known; the rest is non-empty only after a reshuffle.
+EndgameState = namedtuple('EndgameState', [
+    'phase', 'fas_policy', 'lib_policy', 'chaos', 'president', 'chancellor', 'se_prev_pres', 'prev_gov',
+    'president_veto', 'alive_players', 'known_deck', 'unknown_lib', 'unknown_fas', 'proposed'
+])
+
+
+class SolverBudgetExceeded(Exception):
+    pass
+
+
+def policies_left(game_state: SecretHitlerState) -> int:
+    """
+    Most policies that can still be enacted before the game ends on the policy track
+    """
+    return (FAS_POLICY_WIN - game_state.fas_policy) + (LIB_POLICY_WIN - game_state.lib_policy) - 1
+
+
+def endgame_state(game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState) -> EndgameState:
+    return EndgameState(
+        phase=game_state.phase.value, fas_policy=game_state.fas_policy, lib_policy=game_state.lib_policy,
+        chaos=game_state.chaos, president=game_state.president, chancellor=game_state.chancellor,
+        se_prev_pres=game_state.se_prev_pres, prev_gov=game_state.prev_gov, president_veto=game_state.president_veto,
+        alive_players=tuple(game_state.alive_players),
+        # the deck is popped from the right, so the last card is the top one
+        known_deck=tuple(policy.value for policy in reversed(hidden_state.policy_deck.deck)),
+        unknown_lib=0, unknown_fas=0,
+        proposed=tuple(sorted(policy.value for policy in hidden_state.proposed_policies))
+    )
+
+
+class EndgameSolver:
+    """
+    Exact expectimax solver for determinized late-game states.
+
+    The value of a state is the probability of a liberal victory. Every player moves to maximise the chance of
+    their own party winning, votes are cast for the outcome the voter's party prefers, and reshuffles are chance
+    nodes over the cards drawn from the shuffled deck. Values are memoized by role assignment and EndgameState.
+
+    Only states with at most max_policies_left policies to go are attempted, and a solve gives up once it has
+    visited max_states new states, so that larger positions stay with sampling-based search. Without vetoes
+    every line of play ends within a few dozen states; lines that return to a state being solved or grow
+    longer than max_depth states only repeat vetoes and are scored as draws, UNENDING_VALUE. Where a line is cut
+    depends on where the solve started, so only the values of states without a cut line below them are kept
+    for later solves.
+    """
+    def __init__(self, max_policies_left=2, max_states=20000, max_depth=150, determinizations=100):
+        self.max_policies_left = max_policies_left
+        self.max_states = max_states
+        self.max_depth = max_depth
+        self.determinizations = determinizations
+        self.memo = {}
+        self._line_memo = {}  # values of states above cut lines, which only hold within the current solve
+        self.unsolvable = set()
+        self._in_progress = set()
+        self._cut = False  # whether a line below the state being solved was cut
+        self.roles = None
+        self.num_players = None
+        self._budget = 0
+
+    def applicable(self, game_state: SecretHitlerState) -> bool:
+        return not game_state.is_terminal() and policies_left(game_state) <= self.max_policies_left
+
+    def liberal_win_probability(self, game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState):
+        """
+        Exact liberal win probability of a determinization, None when the solve exceeds the state budget
+        """
+        self._start(game_state, hidden_state)
+        key = (self.roles, endgame_state(game_state, hidden_state))
+        if key in self.unsolvable:
+            return None
+        try:
+            return self._value(key[1])
+        except SolverBudgetExceeded:
+            self.unsolvable.add(key)
+            return None
+
+    def values(self, game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState):
+        """
+        Expected terminal value of every player, None when the solve exceeds the state budget
+        """
+        if game_state.is_terminal():
+            return np.asarray(game_state.terminal_value(hidden_state))
+        p = self.liberal_win_probability(game_state, hidden_state)
+        return None if p is None else self._player_values(p)
+
+    def action_values(self, game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState, player: int,
+                      legal_actions) -> np.ndarray or None:
+        """
+        Expected value for player of each legal action, the other players answering optimally
+        """
+        self._start(game_state, hidden_state)
+        state = endgame_state(game_state, hidden_state)
+        try:
+            if game_state.phase == Phase.vote:
+                pass_value, fail_value = self._value_after_vote(state, True), self._value_after_vote(state, False)
+                others = [p for p in state.alive_players if p != player]
+                ja_votes = sum(self._prefers_pass(p, pass_value, fail_value) for p in others)
+                outcomes = [pass_value if ja_votes + action.ja > len(state.alive_players) / 2 else fail_value
+                            for action in legal_actions]
+            else:
+                outcomes = [self._value_after(state, action) for action in legal_actions]
+        except SolverBudgetExceeded:
+            return None
+        return np.array([self._player_values(p)[player] for p in outcomes])
+
+    def _start(self, game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState):
+        self.roles = tuple(role.value for role in hidden_state.hidden_roles)
+        self.num_players = game_state.starting_num_players
+        self._budget = self.max_states
+        self._in_progress.clear()
+        self._line_memo.clear()
+        self._cut = False
+        if len(self.memo) > 4 * self.max_states:
+            self.memo.clear()
+            self.unsolvable.clear()
+
+    def _player_values(self, p: float) -> np.ndarray:
+        num_lib, num_fas = SECRET_HITLER_PLAYER_COUNT[self.num_players]
+        liberal_value = 2 * p - 1
+        return np.array([liberal_value if role == SecretRole.liberal.value else -liberal_value * num_lib / num_fas
+                         for role in self.roles])
+
+    def _is_liberal(self, player: int) -> bool:
+        return self.roles[player] == SecretRole.liberal.value
+
+    def _prefers_pass(self, player: int, pass_value: float, fail_value: float) -> bool:
+        return pass_value > fail_value if self._is_liberal(player) else pass_value < fail_value
+
+    def _best(self, player: int, values) -> float:
+        return max(values) if self._is_liberal(player) else min(values)
+
+    # ---- game rules, mirroring SecretHitlerState.transition ---------------------------------------------
+
+    def _value(self, state: EndgameState) -> float:
+        key = (self.roles, state)
+        value = self.memo.get(key)
+        if value is not None:
+            return value
+        value = self._line_memo.get(key)
+        if value is not None:
+            self._cut = True
+            return value
+        if key in self._in_progress or len(self._in_progress) >= self.max_depth:
+            self._cut = True
+            return UNENDING_VALUE
+        self._budget -= 1
+        if self._budget < 0:
+            raise SolverBudgetExceeded()
+        self._in_progress.add(key)
+        outer_cut, self._cut = self._cut, False
+
+        phase = state.phase
+        if phase == Phase.nomination.value:
+            value = self._best(state.president, [self._value(state._replace(chancellor=c, phase=Phase.vote.value))
+                                                 for c in self._nominees(state)])
+        elif phase == Phase.vote.value:
+            pass_value, fail_value = self._value_after_vote(state, True), self._value_after_vote(state, False)
+            ja_votes = sum(self._prefers_pass(p, pass_value, fail_value) for p in state.alive_players)
+            value = pass_value if ja_votes > len(state.alive_players) / 2 else fail_value
+        elif phase == Phase.presidentSelectPolicy.value:
+            value = self._best(state.president, [self._discard(state, card) for card in set(state.proposed)])
+        elif phase == Phase.chancellorSelectPolicy.value:
+            options = [self._enact(state, card) for card in set(state.proposed)]
+            if state.fas_policy == FAS_POLICY_WIN - 1 and state.president_veto:
+                options.append(self._value(state._replace(phase=Phase.veto.value)))
+            value = self._best(state.chancellor, options)
+        elif phase == Phase.veto.value:
+            value = self._best(state.president, [self._veto(state, True), self._veto(state, False)])
+        elif phase == Phase.presidentPower.value:
+            value = self._power(state)
+        else:
+            assert False, f'Invalid phase={phase}'
+        self._in_progress.discard(key)
+        (self._line_memo if self._cut else self.memo)[key] = value
+        self._cut = self._cut or outer_cut
+        return value
+
+    def _value_after(self, state: EndgameState, action) -> float:
+        """
+        Value after the single moving player plays action
+        """
+        if isinstance(action, NominateChancellorAction):
+            return self._value(state._replace(chancellor=action.chancellor, phase=Phase.vote.value))
+        if isinstance(action, PolicyChoiceAction):
+            if state.phase == Phase.presidentSelectPolicy.value:
+                return self._discard(state, action.policy.value)
+            return self._enact(state, action.policy.value)
+        if isinstance(action, VetoAction):
+            if state.phase == Phase.chancellorSelectPolicy.value:
+                return self._value(state._replace(phase=Phase.veto.value))
+            return self._veto(state, action.veto)
+        return self._power(state, getattr(action, 'player', None))
+
+    def _nominees(self, state: EndgameState) -> List[int]:
+        prev_gov = state.prev_gov if state.prev_gov is not None else ()
+        return [p for p in state.alive_players if p != state.president and p not in prev_gov]
+
+    def _next_president(self, state: EndgameState, alive_players=None) -> int:
+        alive_players = state.alive_players if alive_players is None else alive_players
+        president = ((state.president if state.se_prev_pres is None else state.se_prev_pres) + 1) % self.num_players
+        while president not in alive_players:
+            president = (president + 1) % self.num_players
+        return president
+
+    def _draws(self, state: EndgameState, n: int) -> List[Tuple[float, Tuple, Tuple, int, int]]:
+        """
+        Chance outcomes of drawing n cards: (probability, cards, known deck, unknown liberals, unknown fascists)
+        """
+        known, lib, fas = state.known_deck, state.unknown_lib, state.unknown_fas
+        if len(known) + lib + fas < n:
+            known, lib, fas = (), NUM_LIB_POLICY - state.lib_policy, NUM_FAS_POLICY - state.fas_policy
+        if len(known) >= n:
+            return [(1.0, known[:n], known[n:], lib, fas)]
+        outcomes = [(1.0, known, lib, fas)]
+        for _ in range(n - len(known)):
+            drawn = []
+            for p, cards, l, f in outcomes:
+                if l > 0:
+                    drawn.append((p * l / (l + f), cards + (LIBERAL,), l - 1, f))
+                if f > 0:
+                    drawn.append((p * f / (l + f), cards + (FASCIST,), l, f - 1))
+            outcomes = drawn
+        return [(p, cards, (), l, f) for p, cards, l, f in outcomes]
+
+    def _value_after_vote(self, state: EndgameState, passed: bool) -> float:
+        if passed:
+            if state.fas_policy >= HITLER_ZONE and self.roles[state.chancellor] == SecretRole.hitler.value:
+                return FASCIST_WIN
+            prev_gov = (state.president if len(state.alive_players) > 5 else None, state.chancellor)
+            return sum(p * self._value(state._replace(phase=Phase.presidentSelectPolicy.value, prev_gov=prev_gov,
+                                                      proposed=tuple(sorted(cards)), known_deck=known,
+                                                      unknown_lib=lib, unknown_fas=fas))
+                       for p, cards, known, lib, fas in self._draws(state, 3))
+
+        president = self._next_president(state)
+        if state.chaos + 1 >= CHAOS:
+            return self._chaos(state._replace(chancellor=None, president=president, se_prev_pres=None))
+        return self._value(state._replace(chancellor=None, phase=Phase.nomination.value, chaos=state.chaos + 1,
+                                          president=president, se_prev_pres=None))
+
+    def _chaos(self, state: EndgameState) -> float:
+        value = 0.0
+        for p, cards, known, lib, fas in self._draws(state, 1):
+            fas_policy = state.fas_policy + (cards[0] == FASCIST)
+            lib_policy = state.lib_policy + (cards[0] == LIBERAL)
+            if fas_policy == FAS_POLICY_WIN:
+                value += p * FASCIST_WIN
+            elif lib_policy == LIB_POLICY_WIN:
+                value += p * LIBERAL_WIN
+            else:
+                value += p * self._value(state._replace(
+                    chaos=0, prev_gov=None, fas_policy=fas_policy, lib_policy=lib_policy, phase=Phase.nomination.value,
+                    known_deck=known, unknown_lib=lib, unknown_fas=fas))
+        return value
+
+    def _discard(self, state: EndgameState, card: int) -> float:
+        proposed = list(state.proposed)
+        proposed.remove(card)
+        return self._value(state._replace(phase=Phase.chancellorSelectPolicy.value, proposed=tuple(proposed)))
+
+    def _enact(self, state: EndgameState, card: int) -> float:
+        fas_policy = state.fas_policy + (card == FASCIST)
+        lib_policy = state.lib_policy + (card == LIBERAL)
+        if fas_policy == FAS_POLICY_WIN:
+            return FASCIST_WIN
+        if lib_policy == LIB_POLICY_WIN:
+            return LIBERAL_WIN
+        state = state._replace(fas_policy=fas_policy, lib_policy=lib_policy, chaos=0, chancellor=None,
+                               president_veto=True, proposed=())
+        if card == FASCIST and SECRET_HITLER_POWERS[self.num_players][fas_policy] != Power.none:
+            return self._value(state._replace(phase=Phase.presidentPower.value))
+        return self._value(state._replace(phase=Phase.nomination.value, president=self._next_president(state),
+                                          se_prev_pres=None))
+
+    def _veto(self, state: EndgameState, veto: bool) -> float:
+        if not veto:
+            return self._value(state._replace(phase=Phase.chancellorSelectPolicy.value, president_veto=False))
+        state = state._replace(chancellor=None, proposed=(), president=self._next_president(state), se_prev_pres=None)
+        if state.chaos + 1 >= CHAOS:
+            return self._chaos(state)
+        return self._value(state._replace(phase=Phase.nomination.value))
+
+    def _power(self, state: EndgameState, target: int = None) -> float:
+        """
+        Value of the president's power, for the given target or for the best one
+        """
+        power = SECRET_HITLER_POWERS[self.num_players][state.fas_policy]
+        if power == Power.deckpeek:
+            # a peek puts the cards back, only a reshuffle is revealed
+            president = self._next_president(state)
+            known, lib, fas = state.known_deck, state.unknown_lib, state.unknown_fas
+            if len(known) + lib + fas < 3:
+                known, lib, fas = (), NUM_LIB_POLICY - state.lib_policy, NUM_FAS_POLICY - state.fas_policy
+            return self._value(state._replace(phase=Phase.nomination.value, president=president, se_prev_pres=None,
+                                              known_deck=known, unknown_lib=lib, unknown_fas=fas))
+        if target is None:
+            return self._best(state.president, [self._power(state, p) for p in state.alive_players
+                                                if p != state.president])
+        if power == Power.bullet:
+            if self.roles[target] == SecretRole.hitler.value:
+                return LIBERAL_WIN
+            alive_players = tuple(p for p in state.alive_players if p != target)
+            prev_gov = state.prev_gov if len(state.alive_players) > 5 else (None, state.prev_gov[1])
+            return self._value(state._replace(phase=Phase.nomination.value, alive_players=alive_players,
+                                              president=self._next_president(state, alive_players), se_prev_pres=None,
+                                              prev_gov=prev_gov))
+        if power == Power.investigate:
+            # everything is known in a determinization, so an investigation only passes the presidency on
+            return self._value(state._replace(phase=Phase.nomination.value, president=self._next_president(state),
+                                              se_prev_pres=None))
+        if power == Power.specialelection:
+            return self._value(state._replace(phase=Phase.nomination.value, president=target,
+                                              se_prev_pres=state.president))
+        assert False, f'Invalid Presidential Power={power}'
+
+
+def search_endgame(solver: EndgameSolver, player: int, game_state: SecretHitlerState, possible_hidden_roles,
+                   legal_actions, deck_beliefs, president_pass):
+    """
+    Move with the best exact value averaged over up to solver.determinizations determinizations of the player's
+    information set, None as soon as one of them is too large to solve
+    """
+    totals, solved = np.zeros(len(legal_actions)), 0
+    for hidden_state in determinization_iterator(possible_hidden_roles, solver.determinizations, game_state,
+                                                 legal_actions, deck_beliefs, president_pass, player):
+        values = solver.action_values(game_state, hidden_state, player, legal_actions)
+        if values is None:
+            return None
+        totals += values
+        solved += 1
+    if solved == 0:
+        return None
+    logger.debug(f'endgame values over {solved} determinizations: {totals / solved}')
+    return legal_actions[int(np.argmax(totals))]
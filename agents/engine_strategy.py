@@ -0,0 +1,353 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from .agent import Agent
+from .mcts_common import DeadlineStopping, decision_key
+from .pondering import Ponderer
+from .strategy import Strategy
+from .random_strategy import RandomStrategy
+from secrethitler import SecretHitlerState, HiddenSecretHitlerState, PolicyDeck, Phase, Party, Power, SecretRole, \
+    VetoAction, SECRET_HITLER_POWERS, HITLER_ZONE
+
+logger = logging.getLogger(__name__)
+
+PHASES = {
+    'selectingChancellor': Phase.nomination,
+    'voting': Phase.vote,
+    'presidentSelectingPolicy': Phase.presidentSelectPolicy,
+    'chancellorSelectingPolicy': Phase.chancellorSelectPolicy,
+    'presidentVoteOnVeto': Phase.veto,
+    'execution': Phase.presidentPower,
+    'selectPartyMembershipInvestigate': Phase.presidentPower,
+    'specialElection': Phase.presidentPower,
+}
+POWERS = {
+    None: Power.none,
+    'investigate': Power.investigate,
+    'deckpeek': Power.deckpeek,
+    'election': Power.specialelection,
+    'bullet': Power.bullet,
+}
+ROLES = {'liberal': SecretRole.liberal, 'fascist': SecretRole.fascist, 'hitler': SecretRole.hitler}
+PARTIES = {'liberal': Party.liberal, 'fascist': Party.fascist}
+
+DEADLINE_FRACTION = 0.5  # of the time a timed table gives for a decision
+DEADLINE_GRACE = 2.0  # seconds a search may overrun its deadline before its decision is dropped
+
+
+class LiveGame:
+    """
+    Engine view of a live game, kept up to date from every GameUpdate the bot receives.
+
+    The public state is read off each update. What only the player knows (the roles it was shown, the policies it
+    was dealt or peeked and what follows from elections) is accumulated in an agent made by agent_factory, whose
+    beliefs the search agents use.
+    """
+    def __init__(self, username: str, agent_factory):
+        self.username = username
+        self.agent_factory = agent_factory
+        self.agent: Optional[Agent] = None
+        self.uid = None
+        self.seat = None
+        self.names = {}  # seat -> name status already applied to the beliefs
+        self.deck_size = None
+        self.veto_election = None  # election in which the president was asked to veto
+        self.hitler_checked = None  # election whose chancellor was found not to be Hitler
+        self.dealt = []  # policies the player holds as president
+
+    def observe(self, gameUpdate):
+        try:
+            gameState, general, players = gameUpdate.gameState, gameUpdate.general, gameUpdate.publicPlayersState
+            trackState = gameUpdate.trackState
+            if not gameState.isStarted:
+                return
+        except AttributeError:
+            return
+        if general.uid != self.uid:
+            self.__init__(self.username, self.agent_factory)
+            self.uid = general.uid
+        if self.agent is None and not self._start(gameUpdate, players):
+            return
+
+        self._observe_names(gameUpdate)
+        self._observe_deck(gameUpdate, gameState, trackState)
+        if gameState.phase == 'presidentVoteOnVeto':
+            self.veto_election = general.electionCount
+        if gameState.phase == 'presidentSelectingPolicy' and trackState.fascistPolicyCount >= HITLER_ZONE and \
+                self.hitler_checked != general.electionCount:
+            # the game would have ended had Hitler been elected chancellor
+            chancellor = self._government_seat(players, 'isChancellor')
+            if chancellor is not None:
+                self._filter(lambda roles: roles[chancellor] != SecretRole.hitler)
+                self.hitler_checked = general.electionCount
+        if gameState.phase not in ['chancellorSelectingPolicy', 'chancellorVoteOnVeto', 'presidentVoteOnVeto']:
+            self.agent.president_pass = []
+
+    def _start(self, gameUpdate, players) -> bool:
+        seats = [i for i, player in enumerate(players) if player.userName == self.username]
+        if not seats:
+            return False
+        self.seat = seats[0]
+        role = ROLES.get(self._name_status(gameUpdate, self.seat))
+        if role is None:
+            return False
+        self.agent = self.agent_factory(player_id=self.seat, num_players=len(players), secret_role=role)
+        return True
+
+    @staticmethod
+    def _name_status(gameUpdate, seat: int):
+        try:
+            return gameUpdate.playersState[seat].nameStatus
+        except (AttributeError, IndexError):
+            return None
+
+    def _filter(self, predicate):
+        beliefs = list(filter(predicate, self.agent.hidden_role_beliefs))
+        if beliefs:
+            self.agent.hidden_role_beliefs = beliefs
+        else:
+            logger.warning(f'{self.username} dropped an observation that contradicts every role assignment')
+
+    def _observe_names(self, gameUpdate):
+        knows_fascists = self.agent.secret_role == SecretRole.fascist or \
+            (self.agent.secret_role == SecretRole.hitler and len(gameUpdate.publicPlayersState) < 7)
+        for seat in range(len(gameUpdate.publicPlayersState)):
+            status = self._name_status(gameUpdate, seat)
+            if seat == self.seat or status not in ROLES or self.names.get(seat) == status:
+                continue
+            self.names[seat] = status
+            if status == 'hitler' or (status == 'fascist' and knows_fascists):
+                role = ROLES[status]
+                self._filter(lambda roles: roles[seat] == role)
+            else:
+                # an investigation result
+                party = PARTIES[status]
+                self._filter(lambda roles: roles[seat].party() == party)
+
+    def _observe_deck(self, gameUpdate, gameState, trackState):
+        deck_size = gameState.undrawnPolicyCount
+        if self.deck_size is not None and deck_size != self.deck_size:
+            drawn = self.deck_size - deck_size
+            self.agent.deck_knowledge = self.agent.deck_knowledge[drawn:] if drawn > 0 else []
+        self.deck_size = deck_size
+
+        cards = self.policies(gameUpdate)
+        if self._government_seat(gameUpdate.publicPlayersState, 'isPresident') == self.seat:
+            if gameState.phase == 'presidentSelectingPolicy' and len(cards) == 3:
+                self.dealt = cards
+            elif gameState.phase == 'enactPolicy' and len(cards) == 3 and self._power(gameUpdate) == Power.deckpeek:
+                self.agent.deck_knowledge = cards
+        if gameState.phase == 'chancellorSelectingPolicy' and len(cards) == 2 and \
+                self._government_seat(gameUpdate.publicPlayersState, 'isChancellor') == self.seat:
+            self.agent.president_pass = cards
+
+    def record_discard(self, discarded: Party):
+        """
+        Remembers the policies the player passed on as president
+        """
+        passed = list(self.dealt)
+        if discarded in passed:
+            passed.remove(discarded)
+            self.agent.president_pass = passed
+
+    @staticmethod
+    def policies(gameUpdate) -> List[Party]:
+        """
+        Policies shown to the player, in the order of the cards on the table
+        """
+        cards = []
+        for card in gameUpdate.cardFlingerState:
+            party = PARTIES.get(getattr(card.cardStatus, 'cardBack', None))
+            if party is not None:
+                cards.append(party)
+        return cards
+
+    @staticmethod
+    def _government_seat(players, status: str):
+        for seat, player in enumerate(players):
+            if getattr(player, 'governmentStatus', None) == status:
+                return seat
+        return None
+
+    @staticmethod
+    def _power(gameUpdate) -> Optional[Power]:
+        fascist_policies = gameUpdate.trackState.fascistPolicyCount
+        if fascist_policies == 0:
+            return Power.none
+        return POWERS.get(gameUpdate.customGameSettings.powers[fascist_policies - 1])
+
+    def state(self, gameUpdate) -> Optional[SecretHitlerState]:
+        """
+        Engine state of the update, None when the engine can not represent it
+        """
+        if self.agent is None:
+            return None
+        gameState, trackState = gameUpdate.gameState, gameUpdate.trackState
+        players = gameUpdate.publicPlayersState
+        num_players = len(players)
+        powers = [POWERS.get(power, power) for power in gameUpdate.customGameSettings.powers]
+        if powers != SECRET_HITLER_POWERS[num_players][1:]:
+            return None
+        phase = PHASES.get(gameState.phase)
+        if phase is None:
+            return None
+
+        alive_players = [seat for seat, player in enumerate(players) if not getattr(player, 'isDead', False)]
+        chancellor = None
+        if phase == Phase.vote:
+            chancellor = gameState.pendingChancellorIndex
+        elif phase in [Phase.presidentSelectPolicy, Phase.chancellorSelectPolicy, Phase.veto]:
+            chancellor = self._government_seat(players, 'isChancellor')
+        previous = getattr(gameState, 'previousElectedGovernment', None) or []
+        prev_gov = (previous[0] if len(alive_players) > 5 else None, previous[1]) if len(previous) == 2 else None
+        se_prev_pres = getattr(gameState, 'specialElectionFormerPresidentIndex', None)
+        se_prev_pres = se_prev_pres if isinstance(se_prev_pres, int) and se_prev_pres >= 0 else None
+        try:
+            return SecretHitlerState(starting_num_players=num_players, current_num_players=len(alive_players),
+                                     president=gameState.presidentIndex, chancellor=chancellor, phase=phase,
+                                     fas_policy=trackState.fascistPolicyCount, lib_policy=trackState.liberalPolicyCount,
+                                     chaos=trackState.electionTrackerCount, game_end=None, prev_gov=prev_gov,
+                                     alive_players=alive_players, se_prev_pres=se_prev_pres,
+                                     president_veto=self.veto_election != gameUpdate.general.electionCount,
+                                     game_end_reason=None, policy_deck_size=gameState.undrawnPolicyCount)
+        except AssertionError:
+            logger.warning(f'{self.username} can not represent the state of game {self.uid}')
+            return None
+
+    def legal_actions(self, state: SecretHitlerState, gameUpdate) -> List:
+        hidden_state = HiddenSecretHitlerState(hidden_roles=(), policy_deck=PolicyDeck([]), discard_pile=[],
+                                               proposed_policies=tuple(self.policies(gameUpdate)))
+        legal_actions = state.legal_actions(hidden_state, self.seat)
+        clickable = set(gameUpdate.gameState.clickActionInfo[1]) \
+            if state.phase in [Phase.nomination, Phase.presidentPower] and \
+            len(getattr(gameUpdate.gameState, 'clickActionInfo', [])) > 1 else None
+        if clickable:
+            # trust the table about which players can be picked
+            legal_actions = [action for action in legal_actions if action[0] in clickable] or legal_actions
+        return legal_actions
+
+
+def decide(agent: Agent, state: SecretHitlerState, legal_actions: List, seconds: float = None):
+    """
+    Move of agent, run in an executor. With seconds, its search stops when they have passed.
+    """
+    if seconds is not None:
+        agent.early_stop = DeadlineStopping(seconds)
+    return agent.get_action(state, legal_actions)
+
+
+class EngineStrategy(Strategy):
+    """
+    Strategy playing the moves of a search agent made by agent_factory.
+
+    Searches run in the executor, a process pool in production, with a deadline of DEADLINE_FRACTION of the
+    table's timed mode. Decisions the engine can not represent (custom powers, a dropped search) are made by
+    RandomStrategy. With ponder, the bot's votes on the nominations the president can make are searched in the
+    executor while the president decides.
+    """
+    def __init__(self, agent_factory, username: str, executor=None, name='engine', ponder=False):
+        super().__init__(name, executor)
+        self.game = LiveGame(username, agent_factory)
+        self.random = RandomStrategy(executor)
+        self.ponderer = Ponderer(executor) if ponder else None
+        self.veto = False
+
+    def observe(self, gameUpdate):
+        uid = self.game.uid
+        self.game.observe(gameUpdate)
+        if self.ponderer is None:
+            return
+        completed = hasattr(getattr(gameUpdate, 'gameState', None), 'isCompleted')
+        if self.game.uid != uid or completed:
+            self.ponderer.cancel()
+        if completed:
+            return
+        state = self.game.state(gameUpdate) if self.game.agent is not None else None
+        if state is not None and not state.is_terminal() and self.game.seat not in state.moving_players():
+            self.ponderer.ponder(self.game.agent, state)
+
+    def close(self):
+        if self.ponderer is not None:
+            self.ponderer.close()
+
+    def deadline(self) -> Optional[float]:
+        timed_mode = getattr(self.gameState.general, 'timedMode', None)
+        return DEADLINE_FRACTION * timed_mode if timed_mode else None
+
+    async def decide(self):
+        """
+        Engine move for the current update, None when the fallback has to decide
+        """
+        state = self.game.state(self.gameState)
+        if state is None or self.game.seat not in state.moving_players():
+            return None
+        legal_actions = self.game.legal_actions(state, self.gameState)
+        if len(legal_actions) == 1:
+            return legal_actions[0]
+        seconds = self.deadline()
+        timeout = None if seconds is None else seconds + DEADLINE_GRACE
+        try:
+            if self.ponderer is not None:
+                future = self.ponderer.take(decision_key(self.game.agent, state, legal_actions))
+                if future is not None:
+                    return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+            return await asyncio.wait_for(
+                self.compute(decide, self.game.agent, state, legal_actions, seconds), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'{self.game.username} dropped a search that overran its deadline of {seconds}s')
+            return None
+
+    async def fallback(self, decision: str):
+        self.random.gameState = self.gameState
+        return await getattr(self.random, decision)()
+
+    async def vote(self):
+        move = await self.decide()
+        return await self.fallback('vote') if move is None else move.ja
+
+    async def selectChancellor(self):
+        move = await self.decide()
+        return await self.fallback('selectChancellor') if move is None else move.chancellor
+
+    async def presidentSelectPolicy(self):
+        move = await self.decide()
+        if move is None:
+            return await self.fallback('presidentSelectPolicy')
+        self.game.record_discard(move.policy)
+        return self.game.policies(self.gameState).index(move.policy)
+
+    async def chancellorSelectPolicy(self):
+        move = await self.decide()
+        if move is None:
+            return await self.fallback('chancellorSelectPolicy')
+        cards = self.game.policies(self.gameState)
+        # the table asks for the veto after the policy, so a vetoing chancellor names a policy first
+        self.veto = isinstance(move, VetoAction)
+        policy = self.game.agent.party if self.veto else move.policy
+        return cards.index(policy) if policy in cards else 0
+
+    async def chancellorVoteOnVeto(self):
+        return self.veto
+
+    async def presidentVoteOnVeto(self):
+        move = await self.decide()
+        return await self.fallback('presidentVoteOnVeto') if move is None else move.veto
+
+    async def selectPlayerToExecute(self):
+        move = await self.decide()
+        return await self.fallback('selectPlayerToExecute') if move is None else move.player
+
+    async def selectPartyMembershipInvestigate(self):
+        move = await self.decide()
+        return await self.fallback('selectPartyMembershipInvestigate') if move is None else move.player
+
+    async def selectPartyMembershipInvestigateReverse(self):
+        return await self.fallback('selectPartyMembershipInvestigateReverse')
+
+    async def selectedSpecialElection(self):
+        move = await self.decide()
+        return await self.fallback('selectedSpecialElection') if move is None else move.player
+
+    async def selectedPresidentVoteOnBurn(self):
+        return await self.fallback('selectedPresidentVoteOnBurn')
@@ -0,0 +1,125 @@
+import json
+import time
+from collections import defaultdict
+from typing import Callable, Dict
+
+clock = time.perf_counter
+
+SEARCH_PHASES = ['selection', 'expansion', 'rollout', 'backpropagation']
+
+
+class SearchStats:
+    """
+    Counters collected by one root search.
+
+    determinizations counts every sample drawn and iterations the searches run on them, one per sample or one per
+    root action and sample for paired searches. The sampler only draws determinizations in which the searcher has
+    its observed legal actions, so none is wasted. PIMC expands nodes while selecting,
+    so its expansion time is reported as part of selection. unexpanded counts iterations that added no node
+    because the tree was over its memory budget.
+    """
+    def __init__(self, algorithm: str, searcher: int, phase, budget: int):
+        self.algorithm = algorithm
+        self.searcher = searcher
+        self.phase = phase
+        self.budget = budget
+        self.determinizations = 0
+        self.iterations = 0
+        self.nodes_created = 0
+        self.max_depth = 0
+        self.unexpanded = 0
+        self.bytes_used = 0
+        self.times = dict.fromkeys(SEARCH_PHASES, 0.0)
+        self.elapsed = 0.0
+        self.root_visits = {}
+        self._start = clock()
+
+    def add_time(self, phase: str, start: float) -> float:
+        """
+        Adds the time since start to phase and returns the current time
+        """
+        now = clock()
+        self.times[phase] += now - start
+        return now
+
+    def finish(self, nodes_created: int, root_visits: Dict, bytes_used: int = 0):
+        self.elapsed = clock() - self._start
+        self.nodes_created = nodes_created
+        self.bytes_used = bytes_used
+        self.root_visits = {str(action): int(visits) for action, visits in root_visits.items()}
+        return self
+
+    @property
+    def bytes_per_node(self) -> float:
+        return self.bytes_used / (self.nodes_created + 1)
+
+    def to_dict(self) -> Dict:
+        return {
+            'algorithm': self.algorithm,
+            'searcher': self.searcher,
+            'phase': self.phase.name,
+            'budget': self.budget,
+            'determinizations': self.determinizations,
+            'iterations': self.iterations,
+            'nodes_created': self.nodes_created,
+            'max_depth': self.max_depth,
+            'unexpanded': self.unexpanded,
+            'bytes_used': self.bytes_used,
+            'bytes_per_node': self.bytes_per_node,
+            'times': self.times,
+            'elapsed': self.elapsed,
+            'root_visits': self.root_visits,
+        }
+
+
+class StatsSink:
+    """
+    Base class for destinations of SearchStats
+    """
+    def record(self, stats: SearchStats):
+        raise NotImplementedError
+
+
+class CallbackSink(StatsSink):
+    """
+    Passes the stats of each search to a function
+    """
+    def __init__(self, callback: Callable[[SearchStats], None]):
+        self.callback = callback
+
+    def record(self, stats: SearchStats):
+        self.callback(stats)
+
+
+class JSONLinesSink(StatsSink):
+    """
+    Appends the stats of each search as one JSON object per line
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def record(self, stats: SearchStats):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(stats.to_dict()) + '\n')
+
+
+class HistogramSink(StatsSink):
+    """
+    Keeps every numeric counter in memory, grouped by algorithm and phase
+    """
+    def __init__(self):
+        self.values = defaultdict(lambda: defaultdict(list))
+
+    def record(self, stats: SearchStats):
+        values = self.values[f'{stats.algorithm}:{stats.phase.name}']
+        for field in ['determinizations', 'iterations', 'nodes_created', 'max_depth', 'unexpanded',
+                      'bytes_used', 'bytes_per_node', 'elapsed']:
+            values[field].append(getattr(stats, field))
+        for phase, seconds in stats.times.items():
+            values[f'{phase}_time'].append(seconds)
+
+    def summary(self) -> Dict:
+        return {
+            key: {field: {'count': len(v), 'mean': sum(v) / len(v), 'max': max(v)} for field, v in values.items()}
+            for key, values in self.values.items()
+        }
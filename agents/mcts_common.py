@@ -1,13 +1,17 @@
 import logging
+import math
 import numpy as np
 import random
+import time
+from contextlib import contextmanager
+from statistics import NormalDist
 from typing import List, Tuple, Any
-from collections import deque
+from collections import deque, OrderedDict
 
 from itertools import combinations_with_replacement
 
 from secrethitler import SecretHitlerState, HiddenSecretHitlerState, PolicyDeck, POSSIBLE_DECKS, Party, \
-    Phase, DECK_SIZE, PolicyChoiceAction
+    Phase, DECK_SIZE, PolicyChoiceAction, SECRET_HITLER_PLAYER_COUNT
 
 logger = logging.getLogger(__name__)
 
@@ -39,15 +43,26 @@ def _possible_discard_piles(other_policies: int) -> List[List[Party]]:
     return list(filter(lambda deck: len(deck) == discard_length, POSSIBLE_DECKS))
 
 
-def determinization_iterator(possible_hidden_roles: List, num_iterations, state: SecretHitlerState, legal_actions, top_cards, president_pass):
+def determinization_iterator(possible_hidden_roles: List, num_iterations, state: SecretHitlerState, legal_actions,
+                             top_cards, president_pass, player: int = None):
+    """
+    Yields num_iterations hidden states consistent with what the searcher knows. With player, every hidden state
+    also gives player exactly legal_actions, so no sample has to be rejected by the search.
+    """
     draw_piles = _possible_draw_piles(state.policy_deck_size, top_cards)
     discard_piles = _possible_discard_piles(other_policies=state.policy_deck_size + _proposal_size(state.phase) +
                                             state.fas_policy + state.lib_policy)
 
     possible_proposals = _possible_proposals(state.phase, legal_actions, president_pass)
+    if player is not None:
+        # the legal actions of a player only depend on the hidden state through the proposed policies
+        possible_proposals = [proposal for proposal in possible_proposals if state.legal_actions(
+            HiddenSecretHitlerState(hidden_roles=(), policy_deck=PolicyDeck([]), discard_pile=[],
+                                    proposed_policies=proposal), player) == legal_actions]
 
     i = 0
     while i < num_iterations:
+        start = i
         random.shuffle(draw_piles)
         for draw_pile in draw_piles:
             random.shuffle(discard_piles)
@@ -64,20 +79,290 @@ def determinization_iterator(possible_hidden_roles: List, num_iterations, state:
                             yield HiddenSecretHitlerState(hidden_roles=hidden_role, policy_deck=draw_pile,
                                                           discard_pile=discard_pile, proposed_policies=proposal)
                             i += 1
+        if i == start:
+            logger.warning(f'no hidden state is consistent with the information set in {state}')
+            return
 
 
-def random_choice(values, p=None):
-    return values[np.random.choice(range(len(values)), p=p)]
+def reward_range(num_players: int) -> float:
+    """
+    Returns the width of the interval containing every player's terminal value
+    """
+    num_lib, num_fas = SECRET_HITLER_PLAYER_COUNT[num_players]
+    return 2 * max(1.0, float(num_lib) / num_fas)
+
+
+EXPANSION_RESERVE = 0.25  # share of a memory budget only spent on leaves visited more than the average node
+
+
+def expansion_threshold(tree_bytes: int, memory_budget: int, visit_counts: np.ndarray) -> float:
+    """
+    Returns the visits a leaf needs to be expanded under a memory_budget in bytes, given the visit counts of the
+    nodes. Leaves are expanded freely until the tree fills all but EXPANSION_RESERVE of the budget. The rest of it
+    goes to leaves visited at least as often as the average node, and no leaf is expanded past the budget.
+    """
+    if memory_budget is None or tree_bytes <= (1 - EXPANSION_RESERVE) * memory_budget:
+        return 0
+    if tree_bytes > memory_budget:
+        return math.inf
+    return visit_counts.mean()
+
+
+class EarlyStopping:
+    """
+    Early termination rule for a root search.
+
+    Every check_every iterations the root statistics are tested. The search stops when
+    1. the most visited root action leads the runner up by more visits than there are iterations left, or
+    2. the Hoeffding lower bound on its mean reward (failure probability delta) is above the upper bound
+       of every other root action.
+    """
+    def __init__(self, check_every=100, min_iterations=100, delta=0.01):
+        self.check_every = check_every
+        self.min_iterations = min_iterations
+        self.delta = delta
+        self.last_report = None
+
+    def should_check(self, iterations: int) -> bool:
+        return iterations >= self.min_iterations and iterations % self.check_every == 0
+
+    def can_stop(self, visit_counts, remaining: int, total_rewards=None, value_range=2.0) -> bool:
+        """
+        visit_counts and total_rewards are indexed by root action, unexpanded actions have a count of 0
+        """
+        visit_counts = np.asarray(visit_counts, dtype=np.float64)
+        if len(visit_counts) < 2:
+            return True
+        order = np.argsort(visit_counts)
+        best, runner_up = order[-1], order[-2]
+        if visit_counts[best] - visit_counts[runner_up] > remaining:
+            return True
+
+        if total_rewards is None or visit_counts.min() == 0:
+            return False
+        means = np.asarray(total_rewards) / visit_counts
+        radius = value_range * np.sqrt(math.log(2 * len(visit_counts) / self.delta) / (2 * visit_counts))
+        others = np.delete(means + radius, best)
+        return means[best] - radius[best] > others.max()
+
+    def can_stop_paired(self, paired_rewards: np.ndarray, value_range=2.0) -> bool:
+        """
+        Stopping rule for searches with common random numbers, where row i holds the reward of every root action
+        on determinization i. The differences between the best action and each other one are paired by
+        determinization, and the search stops when a normal confidence bound on every mean difference
+        (failure probability delta overall) is above 0.
+        """
+        num_samples, num_actions = paired_rewards.shape
+        if num_actions < 2:
+            return True
+        if num_samples < 2:
+            return False
+        best = int(np.argmax(paired_rewards.mean(axis=0)))
+        differences = np.delete(paired_rewards[:, [best]] - paired_rewards, best, axis=1)
+        z = NormalDist().inv_cdf(1 - self.delta / (num_actions - 1))
+        radius = z * differences.std(axis=0, ddof=1) / math.sqrt(num_samples)
+        return bool(np.all(differences.mean(axis=0) - radius > 0))
+
+    def report(self, iterations: int, num_iterations: int, elapsed: float):
+        """
+        Records how much of the iteration budget was skipped and the time this saved
+        """
+        saved = elapsed / iterations * (num_iterations - iterations) if iterations > 0 else 0.0
+        self.last_report = {'iterations': iterations, 'budget': num_iterations, 'elapsed': elapsed, 'time_saved': saved}
+        if iterations < num_iterations:
+            logger.info(f'search stopped early after {iterations}/{num_iterations} iterations, saved {saved:.2f}s')
+        return self.last_report
+
+
+class GapStopping(EarlyStopping):
+    """
+    Early termination rule for a search planned to take planned iterations out of a larger budget.
+
+    The search stops before planned iterations like with EarlyStopping. From planned iterations on it stops
+    unless the mean rewards of the two best root actions are within close_gap times the reward range of each
+    other, so only close decisions use the rest of the budget.
+    """
+    def __init__(self, planned: int, close_gap=0.05, check_every=50, delta=0.01):
+        super().__init__(check_every=check_every, min_iterations=check_every, delta=delta)
+        self.planned = planned
+        self.close_gap = close_gap
+        self.iterations = 0
+
+    def should_check(self, iterations: int) -> bool:
+        self.iterations = iterations
+        return super().should_check(iterations)
+
+    def can_stop(self, visit_counts, remaining: int, total_rewards=None, value_range=2.0) -> bool:
+        if super().can_stop(visit_counts, remaining, total_rewards, value_range):
+            return True
+        if self.iterations < self.planned:
+            return False
+        if total_rewards is None:
+            return True
+        visit_counts = np.asarray(visit_counts, dtype=np.float64)
+        visited = visit_counts > 0
+        return self._clear_gap(np.asarray(total_rewards)[visited] / visit_counts[visited], value_range)
+
+    def can_stop_paired(self, paired_rewards: np.ndarray, value_range=2.0) -> bool:
+        if super().can_stop_paired(paired_rewards, value_range):
+            return True
+        if paired_rewards.size < self.planned:
+            return False
+        return self._clear_gap(paired_rewards.mean(axis=0), value_range)
+
+    def _clear_gap(self, means: np.ndarray, value_range: float) -> bool:
+        if len(means) < 2:
+            return True
+        runner_up, best = np.sort(means)[-2:]
+        return best - runner_up >= self.close_gap * value_range
+
+
+class DeadlineStopping(EarlyStopping):
+    """
+    EarlyStopping that also stops the search once seconds have passed since the rule was made
+    """
+    def __init__(self, seconds: float, check_every=10, min_iterations=10, delta=0.01):
+        super().__init__(check_every=check_every, min_iterations=min_iterations, delta=delta)
+        self.deadline = time.monotonic() + seconds
 
+    def can_stop(self, visit_counts, remaining: int, total_rewards=None, value_range=2.0) -> bool:
+        return time.monotonic() >= self.deadline or super().can_stop(visit_counts, remaining, total_rewards,
+                                                                      value_range)
 
-def simulate(game_state, hidden_state):
-    while not game_state.is_terminal():
-        moves = tuple([
-            random_choice(game_state.legal_actions(hidden_state, player))
-            for player in game_state.moving_players()
-        ])
-        game_state, hidden_state, _ = game_state.transition(moves=moves, hidden_state=hidden_state)
-    return game_state.terminal_value(hidden_state)
+    def can_stop_paired(self, paired_rewards: np.ndarray, value_range=2.0) -> bool:
+        return time.monotonic() >= self.deadline or super().can_stop_paired(paired_rewards, value_range)
+
+
+class IterationAllocator:
+    """
+    Iteration budget of one agent for one game.
+
+    A decision is planned base_iterations, scaled by the weight of its phase and by log2 of its number of distinct
+    legal actions, and its search may go on to max_extension times that while the best root actions stay close
+    (see GapStopping). Searches are capped by what is left of game_budget, but never get fewer than
+    min_iterations. Iterations a search does not use stay available to later decisions.
+    """
+    PHASE_WEIGHTS = {
+        Phase.nomination: 1.0,
+        Phase.vote: 0.5,
+        Phase.presidentSelectPolicy: 0.5,
+        Phase.chancellorSelectPolicy: 0.5,
+        Phase.veto: 0.5,
+        Phase.presidentPower: 1.5,
+    }
+
+    def __init__(self, base_iterations=1000, game_budget: int = None, phase_weights=None, max_extension=2.0,
+                 close_gap=0.05, min_iterations=50, check_every=50, delta=0.01):
+        self.base_iterations = base_iterations
+        self.game_budget = game_budget
+        self.phase_weights = self.PHASE_WEIGHTS if phase_weights is None else phase_weights
+        self.max_extension = max_extension
+        self.close_gap = close_gap
+        self.min_iterations = min_iterations
+        self.check_every = check_every
+        self.delta = delta
+        self.spent = 0
+
+    @property
+    def remaining(self):
+        return None if self.game_budget is None else max(0, self.game_budget - self.spent)
+
+    def allocate(self, phase: Phase, legal_actions) -> Tuple[int, GapStopping]:
+        """
+        Returns the iteration budget of a search and the stopping rule that spends it
+        """
+        num_actions = len(set(legal_actions))
+        planned = self.base_iterations * self.phase_weights.get(phase, 1.0) * math.log2(max(2, num_actions))
+        budget = planned * self.max_extension
+        if self.game_budget is not None:
+            budget = min(budget, max(self.remaining, self.min_iterations))
+        budget = max(int(budget), self.min_iterations)
+        planned = min(max(int(planned), self.min_iterations), budget)
+        return budget, GapStopping(planned, self.close_gap, self.check_every, self.delta)
+
+    def spend(self, iterations: int):
+        self.spent += iterations
+
+
+def information_set_key(game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState, observer: int) -> int:
+    """
+    Compact hash of the public state together with what observer privately sees of the hidden state
+    """
+    sees_proposal = game_state.phase in [Phase.presidentSelectPolicy, Phase.chancellorSelectPolicy, Phase.veto] \
+        and observer in [game_state.president, game_state.chancellor]
+    return hash((hash(game_state), tuple(hidden_state.proposed_policies) if sees_proposal else ()))
+
+
+class DecisionCache:
+    """
+    Bounded LRU cache of root search results, keyed by decision_key.
+
+    Each entry holds the root visit count of every searcher action. With sample, a hit draws a move in proportion
+    to the cached visits instead of replaying the most visited one, so that repeated positions keep a mixed play.
+    A cache may be shared by agents of the same kind, the agent name is part of the key.
+    """
+    def __init__(self, max_entries=10000, sample=False):
+        assert max_entries > 0, 'decision cache needs room for at least one entry'
+        self.max_entries = max_entries
+        self.sample = sample
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the cached move for key, None on a miss
+        """
+        root_visits = self.entries.get(key)
+        if root_visits is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        actions, visits = list(root_visits), np.fromiter(root_visits.values(), dtype=np.float64)
+        if self.sample and visits.sum() > 0:
+            return random_choice(actions, p=visits / visits.sum())
+        return actions[int(np.argmax(visits))]
+
+    def put(self, key, root_visits: dict):
+        self.entries[key] = root_visits
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def decision_key(agent, state: SecretHitlerState, legal_actions) -> Tuple:
+    """
+    Everything an agent's search depends on: the public state, who is searching with which role, the belief set
+    in canonical form and the private knowledge of the deck and of the president's pass. The legal actions carry
+    the policies in hand.
+    """
+    return (agent.name, agent.player_id, agent.secret_role, state, frozenset(map(tuple, agent.hidden_role_beliefs)),
+            tuple(agent.deck_knowledge), tuple(agent.president_pass), tuple(legal_actions))
+
+
+@contextmanager
+def common_random_numbers(seed: int):
+    """
+    Runs the block on the random and numpy.random global generators seeded with seed and restores their states
+    afterwards. Blocks run with the same seed draw the same random numbers, so that root actions evaluated on one
+    determinization see the same deck shuffles, opponent moves and rollout noise.
+    """
+    random_state, numpy_state = random.getstate(), np.random.get_state()
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        yield
+    finally:
+        random.setstate(random_state)
+        np.random.set_state(numpy_state)
+
+
+def random_choice(values, p=None):
+    return values[np.random.choice(range(len(values)), p=p)]
 
 
 if __name__ == "__main__":
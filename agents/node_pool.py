@@ -0,0 +1,368 @@
+import math
+import itertools
+import numpy as np
+from typing import Dict, Hashable, List, Tuple
+
+
+def action_key(action: Hashable) -> Hashable:
+    """
+    Dict key of an action, a tuple of actions or a tuple of those. Actions are namedtuples which compare
+    equal to other actions with equal fields, e.g. VoteAction(ja=True) == NominateChancellorAction(chancellor=1),
+    so their type is part of the key.
+    """
+    if type(action) is tuple:
+        return tuple(map(action_key, action))
+    return type(action), action
+
+
+class ActionTable:
+    """
+    Interns hashable actions into dense integer ids so they can index NumPy arrays.
+    """
+    def __init__(self):
+        self.actions = []
+        self.ids = {}
+
+    def id(self, action: Hashable) -> int:
+        key = action_key(action)
+        action_id = self.ids.get(key)
+        if action_id is None:
+            action_id = len(self.actions)
+            self.ids[key] = action_id
+            self.actions.append(action)
+        return action_id
+
+    def get(self, action: Hashable) -> int:
+        """
+        Returns the id of an interned action or None
+        """
+        return self.ids.get(action_key(action))
+
+    def __getitem__(self, action_id: int):
+        return self.actions[action_id]
+
+    def __len__(self):
+        return len(self.actions)
+
+
+class ArrayStore:
+    """
+    Struct-of-arrays storage. Every field is a NumPy array indexed by row id, grown geometrically.
+
+    Subclasses declare FIELDS as a map from field name to (dtype, fill value).
+    """
+    FIELDS: Dict[str, Tuple[type, float]] = {}
+
+    def __init__(self, capacity=256):
+        self.size = 0
+        self.capacity = capacity
+        for name, (dtype, fill) in self.FIELDS.items():
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+
+    def allocate(self, n=1) -> int:
+        """
+        Reserves n consecutive rows and returns the id of the first one
+        """
+        start = self.size
+        if start + n > self.capacity:
+            self._grow(max(2 * self.capacity, start + n))
+        self.size += n
+        return start
+
+    def _grow(self, capacity):
+        for name, (dtype, fill) in self.FIELDS.items():
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def array_nbytes(self) -> int:
+        return sum(getattr(self, name)[:self.size].nbytes for name in self.FIELDS)
+
+    def __getstate__(self):
+        # only the used part of each array is pickled
+        state = self.__dict__.copy()
+        for name in self.FIELDS:
+            state[name] = getattr(self, name)[:self.size].copy()
+        state['capacity'] = self.size
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.capacity == 0:
+            self._grow(1)
+
+
+class ISMCTSNodePool(ArrayStore):
+    """
+    Node store for SO-ISMCTS trees.
+
+    Node 0 is the root. Edges are kept in a single dictionary keyed by (parent id, joint action id)
+    and siblings are linked through first_child/next_sibling so no per-node containers are allocated.
+    EXP3 sums are only allocated for nodes where several players move simultaneously, together with
+    a cache of the EXP3 probabilities that is invalidated whenever the sums or the visit count change.
+    """
+    ROOT = 0
+    FIELDS = {
+        'parent': (np.int32, -1),
+        'incoming_edge': (np.int32, -1),   # joint action id
+        'first_child': (np.int32, -1),
+        'next_sibling': (np.int32, -1),
+        'visit_count': (np.int32, 0),
+        'availability_count': (np.int32, 0),
+        'total_reward': (np.float64, 0.0),
+        'exp3_row': (np.int32, -1),
+    }
+
+    def __init__(self, num_players, capacity=256):
+        super().__init__(capacity)
+        self.num_players = num_players
+        self.joint_actions = ActionTable()  # tuples of moves, one per moving player
+        self.moves = ActionTable()  # individual moves of simultaneous nodes
+        self.edges = {}  # (parent id, joint action id) -> child id
+        self.compatible_cache = {}  # legal actions per moving player -> (joint actions, joint action ids)
+        self.move_ids_cache = {}  # legal actions of one player -> (key, move ids)
+        self.exp3_sum = np.zeros((0, num_players, 2))
+        self.exp3_seen = np.zeros((0, num_players, 2), dtype=bool)
+        self.exp3_probs = np.zeros((0, num_players, 2))
+        self.exp3_stamp = np.zeros((0, num_players, 2), dtype=np.int32)  # (visit count, legal actions key)
+        self.num_exp3_rows = 0
+        self.allocate()  # root
+
+    def add_child(self, parent: int, joint_action: Tuple) -> int:
+        action_id = self.joint_actions.id(joint_action)
+        node = self.allocate()
+        self.parent[node] = parent
+        self.incoming_edge[node] = action_id
+        self.next_sibling[node] = self.first_child[parent]
+        self.first_child[parent] = node
+        self.edges[(int(parent), action_id)] = node
+        return node
+
+    def link_child(self, parent: int, joint_action: Tuple, node: int):
+        """
+        Adds an edge to an existing node. The node keeps its original parent and sibling links.
+        """
+        self.edges[(int(parent), self.joint_actions.id(joint_action))] = node
+
+    def child(self, parent: int, joint_action: Tuple) -> int:
+        """
+        Returns the child reached by joint_action or -1 if it has not been expanded
+        """
+        action_id = self.joint_actions.get(joint_action)
+        if action_id is None:
+            return -1
+        return self.edges.get((parent, action_id), -1)
+
+    def children(self, node: int) -> List[int]:
+        children = []
+        child = self.first_child[node]
+        while child != -1:
+            children.append(int(child))
+            child = self.next_sibling[child]
+        return children
+
+    def edge_action(self, node: int) -> Tuple:
+        return self.joint_actions[self.incoming_edge[node]]
+
+    def compatible(self, legal_actions: Tuple[Tuple, ...]) -> Tuple[List[Tuple], List[int]]:
+        """
+        Returns every joint action for the given legal actions of each moving player and their ids.
+
+        The cartesian product is only built once per distinct set of legal actions, which matters for
+        votes where it has 2^players entries.
+        """
+        key = action_key(legal_actions)
+        cached = self.compatible_cache.get(key)
+        if cached is None:
+            joint_actions = list(itertools.product(*legal_actions))
+            cached = joint_actions, [self.joint_actions.id(moves) for moves in joint_actions]
+            self.compatible_cache[key] = cached
+        return cached
+
+    def move_ids(self, legal_actions: Tuple) -> Tuple[int, np.ndarray]:
+        """
+        Returns a key identifying the legal actions of one player and their move ids
+        """
+        key = action_key(legal_actions)
+        cached = self.move_ids_cache.get(key)
+        if cached is None:
+            cached = len(self.move_ids_cache), np.array([self.move_id(move) for move in legal_actions], dtype=np.int32)
+            self.move_ids_cache[key] = cached
+        return cached
+
+    def move_id(self, move) -> int:
+        move_id = self.moves.id(move)
+        if move_id >= self.exp3_sum.shape[2]:
+            self._grow_exp3(rows=len(self.exp3_sum), width=2 * self.exp3_sum.shape[2])
+        return move_id
+
+    def exp3(self, node: int) -> int:
+        """
+        Returns the EXP3 row of a node, allocating one on first use
+        """
+        row = self.exp3_row[node]
+        if row == -1:
+            row = self.num_exp3_rows
+            if row == len(self.exp3_sum):
+                self._grow_exp3(rows=max(16, 2 * row), width=self.exp3_sum.shape[2])
+            self.exp3_row[node] = row
+            self.num_exp3_rows += 1
+        return row
+
+    def exp3_probabilities(self, node: int, player: int, legal_actions: Tuple) -> np.ndarray:
+        """
+        Returns the EXP3 probabilities of the legal actions of player at node in O(K).
+
+        p_i = gamma / K + (1 - gamma) * softmax(eta * exp3_sum)_i, with the softmax taken through a
+        log-sum-exp. Results are cached until the sums or the visit count of the node change.
+        """
+        key, move_ids = self.move_ids(legal_actions)
+        row = self.exp3(node)
+        n = self.visit_count[node]
+        stamp = self.exp3_stamp[row, player]
+        K = len(move_ids)
+        if stamp[0] == n and stamp[1] == key:
+            return self.exp3_probs[row, player, :K]
+
+        if n == 0:
+            gamma = 1.0
+        else:
+            gamma = min(1.0, math.sqrt(K * math.log(K) / (n * (math.e - 1))))
+        eta = gamma / K
+        self.exp3_seen[row, player, move_ids] = True
+        x = eta * self.exp3_sum[row, player, move_ids]
+        x -= x.max()
+        log_sum_exp = math.log(np.exp(x).sum())
+        probs = gamma / K + (1.0 - gamma) * np.exp(x - log_sum_exp)
+
+        self.exp3_probs[row, player, :K] = probs
+        stamp[0], stamp[1] = n, key
+        return self.exp3_probs[row, player, :K]
+
+    def add_exp3_reward(self, row: int, player: int, move_id: int, reward: float):
+        self.exp3_sum[row, player, move_id] += reward
+        self.exp3_stamp[row, player, 0] = -1
+
+    def _grow_exp3(self, rows, width):
+        old_rows, _, old_width = self.exp3_sum.shape
+        for name, dtype, fill in [('exp3_sum', np.float64, 0), ('exp3_seen', bool, False),
+                                  ('exp3_probs', np.float64, 0), ('exp3_stamp', np.int32, -1)]:
+            old = getattr(self, name)
+            new = np.full((rows, self.num_players, width if name != 'exp3_stamp' else 2), fill, dtype=dtype)
+            new[:old_rows, :, :old.shape[2]] = old
+            setattr(self, name, new)
+
+    def nbytes(self) -> int:
+        """
+        Approximate memory held by the tree, including the edge dictionary
+        """
+        used_exp3 = sum(self.num_exp3_rows * getattr(self, name)[0:1].nbytes
+                        for name in ['exp3_sum', 'exp3_seen', 'exp3_probs', 'exp3_stamp'])
+        # a dict entry plus a key tuple of two small ints costs roughly 150 bytes
+        return self.array_nbytes() + used_exp3 + 150 * len(self.edges)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        for name in ['exp3_sum', 'exp3_seen', 'exp3_probs', 'exp3_stamp']:
+            state[name] = getattr(self, name)[:self.num_exp3_rows].copy()
+        return state
+
+
+class TranspositionTable:
+    """
+    Maps information set keys to SO-ISMCTS nodes so that paths reaching the same information set share
+    statistics. Holds at most max_entries nodes; when full, the half with the fewest visits is forgotten.
+    Forgotten nodes stay in the tree, they only stop being shared.
+    """
+    def __init__(self, max_entries=100000):
+        assert max_entries > 1, 'transposition table needs room for at least two entries'
+        self.max_entries = max_entries
+        self.nodes = {}
+
+    def get(self, key: int) -> int:
+        return self.nodes.get(key, -1)
+
+    def put(self, key: int, node: int, visit_count: np.ndarray):
+        if len(self.nodes) >= self.max_entries:
+            self._evict(visit_count)
+        self.nodes[key] = node
+
+    def _evict(self, visit_count: np.ndarray):
+        keys = list(self.nodes)
+        nodes = np.fromiter(self.nodes.values(), dtype=np.int64, count=len(keys))
+        half = len(keys) // 2
+        keep = np.argpartition(visit_count[nodes], half)[half:]
+        self.nodes = {keys[i]: int(nodes[i]) for i in keep}
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+class EdgeSlots(ArrayStore):
+    """
+    Per-action statistics of PIMC nodes
+    """
+    FIELDS = {
+        'action_id': (np.int32, -1),
+        'choose_counts': (np.int32, 0),
+        'total_payoffs': (np.float64, 0.0),
+    }
+
+
+class PIMCNodePool(ArrayStore):
+    """
+    Node store for PIMC trees.
+
+    Each non-terminal node owns a contiguous block of edge slots, one per legal action of the searching
+    player, holding the choose counts and total payoffs of that action. Node 0 is the root.
+    """
+    ROOT = 0
+    FIELDS = {
+        'parent': (np.int32, -1),
+        'incoming_slot': (np.int32, -1),  # edge slot in the parent
+        'is_terminal': (np.bool_, False),
+        'terminal_value': (np.float64, 0.0),
+        'total_choices': (np.int32, 0),
+        'slot_offset': (np.int32, 0),
+        'num_slots': (np.int32, 0),
+    }
+
+    def __init__(self, legal_actions, capacity=256):
+        super().__init__(capacity)
+        self.actions = ActionTable()
+        self.slots = EdgeSlots(capacity=4 * capacity)
+        self.edges = {}  # (parent slot, state hash, hidden state hash) -> child id
+        self.add_node(parent=-1, slot=-1, legal_actions=legal_actions, is_terminal=False)
+
+    def add_node(self, parent: int, slot: int, legal_actions, is_terminal: bool, terminal_value=0.0) -> int:
+        node = self.allocate()
+        self.parent[node] = parent
+        self.incoming_slot[node] = slot
+        self.is_terminal[node] = is_terminal
+        if is_terminal:
+            self.terminal_value[node] = terminal_value
+        else:
+            legal_actions = list(dict.fromkeys(legal_actions))  # duplicate policies share statistics
+            offset = self.slots.allocate(len(legal_actions))
+            self.slot_offset[node] = offset
+            self.num_slots[node] = len(legal_actions)
+            self.slots.action_id[offset:offset + len(legal_actions)] = [self.actions.id(a) for a in legal_actions]
+        return node
+
+    def node_slots(self, node: int) -> slice:
+        offset = self.slot_offset[node]
+        return slice(offset, offset + self.num_slots[node])
+
+    def legal_actions(self, node: int) -> List:
+        return [self.actions[a] for a in self.slots.action_id[self.node_slots(node)]]
+
+    def slot(self, node: int, action) -> int:
+        ids = self.slots.action_id[self.node_slots(node)]
+        return int(self.slot_offset[node]) + int(np.flatnonzero(ids == self.actions.get(action))[0])
+
+    def nbytes(self) -> int:
+        # a dict entry plus a key tuple of three ints costs roughly 200 bytes
+        return self.array_nbytes() + self.slots.array_nbytes() + 200 * len(self.edges)
+
@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import random
+import numpy as np
+from collections import Counter
+from typing import List, Dict, Tuple
+
+from .random_agent import RandomAgent
+from secrethitler import SecretHitlerState, HiddenSecretHitlerState, SecretRole, PolicyDeck, POSSIBLE_DECKS, \
+    DECK_SIZE, SECRET_HITLER_POSSIBLE_ROLES
+
+logger = logging.getLogger(__name__)
+
+MAX_ACTIONS = 10  # a player never has more legal actions than there are other players
+BOOK_DTYPE = np.dtype([('key', '<u8'), ('visits', '<f4', (MAX_ACTIONS,))])
+
+
+def _plain(value):
+    """
+    Enums replaced by their values, so that keys do not depend on the per-process hash of enum members
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_plain(v) for v in value)
+    return getattr(value, 'value', value)
+
+
+def book_key(state: SecretHitlerState, player: int, secret_role: SecretRole, hidden_role_beliefs, deck_knowledge,
+             president_pass, legal_actions) -> int:
+    """
+    64 bit key of an information set that is stable across processes
+    """
+    public = (state.starting_num_players, state.president, state.chancellor, state.phase.value, state.fas_policy,
+              state.lib_policy, state.chaos, state.prev_gov, state.president_veto, state.se_prev_pres,
+              tuple(state.alive_players), state.policy_deck_size)
+    private = (player, secret_role.value, tuple(sorted(_plain(roles) for roles in hidden_role_beliefs)),
+               _plain(deck_knowledge), _plain(president_pass),
+               tuple((type(action).__name__, _plain(tuple(action))) for action in legal_actions))
+    digest = hashlib.blake2b(repr((public, private)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def agent_book_key(agent, state: SecretHitlerState, legal_actions) -> int:
+    return book_key(state, agent.player_id, agent.secret_role, agent.hidden_role_beliefs, agent.deck_knowledge,
+                    agent.president_pass, legal_actions)
+
+
+class OpeningBook:
+    """
+    Read-only book of root visit counts, memory-mapped from a file written by save_book.
+
+    The visits of an entry are aligned with the legal actions the key was built from.
+    """
+    def __init__(self, path: str):
+        self.entries = np.load(path, mmap_mode='r')
+        self.keys = self.entries['key']
+
+    def visits(self, key: int):
+        index = int(np.searchsorted(self.keys, np.uint64(key)))
+        if index == len(self.keys) or self.keys[index] != key:
+            return None
+        return self.entries['visits'][index]
+
+    def lookup(self, agent, state: SecretHitlerState, legal_actions):
+        """
+        The most visited action of the agent's information set, None when the book does not hold it
+        """
+        visits = self.visits(agent_book_key(agent, state, legal_actions))
+        if visits is None:
+            return None
+        return legal_actions[int(np.argmax(visits[:len(legal_actions)]))]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def save_book(path: str, entries: Dict[int, List[float]]):
+    book = np.zeros(len(entries), dtype=BOOK_DTYPE)
+    for i, (key, visits) in enumerate(sorted(entries.items())):
+        book[i]['key'] = key
+        book[i]['visits'][:len(visits)] = visits
+    np.save(path, book)
+
+
+class _InformationSetCounter:
+    """
+    How often each information set was met, with the arguments needed to search it
+    """
+    def __init__(self):
+        self.counts = Counter()
+        self.searches = {}
+
+    def record(self, agent, state: SecretHitlerState, legal_actions):
+        key = agent_book_key(agent, state, legal_actions)
+        self.counts[agent.secret_role, key] += 1
+        if key not in self.searches:
+            self.searches[key] = (state, agent.player_id, list(agent.hidden_role_beliefs), list(agent.deck_knowledge),
+                                  list(agent.president_pass), legal_actions)
+
+    def most_frequent(self, role: SecretRole, n: int) -> List[Tuple]:
+        by_role = [(count, key) for (r, key), count in self.counts.items() if r == role]
+        return [self.searches[key] for _, key in sorted(by_role, reverse=True)[:n]]
+
+
+class _RecordingAgent(RandomAgent):
+    """
+    RandomAgent that records the decisions it is asked for
+    """
+    def __init__(self, player_id: int, num_players: int, secret_role: SecretRole, counter: _InformationSetCounter):
+        super().__init__(player_id, num_players, secret_role)
+        self.counter = counter
+
+    def get_action(self, state, legal_actions):
+        if len(legal_actions) > 1:
+            self.counter.record(self, state, legal_actions)
+        return super().get_action(state, legal_actions)
+
+
+def frequent_information_sets(num_players: int, num_games: int, positions_per_role: int,
+                              max_enacted: int) -> List[Tuple]:
+    """
+    The information sets met most often in the first decisions of random games
+    """
+    counter = _InformationSetCounter()
+    for _ in range(num_games):
+        roles = random.choice(SECRET_HITLER_POSSIBLE_ROLES[num_players])
+        deck = PolicyDeck(random.choice([d for d in POSSIBLE_DECKS if len(d) == DECK_SIZE]))
+        hidden_state = HiddenSecretHitlerState(hidden_roles=roles, policy_deck=deck, discard_pile=[],
+                                               proposed_policies=())
+        agents = [_RecordingAgent(i, num_players, roles[i], counter) for i in range(num_players)]
+        for agent in agents:
+            if (num_players < 7 and agent.secret_role == SecretRole.hitler) or agent.secret_role == SecretRole.fascist:
+                agent.communicate_hidden_state(hidden_role=roles)
+        state = SecretHitlerState.start_state(num_players=num_players)
+        # like battlefield.run_game, but only as far as the book reaches
+        while not state.is_terminal() and state.fas_policy + state.lib_policy < max_enacted:
+            moving_players = state.moving_players()
+            moves = [agents[player].get_action(state, state.legal_actions(hidden_state=hidden_state, player=player))
+                     for player in moving_players]
+            new_state, new_hidden_state, observation = state.transition(moves=moves, hidden_state=hidden_state)
+            for player in moving_players:
+                agents[player].handle_observation(observation)
+            for agent in agents:
+                agent.handle_transition(old_state=state, new_state=new_state, old_hidden_state=hidden_state,
+                                        new_hidden_state=new_hidden_state, moves=moves)
+            state, hidden_state = new_state, new_hidden_state
+
+    return [search for role in SecretRole for search in counter.most_frequent(role, positions_per_role)]
+
+
+def build_book(player_counts: List[int], num_games: int, positions_per_role: int, iterations: int,
+               max_enacted: int = 1) -> Dict[int, List[float]]:
+    from .soismcts_agent import search_ismcts, root_visit_distribution
+    entries = {}
+    for num_players in player_counts:
+        information_sets = frequent_information_sets(num_players, num_games, positions_per_role, max_enacted)
+        logger.info(f'searching {len(information_sets)} information sets for {num_players} players')
+        for state, player, beliefs, deck_knowledge, president_pass, legal_actions in information_sets:
+            _, tree = search_ismcts(player, state, beliefs, iterations, legal_actions, deck_knowledge,
+                                    president_pass)
+            visits = root_visit_distribution(tree, state.moving_players().index(player))
+            role = beliefs[0][player]
+            key = book_key(state, player, role, beliefs, deck_knowledge, president_pass, legal_actions)
+            entries[key] = [visits.get(action, 0) for action in legal_actions]
+    return entries
+
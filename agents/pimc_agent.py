@@ -1,9 +1,19 @@
+import functools
 import logging
+import random
+import time
 import numpy as np
 from typing import Tuple
-from tqdm import tqdm
 from . import Agent
-from .mcts_common import determinization_iterator
+from .mcts_common import determinization_iterator, reward_range, EarlyStopping, DecisionCache, decision_key, \
+    common_random_numbers, IterationAllocator
+from .node_pool import PIMCNodePool
+from .batch_rollout import simulate_batch
+from .opening_book import OpeningBook
+from .endgame_solver import EndgameSolver, search_endgame
+from .pondering import Ponderer
+from .rollout_policy import RolloutPolicy, rollout_values
+from .instrumentation import SearchStats, StatsSink, clock
 from secrethitler import SecretHitlerState, SecretRole, HiddenSecretHitlerState
 OPPONENT_TREMBLE = 0.1
 
@@ -30,44 +40,23 @@ def select_opponent_move(state, hidden_state: HiddenSecretHitlerState, player, n
     return moves[np.random.choice(len(moves), p=probs)]
 
 
-class Node:
-    def __init__(self, legal_actions, incoming_edge, parent, is_terminal, terminal_value=None):
-        self.parent = parent
-        self.incoming_edge = incoming_edge
-        self.is_terminal = is_terminal
-        if self.is_terminal:
-            self.terminal_value = terminal_value
-        else:
-            self.choose_counts = {action: 0 for action in legal_actions}
-            self.total_payoffs = {action: 0.0 for action in legal_actions}
-            self.legal_actions = legal_actions
-            self.children = {}
-            self.total_choices = 0
-
-    def select_move(self):
-        ucb_cur_max = -float('inf')
-        best_move = None
-        unseen_moves = []
-        for move in self.legal_actions:
-            choose_count = self.choose_counts[move]
-            if choose_count == 0:
-                unseen_moves.append(move)
-                continue
-            ucb_val = self.total_payoffs[move] / self.choose_counts[move] + \
-                (2*np.log(self.total_choices)/self.choose_counts[move])**0.5
-            if ucb_val > ucb_cur_max:
-                ucb_cur_max = ucb_val
-                best_move = move
-        if len(unseen_moves) != 0:
-            return unseen_moves[np.random.choice(len(unseen_moves))]
-        return best_move
-
-    def __str__(self):
-        return '<Node ' + ' '.join(f'{k}={v}' for k, v in sorted(self.__dict__.items())) + '>'
-
-
-def next_node(node: Node, state: SecretHitlerState, hidden_state: HiddenSecretHitlerState, player: int, move)\
-        -> Tuple[Node, SecretHitlerState, HiddenSecretHitlerState, bool]:
+def select_move(tree: PIMCNodePool, node: int):
+    slots = tree.node_slots(node)
+    choose_counts = tree.slots.choose_counts[slots]
+    unseen_moves = np.flatnonzero(choose_counts == 0)
+    if len(unseen_moves) != 0:
+        return tree.actions[tree.slots.action_id[slots.start + unseen_moves[np.random.choice(len(unseen_moves))]]]
+    ucb_vals = tree.slots.total_payoffs[slots] / choose_counts + \
+        (2*np.log(tree.total_choices[node])/choose_counts)**0.5
+    return tree.actions[tree.slots.action_id[slots.start + int(np.argmax(ucb_vals))]]
+
+
+def next_node(tree: PIMCNodePool, node: int, state: SecretHitlerState, hidden_state: HiddenSecretHitlerState,
+              player: int, move, expand=True) -> Tuple[int, SecretHitlerState, HiddenSecretHitlerState, bool]:
+    """
+    Plays move and the opponents' moves up to the next decision of player. Returns the node reached,
+    which is -1 when it is not in the tree and expand is False.
+    """
     moves = [move if p == player else select_opponent_move(state=state, player=p, hidden_state=hidden_state)
              for p in state.moving_players()]
     state, hidden_state, _ = state.transition(moves=moves, hidden_state=hidden_state)
@@ -75,40 +64,67 @@ def next_node(node: Node, state: SecretHitlerState, hidden_state: HiddenSecretHi
         moves = [select_opponent_move(state=state, player=p, hidden_state=hidden_state) for p in state.moving_players()]
         state, hidden_state, _ = state.transition(moves=moves, hidden_state=hidden_state)
 
-    key = (move, hash(state), hash(hidden_state))
-    if key in node.children:
-        return node.children[key], state, hidden_state, False
+    slot = tree.slot(node, move)
+    key = (slot, hash(state), hash(hidden_state))
+    child = tree.edges.get(key)
+    if child is not None:
+        return child, state, hidden_state, False
+    if not expand:
+        return -1, state, hidden_state, False
 
     is_terminal = state.is_terminal()
     legal_actions = None if is_terminal else state.legal_actions(player=player, hidden_state=hidden_state)
     terminal_value = state.terminal_value(hidden_state)[player] if is_terminal else None
-    new_node = Node(legal_actions, key, node, is_terminal, terminal_value)
-    node.children[key] = new_node
+    new_node = tree.add_node(node, slot, legal_actions, is_terminal, terminal_value)
+    tree.edges[key] = new_node
     return new_node, state, hidden_state, True
 
 
-def find_leaf_and_payoff(node, state, hidden_state: HiddenSecretHitlerState, player, node_value_func):
-    if node.is_terminal:
+def find_leaf_and_payoff(tree: PIMCNodePool, node: int, state, hidden_state: HiddenSecretHitlerState, player,
+                         node_value_func, expand=True, move=None):
+    """
+    Descends from node to a leaf, playing move at node when it is given, and returns the leaf and its payoff
+    """
+    if tree.is_terminal[node]:
         assert state.is_terminal(), "Terminal node not terminal"
-        return node, node.terminal_value
+        return node, tree.terminal_value[node]
 
-    move = node.select_move()
-    new_node, next_state, next_hidden_state, is_new = next_node(node, state, hidden_state, player, move)
+    move = select_move(tree, node) if move is None else move
+    new_node, next_state, next_hidden_state, is_new = next_node(tree, node, state, hidden_state, player, move, expand)
     if is_new:
         payoff = node_value_func(state, hidden_state, player)
         return new_node, payoff
-
-    return find_leaf_and_payoff(new_node, next_state, next_hidden_state, player, node_value_func)
-
-
-def search_and_backprop(node, state, hidden_state: HiddenSecretHitlerState, player, node_value_func):
-    node, payoff = find_leaf_and_payoff(node, state, hidden_state, player, node_value_func)
-    while node.parent is not None:
-        parent_action, _, _ = node.incoming_edge
-        node.parent.total_choices += 1
-        node.parent.choose_counts[parent_action] += 1
-        node.parent.total_payoffs[parent_action] += payoff
-        node = node.parent
+    if new_node == -1:
+        # no node to backpropagate from, so the edge to the missing child is credited here
+        payoff = node_value_func(next_state, next_hidden_state, player)
+        slot = tree.slot(node, move)
+        tree.total_choices[node] += 1
+        tree.slots.choose_counts[slot] += 1
+        tree.slots.total_payoffs[slot] += payoff
+        return node, payoff
+
+    return find_leaf_and_payoff(tree, new_node, next_state, next_hidden_state, player, node_value_func, expand)
+
+
+def backpropagate(tree: PIMCNodePool, node: int, payoff) -> int:
+    """
+    Adds payoff to every edge between node and the root and returns the depth of node
+    """
+    depth = 0
+    while tree.parent[node] != -1:
+        parent, slot = tree.parent[node], tree.incoming_slot[node]
+        tree.total_choices[parent] += 1
+        tree.slots.choose_counts[slot] += 1
+        tree.slots.total_payoffs[slot] += payoff
+        node = parent
+        depth += 1
+    return depth
+
+
+def search_and_backprop(tree: PIMCNodePool, node: int, state, hidden_state: HiddenSecretHitlerState, player,
+                        node_value_func):
+    node, payoff = find_leaf_and_payoff(tree, node, state, hidden_state, player, node_value_func)
+    return backpropagate(tree, node, payoff)
 
 
 NUM_PLAYOUTS = 1
@@ -123,28 +139,195 @@ def playout_value_func(root_state, root_hidden_state: HiddenSecretHitlerState, p
             moves = [select_opponent_move(state=state, player=p, hidden_state=hidden_state) for p in state.moving_players()]
             state, hidden_state, _ = state.transition(moves=moves, hidden_state=hidden_state)
         total_payoff += state.terminal_value(hidden_state)[player]
-    return total_payoff
-
-
-def search_mcts(state, player, hidden_roles, node_value_func, legal_actions, num_searches, deck_belief, president_pass):
-    root = Node(legal_actions, None, None, is_terminal=False)
-    for hidden_state in tqdm(determinization_iterator(hidden_roles, num_searches, state, legal_actions, deck_belief, president_pass),
-                             desc='Searching', total=num_searches, disable=None, leave=False):
-        if state.legal_actions(player=player, hidden_state=hidden_state) == legal_actions:
-            search_and_backprop(root, state, hidden_state, player, node_value_func)
-    return root.select_move()
+    return total_payoff / NUM_PLAYOUTS
+
+
+def policy_value(policy: RolloutPolicy, num_playouts: int, root_state, root_hidden_state: HiddenSecretHitlerState,
+                 player):
+    return rollout_values(root_state, root_hidden_state, policy, num_playouts)[player]
+
+
+def policy_value_func(policy: RolloutPolicy, num_playouts: int = NUM_PLAYOUTS):
+    """
+    Node value function averaging the payoffs of num_playouts rollouts played by policy, so that leaves are valued
+    on the scale of a single terminal value whatever num_playouts is. It is a partial rather than a closure so that
+    searches using it can be sent to worker processes.
+    """
+    return functools.partial(policy_value, policy, num_playouts)
+
+
+def batch_playout_value(num_playouts: int, root_state, root_hidden_state: HiddenSecretHitlerState, player):
+    return simulate_batch(root_state, root_hidden_state, num_playouts)[player]
+
+
+def batch_playout_value_func(num_playouts: int):
+    """
+    Node value function averaging num_playouts playouts run at once by the batch rollout engine. The opponents
+    of PIMC playouts move uniformly, as in the engine.
+    """
+    return functools.partial(batch_playout_value, num_playouts)
+
+
+def root_visits(tree: PIMCNodePool) -> dict:
+    root_slots = tree.node_slots(PIMCNodePool.ROOT)
+    return dict(zip(tree.legal_actions(PIMCNodePool.ROOT), tree.slots.choose_counts[root_slots].tolist()))
+
+
+def search_mcts(state, player, hidden_roles, node_value_func, legal_actions, num_searches, deck_belief, president_pass,
+                early_stop: EarlyStopping = None, stats_sink: StatsSink = None, memory_budget: int = None,
+                endgame_solver: EndgameSolver = None, paired: bool = False):
+    """
+    Searches for the move of player. With a memory_budget in bytes, no node is added once the tree holds
+    that much memory and the search keeps refining the statistics of the existing nodes.
+    With an endgame_solver, leaves it can solve are valued exactly instead of by node_value_func. Every leaf is
+    valued on the scale of one terminal value, the one of the reward range the early stopping rules are given.
+    With paired, every determinization is searched once through each root move on common random numbers,
+    so num_searches // len(root moves) determinizations are drawn and the root comparisons are paired.
+    """
+    tree = PIMCNodePool(legal_actions)
+    root_slots = tree.node_slots(PIMCNodePool.ROOT)
+    root_moves = tree.legal_actions(PIMCNodePool.ROOT) if paired else [None]
+    num_determinizations = max(1, num_searches // len(root_moves))
+    paired_payoffs = []
+    value_range = reward_range(state.starting_num_players)
+    stats = SearchStats('PIMC', player, state.phase, num_searches)
+    start = time.time()
+
+    def timed_value_func(leaf_state, leaf_hidden_state, leaf_player):
+        t = clock()
+        payoff = None
+        if endgame_solver is not None and endgame_solver.applicable(leaf_state):
+            values = endgame_solver.values(leaf_state, leaf_hidden_state)
+            payoff = None if values is None else values[leaf_player]
+        if payoff is None:
+            payoff = node_value_func(leaf_state, leaf_hidden_state, leaf_player)
+        stats.add_time('rollout', t)
+        return payoff
+
+    def iterate(hidden_state, move):
+        stats.iterations += 1
+        rollout_time = stats.times['rollout']
+        t = clock()
+        # nodes are expanded while selecting, so expansion time is counted as selection
+        expand = memory_budget is None or tree.nbytes() <= memory_budget
+        stats.unexpanded += not expand
+        node, payoff = find_leaf_and_payoff(tree, PIMCNodePool.ROOT, state, hidden_state, player, timed_value_func,
+                                            expand, move)
+        t = stats.add_time('selection', t)
+        stats.times['selection'] -= stats.times['rollout'] - rollout_time
+        stats.max_depth = max(stats.max_depth, backpropagate(tree, node, payoff))
+        stats.add_time('backpropagation', t)
+        return payoff
+
+    for hidden_state in determinization_iterator(hidden_roles, num_determinizations, state, legal_actions,
+                                                 deck_belief, president_pass, player):
+        stats.determinizations += 1
+        if paired:
+            seed = random.getrandbits(32)
+            payoffs = []
+            for move in root_moves:
+                with common_random_numbers(seed):
+                    payoffs.append(iterate(hidden_state, move))
+            paired_payoffs.append(payoffs)
+        else:
+            iterate(hidden_state, None)
+
+        if early_stop is None or not early_stop.should_check(stats.determinizations):
+            continue
+        if paired:
+            if early_stop.can_stop_paired(np.array(paired_payoffs), value_range):
+                break
+        elif early_stop.can_stop(tree.slots.choose_counts[root_slots],
+                                 remaining=num_searches - stats.determinizations,
+                                 total_rewards=tree.slots.total_payoffs[root_slots], value_range=value_range):
+            break
+
+    if early_stop is not None:
+        # reported in iterations, of which paired searches run one per root move and determinization
+        early_stop.report(stats.determinizations * len(root_moves), num_determinizations * len(root_moves),
+                          time.time() - start)
+    logger.debug(f'PIMC searched {stats.iterations} iterations of a budget of {num_searches}')
+    if stats_sink is not None:
+        stats_sink.record(stats.finish(tree.size - 1, root_visits(tree), tree.nbytes()))
+    return select_move(tree, PIMCNodePool.ROOT), tree
 
 
 class PIMCAgentBase(Agent):
-    def __init__(self, player_id: int, num_players: int, secret_role: SecretRole, iterations=1000, name='PIMC Agent'):
+    def __init__(self, player_id: int, num_players: int, secret_role: SecretRole, iterations=1000, name='PIMC Agent',
+                 early_stop: EarlyStopping = None, stats_sink: StatsSink = None, rollout_policy: RolloutPolicy = None,
+                 memory_budget: int = None, decision_cache: DecisionCache = None, opening_book: OpeningBook = None,
+                 endgame_solver: EndgameSolver = None, paired: bool = False, allocator: IterationAllocator = None,
+                 ponderer: Ponderer = None, num_playouts: int = NUM_PLAYOUTS):
         super().__init__(player_id, name, secret_role, num_players)
         self.iterations = iterations
+        self.paired = paired
+        self.allocator = allocator
+        if rollout_policy is not None:
+            self.node_value_func = policy_value_func(rollout_policy, num_playouts)
+        elif num_playouts > NUM_PLAYOUTS:
+            self.node_value_func = batch_playout_value_func(num_playouts)
+        else:
+            self.node_value_func = playout_value_func
+        self.early_stop = early_stop
+        self.stats_sink = stats_sink
+        self.memory_budget = memory_budget
+        self.decision_cache = decision_cache
+        self.opening_book = opening_book
+        self.endgame_solver = endgame_solver
+        self.ponderer = ponderer
+
+    def search_call(self, state, legal_actions, iterations=None, early_stop=None, stats_sink=None):
+        """
+        search_mcts and its arguments for a decision, so that the search can also run in a worker process
+        """
+        return search_mcts, (state, self.player_id, self.hidden_role_beliefs, self.node_value_func, legal_actions,
+                             self.iterations if iterations is None else iterations, self.deck_knowledge,
+                             self.president_pass, self.early_stop if early_stop is None else early_stop, stats_sink,
+                             self.memory_budget, self.endgame_solver, self.paired)
+
+    def ponder(self, state):
+        if self.ponderer is not None:
+            self.ponderer.ponder(self, state)
+
+    def close(self):
+        if self.ponderer is not None:
+            self.ponderer.close()
 
     def get_action(self, state, legal_actions):
         if len(legal_actions) == 1:
             return legal_actions[0]
-        move = search_mcts(state, self.player_id, self.hidden_role_beliefs, playout_value_func, legal_actions,
-                           self.iterations, self.deck_knowledge, self.president_pass)
+        if self.opening_book is not None:
+            move = self.opening_book.lookup(self, state, legal_actions)
+            if move is not None:
+                logger.info(f'{self.name}:{self.player_id} has chosen book {move}')
+                return move
+        if self.decision_cache is not None:
+            key = decision_key(self, state, legal_actions)
+            move = self.decision_cache.get(key)
+            if move is not None:
+                logger.info(f'{self.name}:{self.player_id} has chosen cached {move}')
+                return move
+        if self.endgame_solver is not None and self.endgame_solver.applicable(state):
+            move = search_endgame(self.endgame_solver, self.player_id, state, self.hidden_role_beliefs,
+                                  legal_actions, self.deck_knowledge, self.president_pass)
+            if move is not None:
+                logger.info(f'{self.name}:{self.player_id} has chosen solved {move}')
+                return move
+        if self.ponderer is not None:
+            move = self.ponderer.result(decision_key(self, state, legal_actions))
+            if move is not None:
+                logger.info(f'{self.name}:{self.player_id} has chosen pondered {move}')
+                return move
+        iterations, early_stop = self.iterations, self.early_stop
+        if self.allocator is not None:
+            iterations, early_stop = self.allocator.allocate(state.phase, legal_actions)
+        search, args = self.search_call(state, legal_actions, iterations, early_stop, self.stats_sink)
+        move, tree = search(*args)
+        if self.allocator is not None:
+            self.allocator.spend(early_stop.last_report['iterations'])
+        if self.decision_cache is not None:
+            # paired searches visit every root move equally, so only the chosen one is cached
+            self.decision_cache.put(key, {move: 1} if self.paired else root_visits(tree))
         logger.info(f'{self.name}:{self.player_id} has chosen {move}')
         return move
 
@@ -157,3 +340,8 @@ class PIMCAgent100(PIMCAgentBase):
 class PIMCAgent10000(PIMCAgentBase):
     def __init__(self, player_id: int, num_players: int, secret_role: SecretRole):
         super().__init__(player_id, num_players, secret_role, 10000, 'PIMC-10000 Agent')
+
+
+class PIMCAgentBatch(PIMCAgentBase):
+    def __init__(self, player_id: int, num_players: int, secret_role: SecretRole):
+        super().__init__(player_id, num_players, secret_role, 1000, 'PIMC-Batch Agent', num_playouts=32)
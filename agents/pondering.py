@@ -0,0 +1,135 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from typing import List, Tuple
+
+import numpy as np
+
+from .mcts_common import decision_key
+from .rollout_policy import DEFAULT_HEURISTIC_TABLE, knows_fascists
+from secrethitler import SecretHitlerState, Phase, FAS_ROLES
+
+logger = logging.getLogger(__name__)
+
+
+def best_move(search, args):
+    """
+    Move of a search function returning (move, tree), run in a worker process so that only the move is sent back
+    """
+    return search(*args)[0]
+
+
+def nomination_probabilities(state: SecretHitlerState, hidden_role_beliefs, table=DEFAULT_HEURISTIC_TABLE):
+    """
+    Nominations the president can make and their probabilities, the president nominating by the weights of table
+    under each role assignment of hidden_role_beliefs, as in TablePolicy
+    """
+    nominations = state.legal_actions(hidden_state=None, player=state.president)
+    if len(hidden_role_beliefs) == 0:
+        return nominations, np.full(len(nominations), 1 / len(nominations))
+    probs = np.zeros(len(nominations))
+    for roles in hidden_role_beliefs:
+        weights = table.get((Phase.nomination, roles[state.president]), {})
+        informed = knows_fascists(roles[state.president], state.starting_num_players)
+        nomination_weights = np.array([
+            weights.get(('nominate_ally' if roles[n.chancellor] in FAS_ROLES else 'nominate_opponent')
+                        if informed else 'nominate_unknown', 1.0)
+            for n in nominations
+        ])
+        probs += nomination_weights / nomination_weights.sum()
+    return nominations, probs / len(hidden_role_beliefs)
+
+
+def predict_decisions(player: int, state: SecretHitlerState, hidden_role_beliefs=()) \
+        -> List[Tuple[SecretHitlerState, List]]:
+    """
+    Decisions of player that may follow state while other players move, with their legal actions, the most likely
+    first.
+
+    While the president nominates, every alive player is about to vote on one of the nominations the president can
+    make, ranked by nomination_probabilities under player's hidden_role_beliefs. Other decision points depend on
+    hidden policies and are not predicted.
+    """
+    if state.is_terminal() or state.phase != Phase.nomination or player == state.president or \
+            player not in state.alive_players:
+        return []
+    nominations, probs = nomination_probabilities(state, hidden_role_beliefs)
+    predictions = []
+    for i in np.argsort(-probs, kind='stable'):
+        vote_state = state.nominate_chancellor_transition(nominations[i].chancellor)
+        predictions.append((vote_state, vote_state.legal_actions(hidden_state=None, player=player)))
+    return predictions
+
+
+class Ponderer:
+    """
+    Speculative searches of an agent's upcoming decisions, run in the executor while other players move.
+
+    ponder submits a search per predicted decision, the most likely first, at most workers of them, the number of
+    searches the executor runs for this agent at once, so that none waits in its queue. When the agent has to decide, take hands over the
+    prediction of its decision_key if it is already running or finished and cancels the others. A shared executor
+    is left running by close, one created by the ponderer is shut down.
+    """
+    def __init__(self, executor=None, workers=1):
+        self.owns_executor = executor is None
+        self.executor = ProcessPoolExecutor(max_workers=workers) if executor is None else executor
+        self.workers = workers
+        self.predictions = {}  # decision key -> future of the move
+        self.hits = 0
+        self.misses = 0
+
+    def ponder(self, agent, state: SecretHitlerState):
+        """
+        Searches the decisions agent may face after state. Predictions already submitted for them are kept.
+        """
+        keys = {}
+        for predicted_state, legal_actions in predict_decisions(agent.player_id, state, agent.hidden_role_beliefs):
+            if len(keys) == self.workers:
+                break
+            if len(legal_actions) > 1:
+                keys[decision_key(agent, predicted_state, legal_actions)] = (predicted_state, legal_actions)
+        self.cancel(keep=keys)
+        for key, (predicted_state, legal_actions) in keys.items():
+            if key not in self.predictions:
+                search, args = agent.search_call(predicted_state, legal_actions)
+                self.predictions[key] = self.executor.submit(best_move, search, args)
+
+    def take(self, key):
+        """
+        Future of the move of the decision with key, None when it was not predicted or its search has not started.
+        Every other prediction is cancelled.
+        """
+        future = self.predictions.pop(key, None)
+        self.cancel()
+        if future is None or not (future.running() or future.done()) or future.cancelled():
+            if future is not None:
+                future.cancel()
+            self.misses += 1
+            return None
+        self.hits += 1
+        return future
+
+    def result(self, key):
+        """
+        Move of the decision with key, waiting for its search to finish, None when it was not predicted
+        """
+        future = self.take(key)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except CancelledError:
+            return None
+        except Exception:
+            logger.exception('speculative search failed')
+            return None
+
+    def cancel(self, keep=()):
+        for key in list(self.predictions):
+            if key not in keep:
+                self.predictions.pop(key).cancel()
+
+    def close(self):
+        self.cancel()
+        if self.owns_executor:
+            # a running search can not be cancelled, its worker exits once it is done
+            self.executor.shutdown(wait=False)
@@ -1,62 +1,62 @@
 import random
-import time
 
-def delay(func):
-    def wrapper(*args, **kwargs):
-        time.sleep(random.randint(1, 3))
-        return func(*args, **kwargs)
-    return wrapper
+from .strategy import Strategy, delay
 
-class RandomStrategy:
-    def __init__(self):
-        self.name = 'random'
-        self.gameState = None
 
-    @delay
-    def vote(self):
+class RandomStrategy(Strategy):
+    def __init__(self, executor=None):
+        super().__init__('random', executor)
+
+    def randomVote(self):
         return random.randint(0, 1) == 1
 
-    @delay
-    def selectPlayer(self):
+    def randomPlayer(self):
         return self.gameState.gameState.clickActionInfo[1][random.randint(0, len(self.gameState.gameState.clickActionInfo[1])-1)]
 
     @delay
-    def selectChancellor(self):
-        return self.selectPlayer()
+    async def vote(self):
+        return self.randomVote()
+
+    @delay
+    async def selectPlayer(self):
+        return self.randomPlayer()
+
+    @delay
+    async def selectChancellor(self):
+        return self.randomPlayer()
 
     @delay
-    def presidentSelectPolicy(self):
+    async def presidentSelectPolicy(self):
         return random.randint(0, 2)
 
     @delay
-    def chancellorSelectPolicy(self):
+    async def chancellorSelectPolicy(self):
         return random.randint(0, 1)
 
     @delay
-    def selectPlayerToExecute(self):
-        return self.selectPlayer()
+    async def selectPlayerToExecute(self):
+        return self.randomPlayer()
 
     @delay
-    def chancellorVoteOnVeto(self):
-        return self.vote()
+    async def chancellorVoteOnVeto(self):
+        return self.randomVote()
 
     @delay
-    def presidentVoteOnVeto(self):
-        return self.vote()
+    async def presidentVoteOnVeto(self):
+        return self.randomVote()
 
     @delay
-    def selectPartyMembershipInvestigate(self):
-        return self.selectPlayer()
+    async def selectPartyMembershipInvestigate(self):
+        return self.randomPlayer()
 
     @delay
-    def selectPartyMembershipInvestigateReverse(self):
-        return self.selectPlayer()
+    async def selectPartyMembershipInvestigateReverse(self):
+        return self.randomPlayer()
 
     @delay
-    def selectedSpecialElection(self):
-        return self.selectPlayer()
+    async def selectedSpecialElection(self):
+        return self.randomPlayer()
 
     @delay
-    def selectedPresidentVoteOnBurn(self):
-        return self.vote()
-
+    async def selectedPresidentVoteOnBurn(self):
+        return self.randomVote()
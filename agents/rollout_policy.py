@@ -0,0 +1,228 @@
+import logging
+import random
+import time
+import numpy as np
+from typing import Dict, Tuple, List
+
+from .selfish_agent import selfish_choice
+from .batch_rollout import simulate_batch
+from .endgame_solver import EndgameSolver
+from secrethitler import SecretHitlerState, HiddenSecretHitlerState, Phase, SecretRole, Party, PolicyChoiceAction, \
+    VoteAction, VetoAction, NominateChancellorAction, PolicyDeck, POSSIBLE_DECKS, DECK_SIZE, FAS_ROLES, \
+    SECRET_HITLER_POSSIBLE_ROLES
+
+logger = logging.getLogger(__name__)
+
+
+class RolloutPolicy:
+    """
+    Move selection for every player during rollouts, without any agent objects.
+
+    batch_selfish tells whether the batch rollout engine can play the policy: False for uniform moves,
+    True for selfish policy choices and None when the engine can not play it.
+    """
+    name = 'rollout'
+    batch_selfish = None
+
+    def choose(self, game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState, player: int, legal_actions):
+        raise NotImplementedError
+
+
+class UniformPolicy(RolloutPolicy):
+    """
+    Uniformly random legal moves, like RandomAgent
+    """
+    name = 'uniform'
+    batch_selfish = False
+
+    def choose(self, game_state, hidden_state, player, legal_actions):
+        return random.choice(legal_actions)
+
+
+class SelfishPolicy(RolloutPolicy):
+    """
+    Policy choices in favour of the player's own party and uniformly random moves otherwise, like SelfishAgent
+    """
+    name = 'selfish'
+    batch_selfish = True
+
+    def choose(self, game_state, hidden_state, player, legal_actions):
+        move = selfish_choice(game_state.phase, hidden_state.hidden_roles[player].party(), legal_actions)
+        return random.choice(legal_actions) if move is None else move
+
+
+def knows_fascists(role: SecretRole, num_players: int) -> bool:
+    return role == SecretRole.fascist or (role == SecretRole.hitler and num_players < 7)
+
+
+def action_feature(game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState, player: int, action) -> str:
+    """
+    Name of what action means to player, the key looked up in a TablePolicy table.
+
+    Targets and governments are only told apart as ally or opponent when player knows the fascists.
+    """
+    role = hidden_state.hidden_roles[player]
+    informed = knows_fascists(role, game_state.starting_num_players)
+
+    def side(other: int) -> str:
+        if not informed:
+            return 'unknown'
+        return 'ally' if hidden_state.hidden_roles[other] in FAS_ROLES else 'opponent'
+
+    if isinstance(action, PolicyChoiceAction):
+        own = action.policy == role.party()
+        if game_state.phase == Phase.presidentSelectPolicy:
+            return 'discard_own' if own else 'discard_other'
+        return 'enact_own' if own else 'enact_other'
+    if isinstance(action, VoteAction):
+        return f'{"ja" if action.ja else "nein"}_{side(game_state.chancellor)}'
+    if isinstance(action, VetoAction):
+        return 'veto' if action.veto else 'no_veto'
+    if isinstance(action, NominateChancellorAction):
+        return f'nominate_{side(action.chancellor)}'
+    if hasattr(action, 'player'):
+        return f'target_{side(action.player)}'
+    return 'other'
+
+
+def _default_table() -> Dict[Tuple[Phase, SecretRole], Dict[str, float]]:
+    policy_weights = {
+        Phase.presidentSelectPolicy: {'discard_other': 9.0, 'discard_own': 1.0},
+        Phase.chancellorSelectPolicy: {'enact_own': 9.0, 'enact_other': 1.0, 'veto': 1.0},
+    }
+    fascist_weights = {
+        Phase.nomination: {'nominate_ally': 3.0, 'nominate_opponent': 1.0},
+        Phase.vote: {'ja_ally': 4.0, 'nein_ally': 1.0, 'ja_opponent': 1.0, 'nein_opponent': 2.0},
+        Phase.presidentPower: {'target_ally': 0.1, 'target_opponent': 1.0},
+    }
+    table = {}
+    for role in SecretRole:
+        for phase, weights in policy_weights.items():
+            table[phase, role] = weights
+        if role in FAS_ROLES:
+            for phase, weights in fascist_weights.items():
+                table[phase, role] = weights
+    return table
+
+
+DEFAULT_HEURISTIC_TABLE = _default_table()
+
+
+class TablePolicy(RolloutPolicy):
+    """
+    Moves sampled in proportion to weights looked up by (phase, secret role) and action_feature.
+    Features missing from the table get weight 1.
+    """
+    name = 'table'
+
+    def __init__(self, table: Dict[Tuple[Phase, SecretRole], Dict[str, float]] = None):
+        self.table = DEFAULT_HEURISTIC_TABLE if table is None else table
+
+    def choose(self, game_state, hidden_state, player, legal_actions):
+        if len(legal_actions) == 1:
+            return legal_actions[0]
+        weights = self.table.get((game_state.phase, hidden_state.hidden_roles[player]))
+        if weights is None:
+            return random.choice(legal_actions)
+        return random.choices(legal_actions, weights=[
+            weights.get(action_feature(game_state, hidden_state, player, action), 1.0) for action in legal_actions
+        ])[0]
+
+
+UNIFORM_POLICY = UniformPolicy()
+SELFISH_POLICY = SelfishPolicy()
+ROLLOUT_POLICIES = {policy.name: policy for policy in [UNIFORM_POLICY, SELFISH_POLICY, TablePolicy()]}
+
+
+def rollout(game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState, policy: RolloutPolicy) -> List:
+    """
+    Plays the game to the end with every player moving by policy and returns the terminal values
+    """
+    while not game_state.is_terminal():
+        moves = tuple([
+            policy.choose(game_state, hidden_state, player, game_state.legal_actions(hidden_state, player))
+            for player in game_state.moving_players()
+        ])
+        game_state, hidden_state, _ = game_state.transition(moves=moves, hidden_state=hidden_state)
+    return game_state.terminal_value(hidden_state)
+
+
+def rollout_values(game_state: SecretHitlerState, hidden_state: HiddenSecretHitlerState, policy: RolloutPolicy,
+                   num_playouts: int = 1) -> np.ndarray:
+    """
+    Mean terminal values of num_playouts rollouts, played by the batch rollout engine when it supports the policy
+    """
+    if num_playouts == 1:
+        return np.asarray(rollout(game_state, hidden_state, policy))
+    if policy.batch_selfish is not None:
+        return simulate_batch(game_state, hidden_state, num_playouts, selfish=policy.batch_selfish)
+    return np.mean([rollout(game_state, hidden_state, policy) for _ in range(num_playouts)], axis=0)
+
+
+def sample_positions(num_positions: int, num_players: int = 7, solver: EndgameSolver = None) \
+        -> List[Tuple[SecretHitlerState, HiddenSecretHitlerState]]:
+    """
+    Positions reached by playing random games from the start for a random number of transitions. With a solver,
+    only positions it can value are kept.
+    """
+    positions = []
+    while len(positions) < num_positions:
+        roles = random.choice(SECRET_HITLER_POSSIBLE_ROLES[num_players])
+        deck = PolicyDeck(random.choice([d for d in POSSIBLE_DECKS if len(d) == DECK_SIZE]))
+        hidden_state = HiddenSecretHitlerState(hidden_roles=roles, policy_deck=deck, discard_pile=[],
+                                               proposed_policies=())
+        game_state = SecretHitlerState.start_state(num_players=num_players)
+        for _ in range(random.randrange(0, 40)):
+            moves = [UNIFORM_POLICY.choose(game_state, hidden_state, p, game_state.legal_actions(hidden_state, p))
+                     for p in game_state.moving_players()]
+            game_state, hidden_state, _ = game_state.transition(moves=moves, hidden_state=hidden_state)
+            if game_state.is_terminal():
+                break
+        if game_state.is_terminal():
+            continue
+        if solver is None or (solver.applicable(game_state) and solver.values(game_state, hidden_state) is not None):
+            positions.append((game_state, hidden_state))
+    return positions
+
+
+def benchmark_policies(policies: List[RolloutPolicy], positions, rollouts_per_position=200,
+                       solver: EndgameSolver = None) -> Dict[str, Dict]:
+    """
+    Rollout throughput of each policy against the accuracy of its value estimates.
+
+    The reference value of a position is its exact value from solver, an EndgameSolver by default, which does not
+    depend on any rollout policy. Positions the solver can not value only count towards throughput, so accuracy
+    needs positions sampled with the solver (see sample_positions). For each policy the result holds rollouts per
+    second, the standard deviation of a single rollout value, the standard error reachable in one second of
+    rollouts, and the mean absolute error of its estimates against the reference over the solved positions.
+    """
+    solver = EndgameSolver() if solver is None else solver
+    references = [solver.values(gs, hs) if solver.applicable(gs) else None for gs, hs in positions]
+    results = {}
+    for policy in policies:
+        elapsed, errors, stds = 0.0, [], []
+        for (game_state, hidden_state), reference in zip(positions, references):
+            start = time.perf_counter()
+            values = np.array([rollout(game_state, hidden_state, policy) for _ in range(rollouts_per_position)])
+            elapsed += time.perf_counter() - start
+            stds.append(values.std(axis=0).mean())
+            if reference is not None:
+                errors.append(np.abs(values.mean(axis=0) - reference).mean())
+        rate = len(positions) * rollouts_per_position / elapsed
+        std = float(np.mean(stds))
+        results[policy.name] = {
+            'rollouts_per_second': rate,
+            'rollout_std': std,
+            'standard_error_per_second': std / rate ** 0.5,
+            'mean_abs_error': float(np.mean(errors)) if errors else float('nan'),
+            'solved_positions': len(errors),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    solver = EndgameSolver()
+    positions = sample_positions(20, solver=solver)
+    for name, result in benchmark_policies(list(ROLLOUT_POLICIES.values()), positions, solver=solver).items():
+        logger.info(f'{name}: ' + ', '.join(f'{key}={value:.4f}' for key, value in result.items()))
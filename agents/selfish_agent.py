@@ -1,11 +1,24 @@
 import random
 import logging
 from agents.agent import Agent
-from secrethitler import SecretHitlerState, Phase, PolicyChoiceAction, SecretRole
+from secrethitler import SecretHitlerState, Phase, PolicyChoiceAction, SecretRole, Party
 
 logger = logging.getLogger(__name__)
 
 
+def selfish_choice(phase: Phase, party: Party, legal_actions):
+    """
+    The policy choice a player of party makes when acting selfishly, None when the phase has no policy choice
+    """
+    if phase == Phase.presidentSelectPolicy:
+        return PolicyChoiceAction(policy=party.opposite()) if PolicyChoiceAction(policy=party.opposite()) in legal_actions \
+            else PolicyChoiceAction(policy=party)
+    if phase == Phase.chancellorSelectPolicy:
+        return PolicyChoiceAction(policy=party) if PolicyChoiceAction(policy=party) in legal_actions \
+            else PolicyChoiceAction(policy=party.opposite())
+    return None
+
+
 class SelfishAgent(Agent):
     """
     SelfishAgent Class.
@@ -19,15 +32,10 @@ class SelfishAgent(Agent):
     def get_action(self, state: SecretHitlerState, legal_actions):
         if state.phase == Phase.presidentSelectPolicy:
             assert state.president == self.player_id, 'asking president action from non president'
-            discard = self.party.opposite() if PolicyChoiceAction(policy=self.party.opposite()) in legal_actions \
-                else self.party
-            move = PolicyChoiceAction(policy=discard)
         elif state.phase == Phase.chancellorSelectPolicy:
             assert state.chancellor == self.player_id, 'asking chancellor action from non chancellor'
-            play = self.party if PolicyChoiceAction(policy=self.party) in legal_actions \
-                else self.party.opposite()
-            move = PolicyChoiceAction(policy=play)
-        else:
+        move = selfish_choice(state.phase, self.party, legal_actions)
+        if move is None:
             move = random.choice(legal_actions)
 
         logger.info(f'{self.name}:{self.player_id} has chosen {move}')
@@ -1,10 +1,17 @@
 import logging
-import math
-import itertools
+import random
+import time
+import numpy as np
 from collections import defaultdict, deque
-from tqdm import tqdm
 
-from agents.mcts_common import random_choice, determinization_iterator, simulate
+from agents.mcts_common import random_choice, determinization_iterator, reward_range, EarlyStopping, \
+    information_set_key, DecisionCache, decision_key, common_random_numbers, IterationAllocator, expansion_threshold
+from agents.node_pool import ISMCTSNodePool, TranspositionTable
+from agents.instrumentation import SearchStats, StatsSink, clock
+from agents.opening_book import OpeningBook
+from agents.endgame_solver import EndgameSolver, search_endgame
+from agents.pondering import Ponderer
+from agents.rollout_policy import RolloutPolicy, UNIFORM_POLICY, rollout_values
 from agents.pimc_agent import PIMCAgent100
 from agents.agent import Agent
 from secrethitler import SecretRole, SecretHitlerState, HiddenSecretHitlerState, Phase, PolicyDeck, Party, PolicyChoiceAction
@@ -15,172 +22,349 @@ logger = logging.getLogger(__name__)
 # TODO: find a better solution to this from within PolicyDeck
 SIMULATED_HIDDEN_STATES = deque()  # needed for deterministic shuffles of policy deck
 SIMULATED_GAME_STATES = deque()
+SIMULATED_ACTIONS = deque()  # path from the root, a node may have several parents with a transposition table
 
 
-class Node:
-    def __init__(self, parent, incoming_edge):
-        self.parent = parent
-        self.incoming_edge = incoming_edge
-        self.children = {}  # map from joint actions to child nodes
-        self.total_reward = 0.0  # the total reward for the parent for selecting this action
-        self.availability_count = 0
-        self.visit_count = 0
-        self.exp3_sum = defaultdict(lambda: defaultdict(lambda: 0.0))  # map from player to action to reward
+def compatible_children(tree: ISMCTSNodePool, game_state, hidden_state):
+    return tree.compatible(tuple(
+        tuple(game_state.legal_actions(hidden_state, player))
+        for player in game_state.moving_players()
+    ))
 
-    def compatible_children(self, game_state, hidden_state):
-        moving_players = game_state.moving_players()
-        return [
-            moves
-            for moves in itertools.product(*[
-                game_state.legal_actions(hidden_state, player)
-                for player in moving_players
-            ])
-        ]
-
-    def unexplored_children(self, game_state, hidden_state):
-        return [moves for moves in self.compatible_children(game_state, hidden_state) if moves not in self.children]
-
-    def calculate_exp3_probs(self, game_state, hidden_state, player):
-        available_actions = game_state.legal_actions(hidden_state, player)
-        K = len(available_actions)
-        n = self.visit_count
-        if n == 0:
-            gamma = 1.0
-        else:
-            gamma = min(1.0, math.sqrt(K * math.log(K) / (n * (math.e - 1))))
-
-        eta = gamma / K
-        probs = [
-            (
-                    gamma / K +
-                    (1.0 - gamma) / sum([
-                math.exp(min(eta * (self.exp3_sum[player][a] - self.exp3_sum[player][action]), 700))
-                for a in available_actions
-            ])
-            )
-            for action in available_actions
-        ]
-        return available_actions, probs
-
-    def select_child(self, game_state, hidden_state):
-        moving_players = game_state.moving_players()
-        if len(moving_players) == 1:
-            available_actions = self.compatible_children(game_state, hidden_state)
-            if len(available_actions) == 1:
-                return available_actions[0]
-
-            return max(
-                available_actions,
-                # UCB1
-                key=lambda action: (
-                        (self.children[action].total_reward / self.children[action].visit_count) +
-                        2000 * math.sqrt(
-                    math.log(self.children[action].availability_count) / self.children[action].visit_count)
-                )
-            )
-        else:
-            move = ()
-            for player in moving_players:
-                actions, probs = self.calculate_exp3_probs(game_state, hidden_state, player)
-                if len(actions) == 1:
-                    chosen_move = actions[0]
-                else:
-                    chosen_move = random_choice(actions, p=probs)
-                move += (chosen_move,)
-            return move
+
+def unexplored_children(tree: ISMCTSNodePool, node: int, game_state, hidden_state):
+    joint_actions, action_ids = compatible_children(tree, game_state, hidden_state)
+    return [moves for moves, action_id in zip(joint_actions, action_ids) if (node, action_id) not in tree.edges]
 
 
-def select_leaf(node, game_state, hidden_state):
+def calculate_exp3_probs(tree: ISMCTSNodePool, node: int, game_state, hidden_state, player):
+    available_actions = game_state.legal_actions(hidden_state, player)
+    return available_actions, tree.exp3_probabilities(node, player, tuple(available_actions))
+
+
+def select_child(tree: ISMCTSNodePool, node: int, game_state, hidden_state):
+    moving_players = game_state.moving_players()
+    if len(moving_players) == 1:
+        available_actions, action_ids = compatible_children(tree, game_state, hidden_state)
+        if len(available_actions) == 1:
+            return available_actions[0]
+
+        children = [tree.edges[(node, action_id)] for action_id in action_ids]
+        visit_count = tree.visit_count[children]
+        # UCB1
+        ucb = tree.total_reward[children] / visit_count + \
+            2000 * np.sqrt(np.log(tree.availability_count[children]) / visit_count)
+        return available_actions[int(np.argmax(ucb))]
+    else:
+        move = ()
+        for player in moving_players:
+            actions, probs = calculate_exp3_probs(tree, node, game_state, hidden_state, player)
+            if len(actions) == 1:
+                chosen_move = actions[0]
+            else:
+                chosen_move = random_choice(actions, p=probs)
+            move += (chosen_move,)
+        return move
+
+
+def select_leaf(tree: ISMCTSNodePool, node: int, game_state, hidden_state):
     if game_state.is_terminal():
         return node, game_state, hidden_state
-    if len(node.unexplored_children(game_state, hidden_state)) != 0:
+    if len(unexplored_children(tree, node, game_state, hidden_state)) != 0:
         return node, game_state, hidden_state
 
-    action = node.select_child(game_state, hidden_state)
-    new_node = node.children[action]
+    action = select_child(tree, node, game_state, hidden_state)
+    new_node = tree.child(node, action)
+    new_game_state, new_hidden_state, _ = game_state.transition(action, hidden_state)
+    SIMULATED_GAME_STATES.appendleft(new_game_state)
+    SIMULATED_HIDDEN_STATES.appendleft(new_hidden_state)
+    SIMULATED_ACTIONS.appendleft(action)
+    return select_leaf(tree, new_node, new_game_state, new_hidden_state)
+
+
+def root_joint_action(tree: ISMCTSNodePool, game_state, hidden_state, searcher_index: int, move):
+    """
+    Joint action at the root in which the searcher plays move and the other moving players choose as in select_child
+    """
+    if len(game_state.moving_players()) == 1:
+        return (move,)
+    joint_action = select_child(tree, ISMCTSNodePool.ROOT, game_state, hidden_state)
+    return joint_action[:searcher_index] + (move,) + joint_action[searcher_index + 1:]
+
+
+def select_leaf_through(tree: ISMCTSNodePool, game_state, hidden_state, action):
+    """
+    Like select_leaf from the root with action played first. The root child of action is expanded when it is not
+    in the tree yet, the returned flag tells whether it was.
+    """
+    node = tree.child(ISMCTSNodePool.ROOT, action)
     new_game_state, new_hidden_state, _ = game_state.transition(action, hidden_state)
     SIMULATED_GAME_STATES.appendleft(new_game_state)
     SIMULATED_HIDDEN_STATES.appendleft(new_hidden_state)
-    return select_leaf(new_node, new_game_state, new_hidden_state)
+    SIMULATED_ACTIONS.appendleft(action)
+    if node == -1:
+        return tree.add_child(ISMCTSNodePool.ROOT, action), new_game_state, new_hidden_state, True
+    return select_leaf(tree, node, new_game_state, new_hidden_state) + (False,)
 
 
-def expand_if_needed(node, game_state, hidden_state):
+def expand_if_needed(tree: ISMCTSNodePool, node: int, game_state, hidden_state, searcher: int,
+                     transpositions: TranspositionTable = None):
     if game_state.is_terminal():
         return node, game_state, hidden_state
-    unexplored_children = node.unexplored_children(game_state, hidden_state)
+    action = random_choice(unexplored_children(tree, node, game_state, hidden_state))
 
-    action = random_choice(unexplored_children)
-
-    new_node = Node(parent=node, incoming_edge=action)
-    node.children[action] = new_node
     new_game_state, new_hidden_state, _ = game_state.transition(action, hidden_state)
+    # children of the root are never shared so that root actions keep their own statistics
+    if transpositions is None or node == ISMCTSNodePool.ROOT:
+        new_node = tree.add_child(node, action)
+    else:
+        key = information_set_key(new_game_state, new_hidden_state, searcher)
+        new_node = transpositions.get(key)
+        if new_node == -1:
+            new_node = tree.add_child(node, action)
+            transpositions.put(key, new_node, tree.visit_count)
+        else:
+            tree.link_child(node, action, new_node)
     SIMULATED_GAME_STATES.appendleft(new_game_state)
     SIMULATED_HIDDEN_STATES.appendleft(new_hidden_state)
+    SIMULATED_ACTIONS.appendleft(action)
     return new_node, new_game_state, new_hidden_state
 
 
-def backpropagate(initial_game_state, initial_hidden_state: HiddenSecretHitlerState, node, rewards):
-    action_history = []
-    while node.parent is not None:
-        action_history.append(node.incoming_edge)
-        node = node.parent
-    action_history = action_history[::-1]
-
+def backpropagate(tree: ISMCTSNodePool, initial_game_state, initial_hidden_state: HiddenSecretHitlerState, rewards):
+    node = ISMCTSNodePool.ROOT
     game_state, hidden_state = initial_game_state, initial_hidden_state
-    for action in action_history:
+    while len(SIMULATED_ACTIONS) != 0:
+        action = SIMULATED_ACTIONS.pop()
         moving_players = game_state.moving_players()
-        for neighbor in node.compatible_children(game_state, hidden_state):
-            if neighbor in node.children:
-                node.children[neighbor].availability_count += 1
+        _, neighbors = compatible_children(tree, game_state, hidden_state)
+        neighbor_nodes = [tree.edges.get((node, neighbor), -1) for neighbor in neighbors]
+        tree.availability_count[[n for n in neighbor_nodes if n != -1]] += 1
 
-        node.children[action].visit_count += 1
+        child = tree.child(node, action)
+        tree.visit_count[child] += 1
 
         if len(moving_players) == 1:
-            node.children[action].total_reward += rewards[moving_players[0]]
+            tree.total_reward[child] += rewards[moving_players[0]]
         else:
+            row = tree.exp3(node)
             for player, move in zip(moving_players, action):
-                if move not in node.exp3_sum[player]:
-                    node.exp3_sum[player][move] += rewards[player]
+                move_id = tree.move_id(move)
+                if not tree.exp3_seen[row, player, move_id]:
+                    tree.exp3_seen[row, player, move_id] = True
+                    tree.add_exp3_reward(row, player, move_id, rewards[player])
                 else:
-                    actions, probs = node.calculate_exp3_probs(game_state, hidden_state, player)
+                    actions, probs = calculate_exp3_probs(tree, node, game_state, hidden_state, player)
                     prob = probs[actions.index(move)]
-                    node.exp3_sum[player][move] += rewards[player] / prob
+                    tree.add_exp3_reward(row, player, move_id, rewards[player] / prob)
 
-        node = node.children[action]
+        node = child
         # this does not work due to randomization of deck shuffle
         # game_state, hidden_state, _ = game_state.transition(action, hidden_state)
         game_state = SIMULATED_GAME_STATES.pop()
         hidden_state = SIMULATED_HIDDEN_STATES.pop()
 
 
-def search_ismcts(searcher, initial_game_state, possible_hidden_states, num_iterations, legal_actions, deck_beliefs, president_pass):
-    root = Node(parent=None, incoming_edge=None)
-
-    for initial_hidden_state in tqdm(determinization_iterator(possible_hidden_states, num_iterations, initial_game_state,
-                                                              legal_actions, deck_beliefs, president_pass),
-                                     desc='Searching', total=num_iterations, disable=None, leave=False):
-        if initial_game_state.legal_actions(player=searcher, hidden_state=initial_hidden_state) == legal_actions:
-            SIMULATED_HIDDEN_STATES.clear()
-            node, game_state, hidden_state = select_leaf(root, initial_game_state, initial_hidden_state)
-            node, game_state, hidden_state = expand_if_needed(node, game_state, hidden_state)
-            rewards = simulate(game_state, hidden_state)
-            backpropagate(initial_game_state, initial_hidden_state, node, rewards)
-
-    moves = max(root.children, key=lambda action: root.children[action].visit_count)
-    move = moves[initial_game_state.moving_players().index(searcher)]
-    return move, root
+def root_statistics(tree: ISMCTSNodePool, root_action_ids):
+    children = np.array([tree.edges.get((ISMCTSNodePool.ROOT, action_id), -1) for action_id in root_action_ids])
+    expanded = children != -1
+    visit_counts = np.zeros(len(children))
+    total_rewards = np.zeros(len(children))
+    visit_counts[expanded] = tree.visit_count[children[expanded]]
+    total_rewards[expanded] = tree.total_reward[children[expanded]]
+    return visit_counts, total_rewards
+
+
+def root_visit_distribution(tree: ISMCTSNodePool, searcher_index: int):
+    visits = defaultdict(int)
+    for child in tree.children(ISMCTSNodePool.ROOT):
+        visits[tree.edge_action(child)[searcher_index]] += tree.visit_count[child]
+    return visits
+
+
+def search_ismcts(searcher, initial_game_state, possible_hidden_states, num_iterations, legal_actions, deck_beliefs,
+                  president_pass, early_stop: EarlyStopping = None, transposition_entries: int = None,
+                  stats_sink: StatsSink = None, num_playouts: int = 1, rollout_policy: RolloutPolicy = UNIFORM_POLICY,
+                  memory_budget: int = None, endgame_solver: EndgameSolver = None, paired: bool = False):
+    """
+    Searches for the move of searcher. With a memory_budget in bytes, leaves are expanded until the tree holds that
+    much memory, the last EXPANSION_RESERVE of it only for leaves visited at least as often as the average node, so
+    the well visited lines keep growing in depth after the others stopped.
+    With an endgame_solver, leaves it can solve are valued exactly instead of by rollouts.
+    With paired, every determinization is searched once through each root move on common random numbers,
+    so num_iterations // len(root moves) determinizations are drawn and the root comparisons are paired.
+    """
+    tree = ISMCTSNodePool(num_players=initial_game_state.starting_num_players)
+    transpositions = TranspositionTable(transposition_entries) if transposition_entries else None
+    single_mover = len(initial_game_state.moving_players()) == 1
+    searcher_index = initial_game_state.moving_players().index(searcher)
+    value_range = reward_range(initial_game_state.starting_num_players)
+    root_action_ids = None
+    stats = SearchStats('SO-ISMCTS', searcher, initial_game_state.phase, num_iterations)
+    start = time.time()
+    root_moves = list(dict.fromkeys(legal_actions)) if paired else [None]
+    num_determinizations = max(1, num_iterations // len(root_moves))
+    paired_rewards = []
+
+    def iterate(initial_hidden_state, move):
+        stats.iterations += 1
+        SIMULATED_HIDDEN_STATES.clear()
+        t = clock()
+        expanded = False
+        if move is None:
+            node, game_state, hidden_state = select_leaf(tree, ISMCTSNodePool.ROOT, initial_game_state,
+                                                         initial_hidden_state)
+        else:
+            action = root_joint_action(tree, initial_game_state, initial_hidden_state, searcher_index, move)
+            node, game_state, hidden_state, expanded = select_leaf_through(tree, initial_game_state,
+                                                                           initial_hidden_state, action)
+        t = stats.add_time('selection', t)
+        if not expanded:
+            # the root is always expanded so that every root action gets searched
+            if memory_budget is not None and node != ISMCTSNodePool.ROOT and not game_state.is_terminal() and \
+                    tree.visit_count[node] < expansion_threshold(tree.nbytes(), memory_budget,
+                                                                 tree.visit_count[1:tree.size]):
+                stats.unexpanded += 1
+            else:
+                node, game_state, hidden_state = expand_if_needed(tree, node, game_state, hidden_state, searcher,
+                                                                  transpositions)
+        stats.max_depth = max(stats.max_depth, len(SIMULATED_ACTIONS))
+        t = stats.add_time('expansion', t)
+        rewards = None
+        if endgame_solver is not None and endgame_solver.applicable(game_state):
+            rewards = endgame_solver.values(game_state, hidden_state)
+        if rewards is None:
+            rewards = rollout_values(game_state, hidden_state, rollout_policy, num_playouts)
+        t = stats.add_time('rollout', t)
+        backpropagate(tree, initial_game_state, initial_hidden_state, rewards)
+        stats.add_time('backpropagation', t)
+        return rewards[searcher]
+
+    for initial_hidden_state in determinization_iterator(possible_hidden_states, num_determinizations,
+                                                         initial_game_state, legal_actions, deck_beliefs,
+                                                         president_pass, searcher):
+        stats.determinizations += 1
+        if paired:
+            seed = random.getrandbits(32)
+            rewards = []
+            for move in root_moves:
+                with common_random_numbers(seed):
+                    rewards.append(iterate(initial_hidden_state, move))
+            paired_rewards.append(rewards)
+        else:
+            iterate(initial_hidden_state, None)
+        if root_action_ids is None:
+            _, root_action_ids = compatible_children(tree, initial_game_state, initial_hidden_state)
+
+        if early_stop is None or not early_stop.should_check(stats.determinizations):
+            continue
+        if paired:
+            if early_stop.can_stop_paired(np.array(paired_rewards), value_range):
+                break
+        else:
+            visit_counts, total_rewards = root_statistics(tree, root_action_ids)
+            if early_stop.can_stop(visit_counts, remaining=num_iterations - stats.determinizations,
+                                   total_rewards=total_rewards if single_mover else None, value_range=value_range):
+                break
+
+    if early_stop is not None:
+        # reported in iterations, of which paired searches run one per root move and determinization
+        early_stop.report(stats.determinizations * len(root_moves), num_determinizations * len(root_moves),
+                          time.time() - start)
+    logger.debug(f'SO-ISMCTS searched {stats.iterations} iterations of a budget of {num_iterations}')
+    if stats_sink is not None:
+        stats_sink.record(stats.finish(tree.size - 1, root_visit_distribution(tree, searcher_index), tree.nbytes()))
+
+    if paired_rewards:
+        # every root move has the same number of visits, so the paired means decide
+        return root_moves[int(np.argmax(np.mean(paired_rewards, axis=0)))], tree
+    if stats.iterations == 0:
+        # only when the sampler found no hidden state consistent with the information set
+        return random_choice(legal_actions), tree
+    best_child = max(tree.children(ISMCTSNodePool.ROOT), key=lambda child: tree.visit_count[child])
+    moves = tree.edge_action(best_child)
+    move = moves[searcher_index]
+    return move, tree
 
 
 class SOISMCTSAgentBase(Agent):
-    def __init__(self, player_id: int, num_players: int, secret_role: SecretRole, iterations=1000, name='SO-ISMCTS Agent'):
+    def __init__(self, player_id: int, num_players: int, secret_role: SecretRole, iterations=1000, name='SO-ISMCTS Agent',
+                 early_stop: EarlyStopping = None, transposition_entries: int = None, stats_sink: StatsSink = None,
+                 num_playouts: int = 1, rollout_policy: RolloutPolicy = UNIFORM_POLICY,
+                 memory_budget: int = None, decision_cache: DecisionCache = None, opening_book: OpeningBook = None,
+                 endgame_solver: EndgameSolver = None, paired: bool = False, allocator: IterationAllocator = None,
+                 ponderer: Ponderer = None):
         super().__init__(player_id, name, secret_role, num_players)
         self.iterations = iterations
+        self.paired = paired
+        self.allocator = allocator
+        self.early_stop = early_stop
+        self.transposition_entries = transposition_entries
+        self.stats_sink = stats_sink
+        self.num_playouts = num_playouts
+        self.rollout_policy = rollout_policy
+        self.memory_budget = memory_budget
+        self.decision_cache = decision_cache
+        self.opening_book = opening_book
+        self.endgame_solver = endgame_solver
+        self.ponderer = ponderer
+
+    def search_call(self, state, legal_actions, iterations=None, early_stop=None, stats_sink=None):
+        """
+        search_ismcts and its arguments for a decision, so that the search can also run in a worker process
+        """
+        return search_ismcts, (self.player_id, state, self.hidden_role_beliefs,
+                               self.iterations if iterations is None else iterations, legal_actions,
+                               self.deck_knowledge, self.president_pass,
+                               self.early_stop if early_stop is None else early_stop, self.transposition_entries,
+                               stats_sink, self.num_playouts, self.rollout_policy, self.memory_budget,
+                               self.endgame_solver, self.paired)
+
+    def ponder(self, state):
+        if self.ponderer is not None:
+            self.ponderer.ponder(self, state)
+
+    def close(self):
+        if self.ponderer is not None:
+            self.ponderer.close()
 
     def get_action(self, state, legal_actions):
         if len(legal_actions) == 1:
             return legal_actions[0]
-        action, _ = search_ismcts(self.player_id, state, self.hidden_role_beliefs, self.iterations,
-                                  legal_actions, self.deck_knowledge, self.president_pass)
+        if self.opening_book is not None:
+            action = self.opening_book.lookup(self, state, legal_actions)
+            if action is not None:
+                logger.info(f'{self} has chosen book {action}')
+                return action
+        if self.decision_cache is not None:
+            key = decision_key(self, state, legal_actions)
+            action = self.decision_cache.get(key)
+            if action is not None:
+                logger.info(f'{self} has chosen cached {action}')
+                return action
+        if self.endgame_solver is not None and self.endgame_solver.applicable(state):
+            action = search_endgame(self.endgame_solver, self.player_id, state, self.hidden_role_beliefs,
+                                    legal_actions, self.deck_knowledge, self.president_pass)
+            if action is not None:
+                logger.info(f'{self} has chosen solved {action}')
+                return action
+        if self.ponderer is not None:
+            action = self.ponderer.result(decision_key(self, state, legal_actions))
+            if action is not None:
+                logger.info(f'{self} has chosen pondered {action}')
+                return action
+        iterations, early_stop = self.iterations, self.early_stop
+        if self.allocator is not None:
+            iterations, early_stop = self.allocator.allocate(state.phase, legal_actions)
+        search, args = self.search_call(state, legal_actions, iterations, early_stop, self.stats_sink)
+        action, tree = search(*args)
+        if self.allocator is not None:
+            self.allocator.spend(early_stop.last_report['iterations'])
+        if self.decision_cache is not None:
+            searcher_index = state.moving_players().index(self.player_id)
+            # paired searches visit every root move equally, so only the chosen one is cached
+            self.decision_cache.put(key, {action: 1} if self.paired else
+                                    dict(root_visit_distribution(tree, searcher_index)))
         logger.info(f'{self} has chosen {action}')
         return action
 
@@ -195,6 +379,22 @@ class SOISMCTSAgent10000(SOISMCTSAgentBase):
         super().__init__(player_id, num_players, secret_role, 10000, 'SO-ISMCTS-10000 Agent')
 
 
+class SOISMCTSAgentAdaptive(SOISMCTSAgentBase):
+    def __init__(self, player_id: int, num_players: int, secret_role: SecretRole):
+        super().__init__(player_id, num_players, secret_role, name='SO-ISMCTS-Adaptive Agent',
+                         allocator=IterationAllocator(base_iterations=1000, game_budget=50000))
+
+
+class SOISMCTSAgentPondering(SOISMCTSAgentBase):
+    """
+    Searches its votes while the president nominates, in executor when given so that the agents of a game share
+    one pool, searching at most workers nominations at once
+    """
+    def __init__(self, player_id: int, num_players: int, secret_role: SecretRole, executor=None, workers=1):
+        super().__init__(player_id, num_players, secret_role, 1000, 'SO-ISMCTS-Pondering Agent',
+                         ponderer=Ponderer(executor, workers))
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     # testing for SIMULATED_HIDDEN_STATES
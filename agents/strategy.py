@@ -0,0 +1,82 @@
+import asyncio
+import functools
+import random
+
+THINKING_TIME = (1, 3)  # seconds, bounds of the pause taken before each delayed decision
+
+
+def delay(func):
+    """
+    Awaits a thinking time of THINKING_TIME seconds before the decision, without blocking the event loop
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        await asyncio.sleep(random.randint(*THINKING_TIME))
+        return await func(*args, **kwargs)
+    return wrapper
+
+
+class Strategy:
+    """
+    Decisions of the live bot.
+
+    Every decision is a coroutine awaited from the socket.io event handlers, which share one event loop with
+    every other bot and their heartbeats. Thinking time has to be awaited (see delay) and real computation run
+    through compute, never done in place.
+    """
+    def __init__(self, name: str, executor=None):
+        self.name = name
+        self.gameState = None
+        self.executor = executor
+
+    async def compute(self, func, *args, **kwargs):
+        """
+        Runs func in the executor, the default thread pool of the loop without one, and returns its result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def observe(self, gameUpdate):
+        """
+        Called with every game update as it arrives, including the ones superseded before a decision is made
+        """
+        pass
+
+    def close(self):
+        """
+        Called when the bot stops, strategies release what they hold
+        """
+        pass
+
+    async def vote(self):
+        raise NotImplementedError
+
+    async def selectChancellor(self):
+        raise NotImplementedError
+
+    async def presidentSelectPolicy(self):
+        raise NotImplementedError
+
+    async def chancellorSelectPolicy(self):
+        raise NotImplementedError
+
+    async def selectPlayerToExecute(self):
+        raise NotImplementedError
+
+    async def chancellorVoteOnVeto(self):
+        raise NotImplementedError
+
+    async def presidentVoteOnVeto(self):
+        raise NotImplementedError
+
+    async def selectPartyMembershipInvestigate(self):
+        raise NotImplementedError
+
+    async def selectPartyMembershipInvestigateReverse(self):
+        raise NotImplementedError
+
+    async def selectedSpecialElection(self):
+        raise NotImplementedError
+
+    async def selectedPresidentVoteOnBurn(self):
+        raise NotImplementedError
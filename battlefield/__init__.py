@@ -1 +1,2 @@
 from .tournament import run_game
+from .mass_tournament import run_baseline_games, BASELINE_AGENT_NAMES
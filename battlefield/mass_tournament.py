@@ -0,0 +1,62 @@
+import logging
+import numpy as np
+from collections import defaultdict
+from typing import List, Dict, Tuple
+
+from agents import RandomAgent, SelfishAgent
+from agents.batch_rollout import RolloutBatch
+from secrethitler import SecretRole, Party, GameEndReason, SECRET_HITLER_SECRET_ROLES
+
+logger = logging.getLogger(__name__)
+
+# agents whose policies are simple enough to be played by RolloutBatch
+BASELINE_AGENT_NAMES = {
+    RandomAgent: 'Random Agent',
+    SelfishAgent: 'Selfish Agent',
+}
+
+
+def random_roles(num_players: int, num_games: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Uniformly random role assignments as SecretRole values, one row per game
+    """
+    roles = np.array([role.value for role in SECRET_HITLER_SECRET_ROLES[num_players]])
+    return rng.permuted(np.tile(roles, (num_games, 1)), axis=1)
+
+
+def run_baseline_games(lineups: List[List[type]], roles: List[Tuple[SecretRole, ...]] = None,
+                       rng: np.random.Generator = None) -> List[Dict]:
+    """
+    Plays one game per lineup of baseline agent classes, all games with the same number of players at once.
+
+    Returns a game summary per lineup, in the format written by push_game_summary_data.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    for lineup in lineups:
+        for agent in lineup:
+            assert agent in BASELINE_AGENT_NAMES, f'{agent.__name__} can not be mass simulated'
+
+    by_num_players = defaultdict(list)
+    for game, lineup in enumerate(lineups):
+        by_num_players[len(lineup)].append(game)
+
+    summaries = [None] * len(lineups)
+    for num_players, games in by_num_players.items():
+        if roles is None:
+            game_roles = random_roles(num_players, len(games), rng)
+        else:
+            game_roles = np.array([[role.value for role in roles[game]] for game in games])
+        batch = RolloutBatch.start(num_players, game_roles, rng)
+        batch.selfish[:] = [[agent is SelfishAgent for agent in lineups[game]] for game in games]
+        batch.run(rng)
+        logger.info(f'simulated {len(games)} games with {num_players} players')
+
+        for row, game in enumerate(games):
+            summaries[game] = {
+                'num_players': num_players,
+                'winning_party': Party(batch.winner[row]).name,
+                'win_reason': GameEndReason(batch.end_reason[row]).name,
+                'players': [{'name': BASELINE_AGENT_NAMES[agent], 'role': SecretRole(role).name}
+                            for agent, role in zip(lineups[game], game_roles[row])]
+            }
+    return summaries
@@ -14,8 +14,10 @@ def run_game(state: SecretHitlerState, hidden_state: HiddenSecretHitlerState, ag
         logger.info(f'current state={state}')
         logger.info(f'hidden_state={hidden_state}')
 
-        # moving agents choose their actions
+        # moving agents choose their actions, the other alive players may search their next decisions meanwhile
         moving_players = state.moving_players()
+        for player in set(state.alive_players) - set(moving_players):
+            agents[player].ponder(state)
         moves = [
             agents[player].get_action(state, state.legal_actions(hidden_state=hidden_state, player=player))
             for player in moving_players
@@ -35,6 +37,8 @@ def run_game(state: SecretHitlerState, hidden_state: HiddenSecretHitlerState, ag
         state = new_state
         hidden_state = new_hidden_state
 
+    for agent in agents:
+        agent.close()
     logger.info(f'ending game state={state}')
     logger.info(f'game ended in a {state.game_end.name} victory. {state.game_end_reason}')
     return state.terminal_value(hidden_state), state
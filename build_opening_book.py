@@ -0,0 +1,28 @@
+"""Build an opening book of SO-ISMCTS root statistics
+
+Usage:
+  build_opening_book <path> [options]
+  build_opening_book -h | --help
+
+Options:
+  -h --help                     Show this screen.
+  -p --players=<counts>         Player counts to cover [default: 5,6,7,8,9,10].
+  -g --games=<num_games>        Random games sampled per player count [default: 2000].
+  -n --positions=<num>          Information sets kept per player count and role [default: 50].
+  -i --iterations=<num>         Search iterations per information set [default: 10000].
+  -e --enacted=<num>            Only decisions made before this many policies are enacted [default: 1].
+  -l --log=<level>              Set the log level [default: INFO].
+"""
+import logging
+from docopt import docopt
+
+from agents.opening_book import build_book, save_book
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    logging.basicConfig(level=getattr(logging, args['--log'].upper()))
+    logging.getLogger('agents.random_agent').setLevel(logging.WARNING)
+    book = build_book([int(n) for n in args['--players'].split(',')], int(args['--games']), int(args['--positions']),
+                      int(args['--iterations']), int(args['--enacted']))
+    save_book(args['<path>'], book)
+    logging.info(f'saved {len(book)} information sets to {args["<path>"]}')
@@ -66,43 +66,70 @@ class TrackState:
 
 class GameUpdate:
     """
-    GameUpdate object received from socket. Has game state information along with other information
+    GameUpdate object received from socket. Has game state information along with other information.
+
+    Sections of the payload are only converted into objects when they are first accessed, so an update costs
+    nothing for the chat history or card states unless they are read.
     """
+    SECTIONS = {
+        'gameState': Struct.from_json,
+        'chats': lambda data: list(map(Chats.from_json, data)),
+        'general': Struct.from_json,
+        'customGameSettings': Struct.from_json,
+        'publicPlayersState': lambda data: list(map(PublicPlayersState.from_json, data)),
+        'playersState': lambda data: list(map(Struct.from_json, data)),
+        'trackState': TrackState.from_json,
+        'cardFlingerState': lambda data: list(map(CardFlingerState.from_json, data)),
+    }
+    # sections that are empty when missing or malformed
+    OPTIONAL_SECTIONS = {'chats', 'playersState', 'cardFlingerState'}
+
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
 
     @classmethod
     def from_json(cls, data):
-        chats = []
-        try:
-            chats = list(map(Chats.from_json, data.pop('chats')))
-        except:
-            pass
+        game_update = cls()
+        game_update._raw = data
+        return game_update
 
-        playersState = []
-        try:
-            playersState = list(map(Struct.from_json, data.pop('playersState')))
-        except:
-            pass
+    def __getattr__(self, name):
+        # only called for attributes that have not been parsed yet
+        raw = self.__dict__.get('_raw', {})
+        if name not in raw and name not in self.OPTIONAL_SECTIONS:
+            raise AttributeError(name)
+        parse = self.SECTIONS.get(name, lambda data: data)
+        if name in self.OPTIONAL_SECTIONS:
+            try:
+                value = parse(raw.pop(name))
+            except:
+                value = []
+        else:
+            value = parse(raw.pop(name))
+        self.__dict__[name] = value
+        return value
 
-        cardFlingerState = []
-        try: 
-            cardFlingerState = list(map(CardFlingerState.from_json, data.pop('cardFlingerState')))
-        except:
-            pass
 
-        args = {   
-            'gameState':Struct.from_json(data.pop('gameState')),
-            'chats':chats,
-            'general':Struct.from_json(data.pop('general')),
-            'customGameSettings':Struct.from_json(data.pop('customGameSettings')),
-            'publicPlayersState':list(map(PublicPlayersState.from_json, data.pop('publicPlayersState'))),
-            'playersState':playersState,
-            'trackState':TrackState.from_json(data.pop('trackState')),
-            'cardFlingerState':cardFlingerState,
-            **data
-        }
-        return cls(**args)
+def _late_game_payload(num_players=10, num_chats=2000):
+    """
+    game_update payload of a game with a long chat history, as sent by the server
+    """
+    card_status = {'cardDisplayed': True, 'isFlipped': False, 'cardFront': 'secretrole',
+                   'cardBack': {'icon': 0, 'roleName': 'liberal', 'team': 'liberal'}}
+    return {
+        'gameState': {'isStarted': True, 'phase': 'voting', 'presidentIndex': 3, 'undrawnPolicyCount': 6,
+                      'clickActionInfo': ['', list(range(num_players))]},
+        'chats': [{'chat': [{'text': f'message {i}', 'type': 'player'}] * 3, 'userName': f'player{i % num_players}',
+                   'timestamp': i, 'gameChat': i % 2 == 0} for i in range(num_chats)],
+        'general': {'uid': 'benchmark', 'playerCount': num_players, 'electionCount': 12},
+        'customGameSettings': {'powers': ['investigate', 'investigate', 'election', 'bullet', 'bullet']},
+        'publicPlayersState': [{'userName': f'player{i}', 'governmentStatus': '', 'isDead': False,
+                                'cardStatus': dict(card_status)} for i in range(num_players)],
+        'playersState': [{'notificationStatus': '', 'nameStatus': '', 'hasVoted': False} for _ in range(num_players)],
+        'trackState': {'liberalPolicyCount': 4, 'fascistPolicyCount': 5, 'electionTrackerCount': 1,
+                       'enactedPolicies': [{'position': 'fascist0', 'cardBack': 'fascist'}] * 9},
+        'cardFlingerState': [{'position': 'middle-left', 'cardStatus': {'isFlipped': False}}] * 2,
+    }
 
 
 """
@@ -258,3 +285,22 @@ private
                     cardFront string
                     cardBack string
 """
+
+
+if __name__ == "__main__":
+    import time
+    for num_chats in [0, 1000, 10000]:
+        # parsing consumes the payloads, so each run gets fresh ones
+        payloads = [_late_game_payload(num_chats=num_chats) for _ in range(40)]
+        start = time.perf_counter()
+        for payload in payloads[:20]:
+            # what SecretHitlerBot.game_update reads
+            game_update = GameUpdate.from_json(payload)
+            game_update.gameState.phase, game_update.trackState, game_update.publicPlayersState
+        handled = (time.perf_counter() - start) / 20
+        start = time.perf_counter()
+        for payload in payloads[20:]:
+            game_update = GameUpdate.from_json(payload)
+            [getattr(game_update, section) for section in GameUpdate.SECTIONS]
+        parsed = (time.perf_counter() - start) / 20
+        print(f'{num_chats} chats: {handled * 1e6:.0f}us handled, {parsed * 1e6:.0f}us fully parsed')
@@ -3,6 +3,7 @@
 Usage:
   run_sh_game <agent>... [options]
   run_sh_game --random [options]
+  run_sh_game --mass <agent>... [options]
   run_sh_game -h | --help
   run_sh_game -v | --versions
 
@@ -13,6 +14,7 @@ Options:
   -l --log=<level>              Set the log level [default: INFO].
   -n --games=<num_games>        Set the number of games to play. [default: 1]
   --random                      Randomize number and type of agents.
+  --mass                        Simulate all games at once. Only random and selfish agents are supported.
   --enable-mongo                Send game data to mongodb.
   --mongo-user=<user>           Set mongodb user.
   --mongo-password=<password>   Set mongodb password.
@@ -20,14 +22,18 @@ Options:
   --mongo-port=<port>           Set mongodb port [default: 27017].
 """
 import logging
+import os
 import random
 import time
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict, Counter
+from typing import List, Tuple, Dict
 from pymongo import MongoClient, errors
 from docopt import docopt
 
-from battlefield import run_game
-from agents import SelfishAgent, RandomAgent, SOISMCTSAgent100, SOISMCTSAgent10000, PIMCAgent10000, PIMCAgent100, Agent
+from battlefield import run_game, run_baseline_games, BASELINE_AGENT_NAMES
+from agents import SelfishAgent, RandomAgent, SOISMCTSAgent100, SOISMCTSAgent10000, SOISMCTSAgentAdaptive, \
+    SOISMCTSAgentPondering, PIMCAgent10000, PIMCAgent100, PIMCAgentBatch, Agent
 from secrethitler import SecretRole, SecretHitlerState, SECRET_HITLER_POSSIBLE_ROLES, HiddenSecretHitlerState, \
     POSSIBLE_DECKS, PolicyDeck, DECK_SIZE, Party, Phase
 
@@ -42,8 +48,19 @@ AGENT_MAP = {
     'random': RandomAgent,
     'selfish': SelfishAgent,
     # 'pimc': PIMCAgent10000,
-    'soismcts': SOISMCTSAgent10000
+    'pimc-batch': PIMCAgentBatch,
+    'soismcts': SOISMCTSAgent10000,
+    'soismcts-adaptive': SOISMCTSAgentAdaptive,
+    'soismcts-ponder': SOISMCTSAgentPondering,
 }
+PONDERING_AGENTS = {SOISMCTSAgentPondering}  # agents searching in worker processes of an executor they are given
+
+
+def check_role_list(role_list: List[str]):
+    for role in role_list:
+        if role not in HIDDEN_STATE_MAP.keys():
+            print(f'Role list may only contain {HIDDEN_STATE_MAP.keys()}\n{__doc__}')
+            exit(1)
 
 
 def get_hidden_state(roles: List[str]) -> Tuple[SecretRole]:
@@ -120,6 +137,70 @@ def push_agent_summary_data(state: SecretHitlerState, agents: List[Agent], mongo
         _push_agent(agent_data, update, retries=0)
 
 
+def push_with_retries(push, retries=0):
+    """
+    Calls push, retrying it after a pause while the connection to mongo is lost
+    """
+    if retries > 5:
+        logging.error(f'Retry limit exceeded. Moving on.')
+        return
+    try:
+        push()
+    except (errors.ServerSelectionTimeoutError, errors.AutoReconnect) as e:
+        logging.error(e)
+        time.sleep(random.randint(10, 120))
+        push_with_retries(push, retries=retries + 1)
+
+
+def push_mass_summary_data(summaries: List[Dict], mongo_client: MongoClient):
+    """
+    Pushes the game summaries of a mass simulation, with agent summaries aggregated into one update per agent and role
+    """
+    secrethitler = mongo_client.secrethitler2
+
+    def insert_summaries():
+        try:
+            secrethitler.game_summaries.insert_many(summaries, ordered=False)
+        except errors.BulkWriteError as e:
+            # insert_many sets the _id of every summary, so the ones inserted before a lost connection are duplicates
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+
+    push_with_retries(insert_summaries)
+
+    updates = defaultdict(Counter)
+    for summary in summaries:
+        num_players, winning_party, reason = summary['num_players'], summary['winning_party'], summary['win_reason']
+        for player in summary['players']:
+            win = SecretRole[player['role']].party().name == winning_party
+            updates[player['name'], player['role']].update([
+                'total_wins' if win else 'total_losses',
+                f'win_reasons.{reason}' if win else f'loss_reasons.{reason}',
+                f'{num_players}p.wins' if win else f'{num_players}p.losses',
+                f'{num_players}p.win_reasons.{reason}' if win else f'{num_players}p.loss_reasons.{reason}',
+            ])
+    for (name, role), counts in updates.items():
+        agent_data = {'agent': name, 'secret_role': role}
+        push_with_retries(lambda: secrethitler.agent_summaries.update_one(
+            agent_data, {'$setOnInsert': agent_data, '$inc': dict(counts)}, upsert=True))
+
+
+def run_mass_games(agents: List[str], role_list: List[str], num_games: int) -> List[Dict]:
+    for agent in agents:
+        if agent not in AGENT_MAP.keys() or AGENT_MAP[agent] not in BASELINE_AGENT_NAMES:
+            print(f'Mass simulation only supports {[a for a, c in AGENT_MAP.items() if c in BASELINE_AGENT_NAMES]}\n{__doc__}')
+            exit(1)
+    lineup = [AGENT_MAP[agent] for agent in agents]
+    roles = [get_hidden_state(role_list) for _ in range(num_games)]
+
+    start_time = time.time()
+    summaries = run_baseline_games([lineup] * num_games, roles=roles)
+    liberal_wins = sum(summary['winning_party'] == Party.liberal.name for summary in summaries)
+    logging.info(f'simulated {num_games} games in {time.time() - start_time} seconds, '
+                 f'liberal win rate {liberal_wins / num_games:.3f}')
+    return summaries
+
+
 def push_data_to_mongo(number_players: int, state: SecretHitlerState, agents: List[Agent], mongo_client: MongoClient):
     push_game_summary_data(num_players=number_players, state=state, agents=agents, mongo_client=mongo_client)
     push_agent_summary_data(state=state, agents=agents, mongo_client=mongo_client)
@@ -135,6 +216,20 @@ if __name__ == '__main__':
     logging.basicConfig(level=numeric_level)
     logging.debug(f'args={args}')
 
+    if args['--mass']:
+        agents = args['<agent>']
+        role_list = args['--roles'].lower().split(',') if args['--roles'] is not None else ['' for _ in range(len(agents))]
+        if len(agents) != len(role_list) or len(agents) not in range(5, 11):
+            print(f'Invalid agent or role list.\n{__doc__}')
+            exit(1)
+        check_role_list(role_list)
+        summaries = run_mass_games(agents, role_list, int(args['--games']))
+        if args['--enable-mongo']:
+            uri = f'mongodb://{args["--mongo-user"]}:{args["--mongo-password"]}@{args["--mongo-host"]}:{args["--mongo-port"]}'
+            push_mass_summary_data(summaries, MongoClient(uri))
+        exit(0)
+
+    executor = None  # shared by the pondering agents of every game
     for i in range(int(args['--games'])):
         start_time = time.time()
         logging.info(f'========================= Game {i} Started =========================')
@@ -151,10 +246,7 @@ if __name__ == '__main__':
             print(f'Invalid number of players: {num_players}. Only 5 - 10 players allowed.\n{__doc__}')
             exit(1)
 
-        for role in role_list:
-            if role not in HIDDEN_STATE_MAP.keys():
-                print(f'Role list may only contain {HIDDEN_STATE_MAP.keys()}\n{__doc__}')
-                exit(1)
+        check_role_list(role_list)
         for agent in agents:
             if agent not in AGENT_MAP.keys():
                 print(f'Agent list may only contain {AGENT_MAP.keys()}\n{__doc__}')
@@ -162,7 +254,12 @@ if __name__ == '__main__':
 
         hidden_roles = get_hidden_state(role_list)
         policy_deck = PolicyDeck(random.choice(list(filter(lambda d: len(d) == DECK_SIZE, POSSIBLE_DECKS))))
-        agent_instances = [AGENT_MAP[agt](player_id=i, num_players=num_players, secret_role=hidden_roles[i])
+        num_pondering = sum(AGENT_MAP[agt] in PONDERING_AGENTS for agt in agents)
+        if num_pondering > 0 and executor is None:
+            executor = ProcessPoolExecutor()
+        pondering_args = {'executor': executor, 'workers': max(1, (os.cpu_count() or 1) // max(1, num_pondering))}
+        agent_instances = [AGENT_MAP[agt](player_id=i, num_players=num_players, secret_role=hidden_roles[i],
+                                          **(pondering_args if AGENT_MAP[agt] in PONDERING_AGENTS else {}))
                            for i, agt in enumerate(agents)]
         hidden_state = HiddenSecretHitlerState(hidden_roles=hidden_roles, policy_deck=policy_deck, discard_pile=[],
                                                proposed_policies=())
@@ -183,4 +280,7 @@ if __name__ == '__main__':
             push_data_to_mongo(number_players=num_players, state=state, agents=agent_instances, mongo_client=client)
             logging.info(f'================== Finished pushing results of game {i} to Mongo ======================\n\n')
 
+    if executor is not None:
+        executor.shutdown()
+
 
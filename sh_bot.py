@@ -1,8 +1,9 @@
 """Secret Hitler Bot.
 
 Usage:
-  sh_bot new game <username> <password> [--scheme=<scheme>] [--host=<host>] [--strategy=<strategy>] [--log=<level>]
-  sh_bot join game <gameuid> <username> <password> [--scheme=<scheme>] [--host=<host>] [--strategy=<strategy>] [--log=<level>]
+  sh_bot new game <username> <password> [--scheme=<scheme>] [--host=<host>] [--strategy=<strategy>] [--ponder] [--join-timeout=<seconds>] [--session-cache=<dir>] [--log=<level>]
+  sh_bot join game <gameuid> <username> <password> [--scheme=<scheme>] [--host=<host>] [--strategy=<strategy>] [--ponder] [--join-timeout=<seconds>] [--session-cache=<dir>] [--log=<level>]
+  sh_bot fleet <accounts> [--table-size=<size>] [--connections=<limit>] [--scheme=<scheme>] [--host=<host>] [--strategy=<strategy>] [--ponder] [--join-timeout=<seconds>] [--session-cache=<dir>] [--log=<level>]
   sh_bot -h | --help
   sh_bot -v | --version
 
@@ -11,28 +12,60 @@ Options:
   -v --version                    Show version
   --scheme=<scheme>               Specify a network scheme [default: http]
   --host=<host>                   Specify a host [default: localhost:8080]
-  --strategy=<strategy>           Specify an agent strategy to use [default: random]
+  --strategy=<strategy>           Specify an agent strategy to use: random, soismcts or pimc [default: random]
+  --ponder                        Search the bot's votes while the president nominates (soismcts and pimc)
+  --join-timeout=<seconds>        Give up joining a game after this many seconds [default: 300]
+  --session-cache=<dir>           Directory keeping the login cookies of the accounts across restarts [default: .sh_bot_sessions]
   --log=<level>                   Specify logging level [default: INFO]
+  --table-size=<size>             Number of fleet accounts seated at each new game [default: 5]
+  --connections=<limit>           Maximum number of HTTP connections shared by the fleet [default: 100]
+
+A fleet runs every account of the <accounts> file, one "username password" pair per line, on one event loop.
+The first account of each group of --table-size accounts creates a game that the others of the group join.
+
+A bot reuses the login cookie of its account from the session cache instead of signing in again, and signs in
+when the server rejects it.
+
+The soismcts and pimc strategies search with the engine in a process pool shared by every bot of the process.
 """
 
 from docopt import docopt
 import socketio
 import asyncio
+import random
 import aiohttp
+import json
 import logging
-from util.json import JSON
+import os
+from concurrent.futures import ProcessPoolExecutor
+from util.json import JSON, Encoded, Packet
 from models.new_game import NewGame
 from models.account import Account
 from models.game_update import GameUpdate
 from agents.random_strategy import RandomStrategy
+from agents.engine_strategy import EngineStrategy
+from agents.soismcts_agent import SOISMCTSAgentBase
+from agents.pimc_agent import PIMCAgentBase
 from actions import Actions
 
 
+JOIN_RETRY_DELAY = 0.5  # seconds before the first retry of a join step, doubled after each retry
+JOIN_MAX_RETRY_DELAY = 30
+NEW_GAME = Encoded(NewGame())
+ENGINE_AGENTS = {
+    'soismcts': SOISMCTSAgentBase,
+    'pimc': PIMCAgentBase,
+}
+
+
 class SecretHitlerBot:
-    def __init__(self, username, password, scheme, host, new, gameuid, strategy='random', **kwargs):
+    def __init__(self, username, password, scheme, host, new, gameuid, strategy='random', table=None, executor=None,
+                 ponder=False, jointimeout=300, sessioncache=None, **kwargs):
         self.logger = logging.getLogger(__name__)
         if strategy == 'random':
             self.strategy = RandomStrategy()
+        elif strategy in ENGINE_AGENTS:
+            self.strategy = EngineStrategy(ENGINE_AGENTS[strategy], username, executor, name=strategy, ponder=ponder)
         else:
             raise ValueError('invalid strategy')
         self.username = username
@@ -40,13 +73,20 @@ class SecretHitlerBot:
         self.url = scheme + '://' + host
         self.createNewGame = new
         self.gameUID = gameuid
+        self.table = table  # future of the uid of the game created for this bot's fleet table
         self.logger.debug(f'url: {self.url}')
-        self.lock = asyncio.Lock()
         self.sio = None
-        self.inGame = False
+        self.joinTimeout = float(jointimeout)
+        self.sessionCache = sessioncache
+        self.account = Encoded(Account(userName=username))
+        self.handshake = {} if sessioncache is None else sessioncache.handshake(username)
+        self.seated = asyncio.Event()
         self.gameUpdate = None
-        self.voted = False
-        self.inUserList = False
+        self.pendingUpdate = None
+        self.updateAvailable = None
+        self.decided = set()  # (game uid, election count, phase) of the decisions already sent, (uid, 'remake')
+        self.decidedGame = None  # uid of the game self.decided is kept for
+        self.listed = asyncio.Event()
 
     def register_socketio_events(self):
         @self.sio.event
@@ -61,117 +101,318 @@ class SecretHitlerBot:
         @self.sio.event
         async def fetch_user():
             await self.sio.emit('getUserGameSettings') # to push user onto userList
-            await self.sio.emit('confirmTOU')
-            await self.sio.emit('hasSeenNewPlayerModal')
-            await self.sio.emit('sendUser', Account(userName=self.username))
+            # the account remembers these, so they are only sent until the cache knows they went through
+            for event in ['confirmTOU', 'hasSeenNewPlayerModal']:
+                if not self.handshake.get(event):
+                    await self.sio.emit(event)
+                    self.handshake[event] = True
+            await self.sio.emit('sendUser', self.account)
+            if self.sessionCache is not None:
+                self.sessionCache.save_handshake(self.username, self.handshake)
 
         # if server redirects to game, update user status
         @self.sio.event
         async def join_game_redirect(uid):
             self.logger.log(25, f'joining game {uid}')
+            if self.table is not None and not self.table.done():
+                self.table.set_result(uid)
             await self.sio.emit('updateSeatedUser', { "uid": uid })
 
         @self.sio.event
         def update_seat_for_user(success=True):
             if success:
-                self.inGame = True
+                self.seated.set()
 
         @self.sio.event
         def user_list(data):
             self.logger.debug(data)
             for user in data['list']:
                 if user['userName'] == self.username:
-                    self.inUserList = True
+                    self.listed.set()
                     return
-            self.inUserList = False   
+            self.listed.clear()
 
         @self.sio.event
         async def game_update(data, noChats=False):
-            async with self.lock:
-                self.gameUpdate = GameUpdate.from_json(data)
-                self.strategy.gameState = self.gameUpdate
-                try:
-                    self.gameUpdate.gameState.isStarted
-                    self.gameUpdate.gameState.phase
-                except:
-                    return
-                
-                gameState = self.gameUpdate.gameState
-                general = self.gameUpdate.general
-                trackState = self.gameUpdate.trackState
-                try:
-                    self.logger.log(25, f'{gameState.isCompleted} win!')
-                    self.logger.log(25, f'voting to remake {general.uid}')
-                    await self.sio.emit('updateRemake', { 'remakeStatus':True, 'uid': general.uid })
-                    return
-                except:
-                    pass
-
-                actions = Actions(gameUpdate=self.gameUpdate, sio=self.sio, strategy=self.strategy, username=self.username)
-
-                # game is started and phase is active
-                if gameState.phase =='voting':
-                    if not self.voted:
-                        await actions.votingPhase()
-                        self.voted = True
-                elif gameState.phase == 'selectingChancellor':
-                    await actions.selectingChancellorPhase()
-                    self.voted = False
-                elif gameState.phase == 'presidentVoteOnVeto':
-                    await actions.presidentVoteOnVetoPhase()
-                elif gameState.phase == 'chancellorVoteOnVeto':
-                    await actions.chancellorVoteOnVetoPhase()
-                elif gameState.phase == 'chancellorSelectingPolicy':
-                    await actions.chancellorSelectingPolicyPhase()
-                elif gameState.phase == 'presidentSelectingPolicy':
-                    await actions.presidentSelectingPolicyPhase()
-                elif gameState.phase == 'enactPolicy':
-                    power = self.gameUpdate.customGameSettings.powers[trackState.fascistPolicyCount-1]
-                    if not trackState.enactedPolicies[len(trackState.enactedPolicies)-1].position == 'middle':
-                        if power == 'deckpeek':
-                            await actions.deckpeekPhase()
-                        elif power == 'peekdrop':
-                            await actions.peekdropPhase()
-                        else:
-                            raise ValueError('unsupported operation')
-                elif gameState.phase == 'presidentVoteOnBurn':
-                    await actions.presidentVoteOnBurnPhase()
-                elif gameState.phase == 'selectPartyMembershipInvestigate':
-                    await actions.selectPartyMembershipInvestigatePhase()
-                elif gameState.phase == 'selectPartyMembershipInvestigateReverse':
-                    await actions.selectPartyMembershipInvestigateReversePhase()
-                elif gameState.phase == 'specialElection':
-                    await actions.specialElectionPhase()
-                elif gameState.phase == 'execution':
-                    await actions.executionPhase()  
-                elif gameState.phase == '':
-                    self.logger.log(25, 'no game state')
+            # latest wins: an update arriving while a decision is in flight replaces the pending one
+            self.pendingUpdate = GameUpdate.from_json(data)
+            self.strategy.observe(self.pendingUpdate)
+            self.updateAvailable.set()
+
+    async def process_updates(self):
+        """
+        Handles the newest game update whenever one is pending, so updates superseded during a decision are dropped
+        """
+        while True:
+            await self.updateAvailable.wait()
+            self.updateAvailable.clear()
+            gameUpdate, self.pendingUpdate = self.pendingUpdate, None
+            try:
+                await self.handle_game_update(gameUpdate)
+            except Exception:
+                self.logger.exception('failed to handle game update')
+
+    async def handle_game_update(self, gameUpdate):
+        self.gameUpdate = gameUpdate
+        self.strategy.gameState = self.gameUpdate
+        try:
+            self.gameUpdate.gameState.isStarted
+            self.gameUpdate.gameState.phase
+        except:
+            return
+
+        gameState = self.gameUpdate.gameState
+        general = self.gameUpdate.general
+        trackState = self.gameUpdate.trackState
+        if general.uid != self.decidedGame:
+            # decisions are only remembered for the current game, so a bot playing game after game does not keep them
+            self.decidedGame = general.uid
+            self.decided.clear()
+        try:
+            gameState.isCompleted
+            if (general.uid, 'remake') not in self.decided:
+                self.logger.log(25, f'{gameState.isCompleted} win!')
+                self.logger.log(25, f'voting to remake {general.uid}')
+                await self.sio.emit('updateRemake', { 'remakeStatus':True, 'uid': general.uid })
+                self.decided.add((general.uid, 'remake'))
+            return
+        except AttributeError:
+            pass
+
+        # a decision is made once per game, election and phase, however many updates show it
+        decision = (general.uid, general.electionCount, gameState.phase)
+        if decision in self.decided:
+            return
+
+        actions = Actions(gameUpdate=self.gameUpdate, sio=self.sio, strategy=self.strategy, username=self.username)
+
+        # game is started and phase is active
+        acted = False
+        if gameState.phase =='voting':
+            acted = await actions.votingPhase()
+        elif gameState.phase == 'selectingChancellor':
+            acted = await actions.selectingChancellorPhase()
+        elif gameState.phase == 'presidentVoteOnVeto':
+            acted = await actions.presidentVoteOnVetoPhase()
+        elif gameState.phase == 'chancellorVoteOnVeto':
+            acted = await actions.chancellorVoteOnVetoPhase()
+        elif gameState.phase == 'chancellorSelectingPolicy':
+            acted = await actions.chancellorSelectingPolicyPhase()
+        elif gameState.phase == 'presidentSelectingPolicy':
+            acted = await actions.presidentSelectingPolicyPhase()
+        elif gameState.phase == 'enactPolicy':
+            power = self.gameUpdate.customGameSettings.powers[trackState.fascistPolicyCount-1]
+            if not trackState.enactedPolicies[len(trackState.enactedPolicies)-1].position == 'middle':
+                if power == 'deckpeek':
+                    acted = await actions.deckpeekPhase()
+                elif power == 'peekdrop':
+                    acted = await actions.peekdropPhase()
                 else:
-                    raise ValueError(gameState.phase)
+                    raise ValueError('unsupported operation')
+        elif gameState.phase == 'presidentVoteOnBurn':
+            acted = await actions.presidentVoteOnBurnPhase()
+        elif gameState.phase == 'selectPartyMembershipInvestigate':
+            acted = await actions.selectPartyMembershipInvestigatePhase()
+        elif gameState.phase == 'selectPartyMembershipInvestigateReverse':
+            acted = await actions.selectPartyMembershipInvestigateReversePhase()
+        elif gameState.phase == 'specialElection':
+            acted = await actions.specialElectionPhase()
+        elif gameState.phase == 'execution':
+            acted = await actions.executionPhase()
+        elif gameState.phase == '':
+            self.logger.log(25, 'no game state')
+        else:
+            raise ValueError(gameState.phase)
+        if acted:
+            self.decided.add(decision)
 
-    async def run(self):
+    async def signin(self, session):
         login_data = {'username': self.username, 'password': self.password}
         self.logger.debug(f'login_data: {login_data}')
-        async with aiohttp.ClientSession() as session:
-            await session.post(self.url + '/account/signin', data=login_data)
-            self.sio = socketio.AsyncClient(json=JSON)
-            self.sio.eio.http = session # preserves cookie from login
+        async with session.post(self.url + '/account/signin', data=login_data) as response:
+            self.logger.debug(f'{self.username} signed in with status {response.status}')
+
+    async def connect(self, session):
+        """
+        Connects with the cached login cookie of the account when there is one, signing in when there is none or
+        the server rejects it
+        """
+        if self.sessionCache is not None and self.sessionCache.load(self.username, session.cookie_jar):
+            try:
+                await self.sio.connect(self.url)
+                return
+            except socketio.exceptions.ConnectionError:
+                self.logger.info(f'cached session of {self.username} was rejected')
+                self.sessionCache.forget(self.username)
+                self.handshake = {}
+                session.cookie_jar.clear()
+        await self.signin(session)
+        await self.sio.connect(self.url)
+        if self.sessionCache is not None:
+            self.sessionCache.save(self.username, session.cookie_jar)
+
+    async def run(self, session_factory=aiohttp.ClientSession):
+        async with session_factory() as session:
+            # preserves cookie from login, and as an external session it survives a rejected connection
+            self.sio = socketio.AsyncClient(json=JSON, serializer=Packet, http_session=session)
             
             self.register_socketio_events()
+            self.updateAvailable = asyncio.Event()
+            updates = asyncio.create_task(self.process_updates())
+
+            try:
+                await self.connect(session)
+                if await self.join():
+                    await self.sio.wait()
+                else:
+                    self.logger.error(f'{self.username} could not join a game within {self.joinTimeout} seconds')
+            finally:
+                updates.cancel()
+                self.strategy.close()
+                # also when stopped, so that the engine.io tasks are done before the session closes
+                await self.sio.disconnect()
 
-            await self.sio.connect(self.url)
+    async def join(self):
+        """
+        Waits to be on the user list, then creates or joins the game. Returns whether the bot was seated in time.
+        """
+        if not await self.until(self.listed, lambda: self.sio.emit('sendUser', self.account)):
+            return False
+        if self.createNewGame:
+            await self.sio.emit('addNewGame', NEW_GAME)
+            return await self.until(self.seated)
+        if self.gameUID is None and self.table is not None:
+            try:
+                # shielded, the table is shared with the other bots of the fleet
+                self.gameUID = await asyncio.wait_for(asyncio.shield(self.table), self.joinTimeout)
+            except asyncio.TimeoutError:
+                return False
+        await self.sio.emit('getGameInfo', self.gameUID)
+        return await self.until(self.seated, lambda: self.sio.emit('getGameInfo', self.gameUID))
 
-            while not self.inUserList:
-                await self.sio.sleep(1)
+    async def until(self, event, retry=None):
+        """
+        Waits for event to be set by a handler, awaiting retry() each time a wait of exponential backoff with jitter
+        runs out. Returns False when the join timeout passed first.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.joinTimeout
+        delay = JOIN_RETRY_DELAY
+        while not event.is_set():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, random.uniform(delay / 2, delay)))
+            except asyncio.TimeoutError:
+                if retry is not None:
+                    await retry()
+                delay = min(2 * delay, JOIN_MAX_RETRY_DELAY)
+        return True
 
-            if self.createNewGame:
-                await self.sio.emit('addNewGame', NewGame())
-            else:
-                while not self.inGame:
-                    await self.sio.emit('getGameInfo', self.gameUID)
-                    await self.sio.sleep(5)
-         
-            await self.sio.wait()
+
+class SessionFactory:
+    """
+    HTTP sessions of a bot fleet. They share one connection pool, but each has its own cookie jar so that the
+    login cookies of the accounts stay apart.
+    """
+    def __init__(self, limit=100):
+        self.connector = aiohttp.TCPConnector(limit=limit)
+
+    def __call__(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(connector=self.connector, connector_owner=False, cookie_jar=aiohttp.CookieJar())
+
+    async def close(self):
+        await self.connector.close()
+
+
+class SessionCache:
+    """
+    Login cookies and completed handshake steps of accounts, kept in directory so that restarted bots skip them
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        # the cookies sign the accounts in, so only the bot's user may read or replace them
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)
+
+    def path(self, username, suffix):
+        return os.path.join(self.directory, ''.join(c if c.isalnum() else '_' for c in username) + suffix)
+
+    def private_path(self, username, suffix):
+        """
+        Path of a cache file of username, created readable and writable by the owner only
+        """
+        path = self.path(username, suffix)
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+        os.chmod(path, 0o600)
+        return path
+
+    def load(self, username, cookie_jar) -> bool:
+        """
+        Loads the cookies of username into cookie_jar, returns whether there were any
+        """
+        try:
+            cookie_jar.load(self.path(username, '.cookies'))
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            # a truncated or corrupt cache falls back to signing in
+            logging.getLogger(__name__).warning(f'discarding unreadable session cache of {username}: {e!r}')
+            cookie_jar.clear()
+            self.forget(username)
+            return False
+        return len(cookie_jar) > 0
+
+    def save(self, username, cookie_jar):
+        cookie_jar.save(self.private_path(username, '.cookies'))
+
+    def handshake(self, username) -> dict:
+        try:
+            with open(self.path(username, '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_handshake(self, username, handshake: dict):
+        with open(self.private_path(username, '.json'), 'w') as f:
+            json.dump(handshake, f)
+
+    def forget(self, username):
+        for suffix in ['.cookies', '.json']:
+            try:
+                os.remove(self.path(username, suffix))
+            except FileNotFoundError:
+                pass
+
+
+def read_accounts(path):
+    accounts = []
+    with open(path) as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                username, password = line.split()
+                accounts.append((username, password))
+    return accounts
+
+
+async def run_fleet(accounts, scheme, host, strategy='random', tablesize=5, connections=100, executor=None,
+                    ponder=False, jointimeout=300, sessioncache=None):
+    """
+    Runs a bot per account as tasks of the current event loop, seated tablesize to a game
+    """
+    session_factory = SessionFactory(limit=connections)
+    bots = []
+    for start in range(0, len(accounts), tablesize):
+        table = asyncio.get_running_loop().create_future()
+        for seat, (username, password) in enumerate(accounts[start:start + tablesize]):
+            bots.append(SecretHitlerBot(username, password, scheme, host, new=seat == 0, gameuid=None,
+                                        strategy=strategy, table=table, executor=executor,
+                                        ponder=ponder, jointimeout=jointimeout, sessioncache=sessioncache))
+    try:
+        await asyncio.gather(*(bot.run(session_factory) for bot in bots))
+    finally:
+        await session_factory.close()
 
 
 def clean_args(arguments):
@@ -198,9 +439,22 @@ if __name__ == '__main__' and __package__ is None:
     logger.debug(f'args:\n{args}')
     
     args = clean_args(args)
+    args['sessioncache'] = SessionCache(args['sessioncache'])
 
-    bot = SecretHitlerBot(**args)
-    asyncio.run(bot.run())
+    # engine searches are CPU bound, so they run in worker processes rather than on the event loop
+    executor = ProcessPoolExecutor() if args['strategy'] in ENGINE_AGENTS else None
+    try:
+        if args['fleet']:
+            asyncio.run(run_fleet(read_accounts(args['accounts']), args['scheme'], args['host'], args['strategy'],
+                                  int(args['tablesize']), int(args['connections']), executor, args['ponder'],
+                                  float(args['jointimeout']), args['sessioncache']))
+        else:
+            bot = SecretHitlerBot(**args, executor=executor)
+            asyncio.run(bot.run())
+    finally:
+        if executor is not None:
+            # searches still queued were cancelled along with the tasks awaiting them, running ones are waited for
+            executor.shutdown(wait=True)
     
 
 
@@ -0,0 +1,496 @@
+"""Secret Hitler Stand-in Server.
+
+Usage:
+  sh_server serve [--host=<host>] [--port=<port>] [--log=<level>]
+  sh_server loadtest <bots> [--duration=<seconds>] [--strategy=<strategy>] [--thinking] [--connections=<limit>] [--port=<port>] [--log=<level>]
+  sh_server -h | --help
+  sh_server -v | --version
+
+Options:
+  -h --help                       Show this screen
+  -v --version                    Show version
+  --host=<host>                   Interface to listen on [default: localhost]
+  --port=<port>                   Port to listen on [default: 8080]
+  --duration=<seconds>            Length of the load test [default: 60]
+  --strategy=<strategy>           Strategy of the load test bots: random, soismcts or pimc [default: random]
+  --thinking                      Keep the thinking time of the random strategy in the load test
+  --connections=<limit>           Maximum number of HTTP connections shared by the bots [default: 1000]
+  --log=<level>                   Specify logging level [default: WARNING]
+
+The stand-in implements the part of the Secret Hitler web server that sh_bot uses: signing in, the user handshake,
+creating and joining games and the decisions of a game. Games are played by the engine and a finished game is
+remade once all its players asked for it, so a fleet keeps playing.
+
+A load test serves on localhost and runs a fleet of <bots> bots against it on the same event loop. It reports
+the latency from the game_update asking a bot for a decision to the bot's answer, and the decision throughput.
+"""
+
+import asyncio
+import logging
+import random
+import statistics
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import socketio
+from aiohttp import web
+from docopt import docopt
+
+from secrethitler import SecretHitlerState, HiddenSecretHitlerState, PolicyDeck, Phase, Party, Power, SecretRole, \
+    SECRET_HITLER_POSSIBLE_ROLES, POSSIBLE_DECKS, DECK_SIZE, LIB_ROLES, InvestigatePowerObservation, \
+    NominateChancellorAction, VoteAction, PolicyChoiceAction, VetoAction, DeckpeekPowerAction, BulletPowerAction, \
+    InvestigateAction, SpecialElectionAction
+
+logger = logging.getLogger(__name__)
+
+POWERS = {
+    Power.none: None,
+    Power.investigate: 'investigate',
+    Power.deckpeek: 'deckpeek',
+    Power.specialelection: 'election',
+    Power.bullet: 'bullet',
+}
+POWER_PHASES = {
+    Power.deckpeek: 'enactPolicy',
+    Power.bullet: 'execution',
+    Power.investigate: 'selectPartyMembershipInvestigate',
+    Power.specialelection: 'specialElection',
+}
+PHASES = {
+    Phase.nomination: 'selectingChancellor',
+    Phase.vote: 'voting',
+    Phase.presidentSelectPolicy: 'presidentSelectingPolicy',
+    Phase.chancellorSelectPolicy: 'chancellorSelectingPolicy',
+    Phase.veto: 'presidentVoteOnVeto',
+}
+# decision events of the bot, the phase they answer and the key of the answer in their payload
+DECISIONS = {
+    'presidentSelectedChancellor': ('selectingChancellor', 'chancellorIndex'),
+    'selectedVoting': ('voting', 'vote'),
+    'selectedPresidentPolicy': ('presidentSelectingPolicy', 'selection'),
+    'selectedChancellorPolicy': ('chancellorSelectingPolicy', 'selection'),
+    'selectedChancellorVoteOnVeto': ('chancellorVoteOnVeto', 'vote'),
+    'selectedPresidentVoteOnVeto': ('presidentVoteOnVeto', 'vote'),
+    'selectedPolicies': ('enactPolicy', None),
+    'selectedPlayerToExecute': ('execution', 'playerIndex'),
+    'selectPartyMembershipInvestigate': ('selectPartyMembershipInvestigate', 'playerIndex'),
+    'selectedSpecialElection': ('specialElection', 'playerIndex'),
+}
+TARGET_ACTIONS = {
+    'execution': BulletPowerAction,
+    'selectPartyMembershipInvestigate': InvestigateAction,
+    'specialElection': SpecialElectionAction,
+}
+CARD_POSITIONS = ['middle-left', 'middle-center', 'middle-right']
+
+
+class LoadStats:
+    """
+    Latencies from the update asking a player for a decision to its answer, per user
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.latencies = defaultdict(list)
+        self.updates = 0
+        self.games = 0
+
+    def record(self, username: str, latency: float):
+        self.latencies[username].append(latency)
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.start
+        latencies = sorted(latency for user in self.latencies.values() for latency in user)
+        report = {'bots': len(self.latencies), 'seconds': round(elapsed, 1), 'games': self.games,
+                  'decisions': len(latencies), 'decisions/s': round(len(latencies) / elapsed, 1),
+                  'updates/s': round(self.updates / elapsed, 1)}
+        if latencies:
+            for percentile in [50, 95, 99]:
+                report[f'p{percentile} ms'] = round(1000 * latencies[int(percentile / 100 * (len(latencies) - 1))], 1)
+            report['max ms'] = round(1000 * latencies[-1], 1)
+            report['worst bot mean ms'] = round(1000 * max(map(statistics.mean, self.latencies.values())), 1)
+        return report
+
+
+class Game:
+    """
+    A table of the stand-in server, played by the engine.
+
+    The engine state is translated into the phases of the web server. The web server asks the chancellor for a
+    policy before the veto, so a chancellor's VetoAction is asked for as chancellorVoteOnVeto after its selection.
+    """
+    def __init__(self, uid: str, name: str, num_players: int):
+        self.uid = uid
+        self.name = name
+        self.num_players = num_players
+        self.seats = []  # usernames
+        self.state = None
+        self.hidden_state = None
+        self.election_count = 0
+        self.votes = {}
+        self.selection = None  # policy chosen by a chancellor that may still veto
+        self.vetoing = False
+        self.last_government = None
+        self.enacted = []
+        self.investigations = defaultdict(dict)  # president -> seat -> party
+        self.remakes = set()
+
+    def start(self):
+        roles = random.choice(SECRET_HITLER_POSSIBLE_ROLES[self.num_players])
+        deck = PolicyDeck(random.choice([d for d in POSSIBLE_DECKS if len(d) == DECK_SIZE]))
+        self.hidden_state = HiddenSecretHitlerState(hidden_roles=roles, policy_deck=deck, discard_pile=[],
+                                                    proposed_policies=())
+        self.state = SecretHitlerState.start_state(num_players=self.num_players)
+
+    @property
+    def started(self) -> bool:
+        return self.state is not None
+
+    def phase(self) -> str:
+        if self.state.phase == Phase.presidentPower:
+            return POWER_PHASES[self.state.powers[self.state.fas_policy]]
+        if self.vetoing:
+            return 'chancellorVoteOnVeto'
+        return PHASES.get(self.state.phase, '')
+
+    def deciders(self):
+        """
+        Seats the current phase waits for
+        """
+        if self.state.is_terminal():
+            return []
+        if self.vetoing:
+            return [self.state.chancellor]
+        if self.state.phase == Phase.vote:
+            return [seat for seat in self.state.alive_players if seat not in self.votes]
+        return self.state.moving_players()
+
+    def targets(self):
+        if self.state.phase == Phase.nomination:
+            return [action.chancellor for action in self.state.legal_actions(self.hidden_state, self.state.president)]
+        if self.state.phase == Phase.presidentPower:
+            return [seat for seat in self.state.alive_players if seat != self.state.president]
+        return []
+
+    def move(self, seat: int, event: str, answer):
+        """
+        Applies the answer of seat to the decision event, returns whether the game moved on
+        """
+        phase, _ = DECISIONS[event]
+        if self.state.is_terminal() or phase != self.phase() or seat not in self.deciders():
+            return False
+        if phase == 'voting':
+            self.votes[seat] = VoteAction(ja=bool(answer))
+            if len(self.votes) < len(self.state.alive_players):
+                return False
+            votes = [self.votes[player] for player in self.state.alive_players]
+            self.votes = {}
+            return self.transition(*votes)
+        if phase == 'selectingChancellor':
+            if answer not in self.targets():
+                return False
+            return self.transition(NominateChancellorAction(chancellor=answer))
+        if phase == 'presidentSelectingPolicy':
+            return self.transition(PolicyChoiceAction(policy=self.hidden_state.proposed_policies[answer]))
+        if phase == 'chancellorSelectingPolicy':
+            self.selection = PolicyChoiceAction(policy=self.hidden_state.proposed_policies[answer])
+            if self.state.veto and self.state.president_veto:
+                self.vetoing = True
+                return True
+            return self.transition(self.selection)
+        if phase == 'chancellorVoteOnVeto':
+            self.vetoing = False
+            return self.transition(VetoAction(veto=True) if answer else self.selection)
+        if phase == 'presidentVoteOnVeto':
+            self.transition(VetoAction(veto=bool(answer)))
+            if self.state.phase == Phase.chancellorSelectPolicy:
+                # a rejected veto enacts the policy the chancellor selected
+                self.transition(self.selection)
+            return True
+        if phase == 'enactPolicy':
+            return self.transition(DeckpeekPowerAction(nonsense=None))
+        if answer not in self.targets():
+            return False
+        return self.transition(TARGET_ACTIONS[phase](player=answer))
+
+    def transition(self, *moves):
+        old_state = self.state
+        self.state, self.hidden_state, observation = self.state.transition(list(moves), self.hidden_state)
+        if isinstance(observation, InvestigatePowerObservation):
+            target, party = observation.party
+            self.investigations[old_state.president][target] = party
+        if old_state.phase == Phase.vote and self.state.phase == Phase.presidentSelectPolicy:
+            self.last_government = [old_state.president, old_state.chancellor]
+        if self.state.fas_policy + self.state.lib_policy > old_state.fas_policy + old_state.lib_policy:
+            self.enacted.append(Party.fascist if self.state.fas_policy > old_state.fas_policy else Party.liberal)
+        if self.state.phase == Phase.nomination and old_state.phase != Phase.nomination:
+            self.election_count += 1
+        return True
+
+    def name_status(self, viewer: int, seat: int) -> str:
+        roles = self.hidden_state.hidden_roles
+        if seat == viewer or self.state.is_terminal():
+            return roles[seat].name
+        knows_fascists = roles[viewer] == SecretRole.fascist or \
+            (roles[viewer] == SecretRole.hitler and self.num_players < 7)
+        if knows_fascists and roles[seat] not in LIB_ROLES:
+            return roles[seat].name
+        if seat in self.investigations[viewer]:
+            return self.investigations[viewer][seat].name
+        return ''
+
+    def government_status(self, seat: int) -> str:
+        state = self.state
+        if state.is_terminal():
+            return ''
+        if state.phase in [Phase.nomination, Phase.vote]:
+            if seat == state.president:
+                return 'isPendingPresident'
+            return 'isPendingChancellor' if seat == state.chancellor else ''
+        if seat == state.president:
+            return 'isPresident'
+        return 'isChancellor' if seat == state.chancellor else ''
+
+    def cards(self, viewer: int):
+        state, phase = self.state, self.phase()
+        cards = []
+        if phase == 'presidentSelectingPolicy' and viewer == state.president:
+            cards = self.hidden_state.proposed_policies
+        elif phase in ['chancellorSelectingPolicy', 'chancellorVoteOnVeto', 'presidentVoteOnVeto'] and \
+                viewer == state.chancellor:
+            cards = self.hidden_state.proposed_policies
+        elif phase == 'enactPolicy' and viewer == state.president:
+            cards, _ = self.hidden_state.policy_deck.peek(lib_policy=state.lib_policy, fas_policy=state.fas_policy)
+        return [{'position': position, 'notificationStatus': '',
+                 'cardStatus': {'isFlipped': True, 'cardFront': 'policy', 'cardBack': card.name}}
+                for position, card in zip(CARD_POSITIONS, cards)]
+
+    def update(self, viewer: int) -> dict:
+        """
+        game_update payload as seen by the player in seat viewer
+        """
+        state = self.state
+        game_state = {'isStarted': True, 'phase': self.phase(), 'presidentIndex': state.president,
+                      'undrawnPolicyCount': state.policy_deck_size,
+                      'previousElectedGovernment': self.last_government if state.prev_gov is not None else [],
+                      'clickActionInfo': [self.seats[state.president], self.targets()]}
+        if state.phase == Phase.vote:
+            game_state['pendingChancellorIndex'] = state.chancellor
+        if state.se_prev_pres is not None:
+            game_state['specialElectionFormerPresidentIndex'] = state.se_prev_pres
+        if state.is_terminal():
+            game_state['isCompleted'] = state.game_end.name
+        return {
+            'gameState': game_state,
+            'general': {'uid': self.uid, 'name': self.name, 'playerCount': self.num_players,
+                        'livingPlayerCount': state.current_num_players, 'electionCount': self.election_count,
+                        'timedMode': False},
+            'customGameSettings': {'powers': [POWERS[power] for power in state.powers[1:]]},
+            'publicPlayersState': [{'userName': username, 'connected': True, 'isDead': seat not in state.alive_players,
+                                    'governmentStatus': self.government_status(seat),
+                                    'cardStatus': {'cardDisplayed': True, 'isFlipped': False}}
+                                   for seat, username in enumerate(self.seats)],
+            'playersState': [{'nameStatus': self.name_status(viewer, seat), 'notificationStatus': '',
+                              'hasVoted': seat in self.votes} for seat in range(self.num_players)],
+            'trackState': {'liberalPolicyCount': state.lib_policy, 'fascistPolicyCount': state.fas_policy,
+                           'electionTrackerCount': state.chaos,
+                           'enactedPolicies': [{'position': f'{policy.name}{i}', 'cardBack': policy.name}
+                                               for i, policy in enumerate(self.enacted)]},
+            'cardFlingerState': self.cards(viewer),
+            'chats': [],
+        }
+
+
+class StandInServer:
+    """
+    socket.io and HTTP endpoints of the web server used by sh_bot, on an aiohttp application
+    """
+    def __init__(self, stats: LoadStats = None):
+        self.sio = socketio.AsyncServer(async_mode='aiohttp')
+        self.app = web.Application()
+        self.sio.attach(self.app)
+        self.app.router.add_post('/account/signin', self.signin)
+        self.stats = LoadStats() if stats is None else stats
+        self.sessions = {}  # cookie -> username
+        self.users = {}  # sid -> username
+        self.sids = {}  # username -> sid
+        self.games = {}  # uid -> Game
+        self.asked = {}  # (uid, seat) -> time the decision was asked for
+        self.register_socketio_events()
+
+    async def signin(self, request):
+        form = await request.post()
+        if not form.get('username') or not form.get('password'):
+            return web.Response(status=401)
+        session = uuid.uuid4().hex
+        self.sessions[session] = form['username']
+        response = web.Response(status=200)
+        response.set_cookie('connect.sid', session)
+        return response
+
+    def register_socketio_events(self):
+        @self.sio.event
+        async def connect(sid, environ, auth=None):
+            request = environ.get('aiohttp.request')
+            if request is None or request.cookies.get('connect.sid') not in self.sessions:
+                raise socketio.exceptions.ConnectionRefusedError('not signed in')
+            # only once the connection is acknowledged can the client answer
+            self.sio.start_background_task(self.sio.emit, 'fetch_user', to=sid)
+
+        @self.sio.event
+        def disconnect(sid, *args):
+            username = self.users.pop(sid, None)
+            if self.sids.get(username) == sid:
+                del self.sids[username]
+
+        @self.sio.event
+        async def sendUser(sid, data):
+            username = data['userName']
+            self.users[sid], self.sids[username] = username, sid
+            await self.sio.emit('user_list', {'list': [{'userName': user} for user in self.sids]}, to=sid)
+
+        @self.sio.event
+        async def addNewGame(sid, data):
+            uid = uuid.uuid4().hex[:12]
+            self.games[uid] = Game(uid, data.get('gameName', 'Bot Game'), data.get('maxPlayersCount', 5))
+            await self.sio.emit('join_game_redirect', uid, to=sid)
+
+        @self.sio.event
+        async def getGameInfo(sid, uid):
+            game = self.games.get(uid)
+            if game is not None and not game.started:
+                await self.sio.emit('join_game_redirect', uid, to=sid)
+
+        @self.sio.event
+        async def updateSeatedUser(sid, data):
+            game, username = self.games.get(data['uid']), self.users.get(sid)
+            if game is None or username is None:
+                return
+            if username not in game.seats:
+                if game.started or len(game.seats) == game.num_players:
+                    await self.sio.emit('update_seat_for_user', False, to=sid)
+                    return
+                game.seats.append(username)
+            await self.sio.emit('update_seat_for_user', True, to=sid)
+            if len(game.seats) == game.num_players and not game.started:
+                game.start()
+                await self.broadcast(game)
+
+        @self.sio.event
+        async def updateRemake(sid, data):
+            game, username = self.games.get(data['uid']), self.users.get(sid)
+            if game is None or not game.started or not game.state.is_terminal() or username not in game.seats:
+                return
+            game.remakes.add(username)
+            if len(game.remakes) == len(game.seats):
+                del self.games[game.uid]
+                remade = Game(uuid.uuid4().hex[:12], game.name, game.num_players)
+                self.games[remade.uid] = remade
+                for username in game.seats:
+                    if username in self.sids:
+                        await self.sio.emit('join_game_redirect', remade.uid, to=self.sids[username])
+
+        for event in DECISIONS:
+            self.sio.on(event, self.decision_handler(event))
+
+    def decision_handler(self, event):
+        _, key = DECISIONS[event]
+
+        async def handler(sid, data):
+            game, username = self.games.get(data.get('uid')), self.users.get(sid)
+            if game is None or not game.started or username not in game.seats:
+                return
+            seat = game.seats.index(username)
+            asked = self.asked.pop((game.uid, seat), None)
+            try:
+                moved = game.move(seat, event, None if key is None else data[key])
+            except (AssertionError, IndexError, KeyError, TypeError):
+                logger.warning(f'{username} sent an invalid {event}: {data}')
+                moved = False
+            if asked is not None:
+                self.stats.record(username, time.perf_counter() - asked)
+            if moved:
+                await self.broadcast(game)
+        return handler
+
+    async def broadcast(self, game: Game):
+        """
+        Sends every player of the game its view of it and starts the clock of the decisions it asks for
+        """
+        if game.state.is_terminal():
+            self.stats.games += 1
+        now = time.perf_counter()
+        for seat in game.deciders():
+            self.asked.setdefault((game.uid, seat), now)
+        for seat, username in enumerate(game.seats):
+            if username in self.sids:
+                self.stats.updates += 1
+                await self.sio.emit('game_update', game.update(seat), to=self.sids[username])
+
+    async def serve(self, host='localhost', port=8080) -> web.AppRunner:
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.log(25, f'stand-in server listening on {host}:{port}')
+        return runner
+
+
+async def serve(host, port):
+    runner = await StandInServer().serve(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def load_test(num_bots, duration, port=8080, strategy='random', thinking=False, connections=1000):
+    """
+    Runs num_bots bots against a stand-in server on the current event loop for duration seconds and returns the
+    load report
+    """
+    import agents.strategy
+    from sh_bot import run_fleet, ENGINE_AGENTS
+    from models.new_game import NewGame
+    server = StandInServer()
+    runner = await server.serve('localhost', port)
+    executor = ProcessPoolExecutor() if strategy in ENGINE_AGENTS else None
+    accounts = [(f'loadbot{i}', 'password') for i in range(num_bots)]
+    # the thinking time of the process is restored once the fleet is stopped
+    thinking_time = agents.strategy.THINKING_TIME
+    if not thinking:
+        agents.strategy.THINKING_TIME = (0, 0)
+    fleet = asyncio.create_task(run_fleet(accounts, 'http', f'localhost:{port}', strategy,
+                                          NewGame().maxPlayersCount, connections, executor))
+    try:
+        await asyncio.sleep(duration)
+        return server.stats.report()
+    finally:
+        fleet.cancel()
+        await asyncio.gather(fleet, return_exceptions=True)
+        await runner.cleanup()
+        if executor is not None:
+            # searches still queued were cancelled along with the bots, running ones are waited for
+            executor.shutdown(wait=True)
+        agents.strategy.THINKING_TIME = thinking_time
+
+
+def clean_args(arguments):
+    clean = {}
+    for key in arguments:
+        clean_key = key.replace('-', '').replace('<', '').replace('>', '')
+        clean[clean_key] = arguments[key]
+    return clean
+
+
+if __name__ == '__main__':
+    args = clean_args(docopt(__doc__, version='Secret Hitler Stand-in Server 0.1'))
+    logging.basicConfig(level=getattr(logging, args['log'].upper()))
+
+    if args['serve']:
+        asyncio.run(serve(args['host'], int(args['port'])))
+    else:
+        report = asyncio.run(load_test(int(args['bots']), float(args['duration']), int(args['port']),
+                                       args['strategy'], args['thinking'], int(args['connections'])))
+        for key, value in report.items():
+            print(f'{key}: {value}')
@@ -0,0 +1,75 @@
+import copy
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from agents.batch_rollout import RolloutBatch
+from agents.rollout_policy import UNIFORM_POLICY
+from secrethitler import SecretHitlerState, HiddenSecretHitlerState, PolicyDeck, Party, GameEndReason, \
+    SECRET_HITLER_POSSIBLE_ROLES, POSSIBLE_DECKS, DECK_SIZE
+
+NUM_GAMES = 2000
+
+
+def determinization(num_players: int, transitions: int):
+    """
+    Position reached by playing transitions uniformly random moves from a random start
+    """
+    roles = random.choice(SECRET_HITLER_POSSIBLE_ROLES[num_players])
+    deck = PolicyDeck(random.choice([d for d in POSSIBLE_DECKS if len(d) == DECK_SIZE]))
+    hidden_state = HiddenSecretHitlerState(hidden_roles=roles, policy_deck=deck, discard_pile=[],
+                                           proposed_policies=())
+    game_state = SecretHitlerState.start_state(num_players=num_players)
+    for _ in range(transitions):
+        moves = [UNIFORM_POLICY.choose(game_state, hidden_state, p, game_state.legal_actions(hidden_state, p))
+                 for p in game_state.moving_players()]
+        next_state, next_hidden_state, _ = game_state.transition(moves=moves, hidden_state=hidden_state)
+        if next_state.is_terminal():
+            break
+        game_state, hidden_state = next_state, next_hidden_state
+    return game_state, hidden_state
+
+
+def scalar_outcomes(game_state, hidden_state, num_games: int) -> Counter:
+    outcomes = Counter()
+    for _ in range(num_games):
+        state, hidden = game_state, hidden_state
+        while not state.is_terminal():
+            moves = [UNIFORM_POLICY.choose(state, hidden, p, state.legal_actions(hidden, p))
+                     for p in state.moving_players()]
+            state, hidden, _ = state.transition(moves=moves, hidden_state=hidden)
+        outcomes[state.game_end, state.game_end_reason] += 1
+    return outcomes
+
+
+def batch_outcomes(game_state, hidden_state, num_games: int) -> Counter:
+    batch = RolloutBatch.from_states([game_state], [hidden_state]).repeat(num_games)
+    batch.run(np.random.default_rng(0))
+    return Counter((Party(winner), GameEndReason(reason)) for winner, reason in zip(batch.winner, batch.end_reason))
+
+
+@pytest.mark.parametrize('num_players, transitions', [(5, 0), (7, 0), (10, 0), (7, 25), (9, 40)])
+def test_batch_engine_matches_scalar_engine_outcomes(num_players, transitions):
+    random.seed(num_players * 100 + transitions)
+    np.random.seed(num_players * 100 + transitions)
+    game_state, hidden_state = determinization(num_players, transitions)
+    scalar = scalar_outcomes(game_state, hidden_state, NUM_GAMES)
+    batch = batch_outcomes(game_state, hidden_state, NUM_GAMES)
+    for outcome in set(scalar) | set(batch):
+        p_scalar, p_batch = scalar[outcome] / NUM_GAMES, batch[outcome] / NUM_GAMES
+        p = (p_scalar + p_batch) / 2
+        # four standard errors of the difference of two proportions
+        assert abs(p_scalar - p_batch) <= 4 * (2 * p * (1 - p) / NUM_GAMES) ** 0.5 + 1e-9, outcome
+
+
+def test_batch_terminal_values_match_scalar_payoffs():
+    random.seed(1)
+    game_state, hidden_state = determinization(7, 30)
+    batch = RolloutBatch.from_states([game_state], [hidden_state]).repeat(50)
+    values = batch.run(np.random.default_rng(1))
+    for winner, row in zip(batch.winner, values):
+        terminal_state = copy.copy(game_state)
+        terminal_state.game_end = Party(winner)
+        assert row.tolist() == terminal_state.terminal_value(hidden_state)
@@ -0,0 +1,101 @@
+from agents import RandomAgent
+from agents.engine_strategy import LiveGame
+from models.game_update import GameUpdate
+from secrethitler import Phase, Party, SecretRole, PolicyChoiceAction, VetoAction, VoteAction
+from util.json import JSON
+
+# game_update received by bot, seated as fascist in seat 2, when elected chancellor of a 7 player game after
+# the first bullet, with the players' chats and unused fields left out
+CHANCELLOR_UPDATE = '''{
+ "gameState": {"isStarted": true, "phase": "chancellorSelectingPolicy", "presidentIndex": 4,
+               "undrawnPolicyCount": 9, "previousElectedGovernment": [1, 3], "isTracksFlipped": true,
+               "clickActionInfo": ["player4", []]},
+ "general": {"uid": "devgame1", "name": "bots", "playerCount": 7, "livingPlayerCount": 6, "electionCount": 9,
+             "timedMode": false},
+ "customGameSettings": {"enabled": false, "powers": [null, "investigate", "election", "bullet", "bullet"]},
+ "publicPlayersState": [
+  {"userName": "player0", "isDead": true, "governmentStatus": "", "cardStatus": {"cardDisplayed": true}},
+  {"userName": "player1", "isDead": false, "governmentStatus": "", "cardStatus": {"cardDisplayed": true}},
+  {"userName": "bot", "isDead": false, "governmentStatus": "isChancellor", "cardStatus": {"cardDisplayed": true}},
+  {"userName": "player3", "isDead": false, "governmentStatus": "", "cardStatus": {"cardDisplayed": true}},
+  {"userName": "player4", "isDead": false, "governmentStatus": "isPresident", "cardStatus": {"cardDisplayed": true}},
+  {"userName": "player5", "isDead": false, "governmentStatus": "", "cardStatus": {"cardDisplayed": true}},
+  {"userName": "player6", "isDead": false, "governmentStatus": "", "cardStatus": {"cardDisplayed": true}}
+ ],
+ "playersState": [
+  {"nameStatus": "", "notificationStatus": ""}, {"nameStatus": "", "notificationStatus": ""},
+  {"nameStatus": "fascist", "notificationStatus": ""}, {"nameStatus": "", "notificationStatus": ""},
+  {"nameStatus": "", "notificationStatus": ""}, {"nameStatus": "fascist", "notificationStatus": ""},
+  {"nameStatus": "hitler", "notificationStatus": ""}
+ ],
+ "trackState": {"liberalPolicyCount": 2, "fascistPolicyCount": 4, "electionTrackerCount": 1,
+                "enactedPolicies": [{"position": "fascist0", "cardBack": "fascist"}]},
+ "cardFlingerState": [
+  {"position": "middle-left", "notificationStatus": "",
+   "cardStatus": {"isFlipped": true, "cardFront": "policy", "cardBack": "liberal"}},
+  {"position": "middle-right", "notificationStatus": "",
+   "cardStatus": {"isFlipped": true, "cardFront": "policy", "cardBack": "fascist"}}
+ ],
+ "chats": []
+}'''
+
+
+def game_update(payload: str = CHANCELLOR_UPDATE, **game_state) -> GameUpdate:
+    data = JSON.loads(payload)
+    data['gameState'].update(game_state)
+    return GameUpdate.from_json(data)
+
+
+def live_game(update: GameUpdate) -> LiveGame:
+    game = LiveGame('bot', RandomAgent)
+    game.observe(update)
+    return game
+
+
+def test_state_of_recorded_update():
+    update = game_update()
+    game = live_game(update)
+    state = game.state(update)
+    assert game.seat == 2
+    assert game.agent.secret_role == SecretRole.fascist
+    assert state.phase == Phase.chancellorSelectPolicy
+    assert (state.president, state.chancellor) == (4, 2)
+    assert (state.lib_policy, state.fas_policy, state.chaos) == (2, 4, 1)
+    assert state.alive_players == [1, 2, 3, 4, 5, 6]
+    assert state.current_num_players == 6
+    assert state.prev_gov == (1, 3)
+    assert state.policy_deck_size == 9
+    assert state.president_veto
+    assert game.legal_actions(state, update) == [PolicyChoiceAction(Party.liberal), PolicyChoiceAction(Party.fascist)]
+
+
+def test_knowledge_of_recorded_update():
+    game = live_game(game_update())
+    assert game.agent.president_pass == [Party.liberal, Party.fascist]
+    assert game.agent.hidden_role_beliefs
+    for roles in game.agent.hidden_role_beliefs:
+        assert (roles[2], roles[5], roles[6]) == (SecretRole.fascist, SecretRole.fascist, SecretRole.hitler)
+
+
+def test_veto_is_legal_after_five_fascist_policies():
+    data = JSON.loads(CHANCELLOR_UPDATE)
+    data['trackState']['fascistPolicyCount'] = 5
+    update = GameUpdate.from_json(data)
+    game = live_game(update)
+    assert VetoAction(veto=True) in game.legal_actions(game.state(update), update)
+
+
+def test_vote_of_recorded_update():
+    update = game_update(phase='voting', pendingChancellorIndex=3)
+    game = live_game(update)
+    state = game.state(update)
+    assert state.phase == Phase.vote
+    assert state.chancellor == 3
+    assert set(game.legal_actions(state, update)) == {VoteAction(ja=True), VoteAction(ja=False)}
+
+
+def test_custom_powers_are_not_represented():
+    data = JSON.loads(CHANCELLOR_UPDATE)
+    data['customGameSettings']['powers'] = ['reverseinv', 'investigate', 'election', 'bullet', 'bullet']
+    update = GameUpdate.from_json(data)
+    assert live_game(update).state(update) is None
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+from socketio import packet
+
+from models.account import Account
+from util import json as util_json
+from util.json import JSON, Encoded, Packet
+
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def codec(request, monkeypatch):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(util_json, 'orjson', None)
+    return request.param
+
+
+PAYLOADS = [
+    {'gameState': {'phase': 'voting', 'presidentIndex': 4}, 'chats': [{'chat': 'ja ÿ 🙂', 'timestamp': None}]},
+    ['game_update', {'trackState': {'liberalPolicyCount': 2, 'fascistPolicyCount': 4}}],
+    [1, 2.5, True, None, 'a"b\\c'],
+    {'big': 2 ** 70},
+]
+
+
+def stdlib_dumps(obj):
+    # the encoding used before util.json
+    return json.dumps(obj, default=lambda o: o.__dict__)
+
+
+@pytest.mark.parametrize('obj', PAYLOADS)
+def test_dumps_round_trip(codec, obj):
+    encoded = JSON.dumps(obj)
+    assert json.loads(encoded) == obj
+    assert JSON.loads(encoded) == obj
+
+
+def test_dumps_objects_by_attributes(codec):
+    account = Account(userName='bot')
+    assert json.loads(JSON.dumps(['sendUser', account])) == json.loads(stdlib_dumps(['sendUser', account]))
+
+
+def test_encoded_payload_is_spliced(codec):
+    account = Account(userName='bot')
+    assert JSON.dumps(['sendUser', Encoded(account)]) == JSON.dumps(['sendUser', account])
+    # nested pre-encoded payloads are decoded back instead
+    assert json.loads(JSON.dumps({'user': Encoded(account)})) == json.loads(stdlib_dumps({'user': account}))
+
+
+def test_loads_from_offset(codec):
+    assert JSON.loads_from('2["game_update",{"a":[1]}]', 1) == ['game_update', {'a': [1]}]
+
+
+@pytest.mark.parametrize('message', [
+    '2["game_update",{"gameState":{"phase":"voting"},"chats":[{"chat":"hi"}]}]',
+    '2["gameList",[]]',
+    '21["sendUser",{"userName":"bot"}]',  # with ack id
+    '2/lobby,["game_update",{}]',  # with namespace
+    '0',
+    '31["ok"]',
+])
+def test_packet_decode_matches_socketio(codec, message):
+    expected, decoded = packet.Packet(encoded_packet=message), Packet(encoded_packet=message)
+    assert (decoded.packet_type, decoded.namespace, decoded.id, decoded.data) == \
+           (expected.packet_type, expected.namespace, expected.id, expected.data)
+
+
+def test_packet_encode_round_trip(codec):
+    data = ['game_update', {'gameState': {'phase': 'voting'}}]
+    encoded = Packet(packet.EVENT, data=data).encode()
+    assert Packet(encoded_packet=encoded).data == data
@@ -0,0 +1,40 @@
+from agents.node_pool import ActionTable, ISMCTSNodePool, PIMCNodePool
+from secrethitler import VoteAction, NominateChancellorAction, BulletPowerAction
+
+
+def test_actions_of_different_types_with_equal_fields_get_different_ids():
+    assert VoteAction(ja=False) == NominateChancellorAction(chancellor=0)
+    table = ActionTable()
+    ids = [table.id(action) for action in [VoteAction(ja=False), NominateChancellorAction(chancellor=0),
+                                           NominateChancellorAction(chancellor=1), BulletPowerAction(player=1)]]
+    assert len(set(ids)) == 4
+    assert table.get(BulletPowerAction(player=1)) == ids[3]
+    assert table.get(BulletPowerAction(player=0)) is None
+    assert type(table[ids[1]]) is NominateChancellorAction
+
+
+def test_pimc_node_keeps_its_own_actions():
+    tree = PIMCNodePool([VoteAction(ja=True), VoteAction(ja=False)])
+    node = tree.add_node(PIMCNodePool.ROOT, 0, [NominateChancellorAction(0), NominateChancellorAction(2)], False)
+    assert tree.legal_actions(node) == [NominateChancellorAction(0), NominateChancellorAction(2)]
+    assert [type(action) for action in tree.legal_actions(node)] == [NominateChancellorAction] * 2
+    assert tree.slot(node, NominateChancellorAction(0)) == tree.slot_offset[node]
+
+
+def test_ismcts_edges_are_looked_up_by_action_type():
+    tree = ISMCTSNodePool(num_players=5)
+    child = tree.add_child(ISMCTSNodePool.ROOT, (NominateChancellorAction(chancellor=1),))
+    assert tree.child(ISMCTSNodePool.ROOT, (NominateChancellorAction(chancellor=1),)) == child
+    assert tree.child(ISMCTSNodePool.ROOT, (VoteAction(ja=True),)) == -1
+    assert tree.child(ISMCTSNodePool.ROOT, (BulletPowerAction(player=1),)) == -1
+
+
+def test_ismcts_caches_are_keyed_by_action_type():
+    tree = ISMCTSNodePool(num_players=5)
+    votes = ((VoteAction(ja=False), VoteAction(ja=True)),)
+    nominations = ((NominateChancellorAction(chancellor=0), NominateChancellorAction(chancellor=1)),)
+    vote_actions, vote_ids = tree.compatible(votes)
+    nomination_actions, nomination_ids = tree.compatible(nominations)
+    assert [type(moves[0]) for moves in nomination_actions] == [NominateChancellorAction] * 2
+    assert not set(vote_ids) & set(nomination_ids)
+    assert tree.move_ids(votes[0])[0] != tree.move_ids(nominations[0])[0]
@@ -0,0 +1,46 @@
+import asyncio
+import os
+import pickle
+import stat
+
+import aiohttp
+import pytest
+from yarl import URL
+
+from sh_bot import SessionCache
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SessionCache(str(tmp_path / 'sessions'))
+
+
+def test_cache_is_private(cache):
+    async def save_and_load():
+        jar = aiohttp.CookieJar()
+        jar.update_cookies({'sid': 'secret'}, URL('http://localhost'))
+        cache.save('bot', jar)
+        cache.save_handshake('bot', {'confirmTOU': True})
+        return cache.load('bot', aiohttp.CookieJar())
+
+    assert asyncio.run(save_and_load())
+    assert mode(cache.directory) == 0o700
+    assert mode(cache.path('bot', '.cookies')) == 0o600
+    assert mode(cache.path('bot', '.json')) == 0o600
+
+
+@pytest.mark.parametrize('content', [b'', b'\x80\x04\x95', pickle.dumps({'a': 1})[:-3], b'garbage'])
+def test_corrupt_cookies_fall_back_to_signin(cache, content):
+    async def load():
+        return cache.load('bot', aiohttp.CookieJar())
+
+    cache.save_handshake('bot', {'confirmTOU': True})
+    with open(cache.path('bot', '.cookies'), 'wb') as f:
+        f.write(content)
+    assert not asyncio.run(load())
+    assert not os.path.exists(cache.path('bot', '.cookies'))
+    assert cache.handshake('bot') == {}
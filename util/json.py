@@ -1,10 +1,91 @@
 import json
 
+from socketio import packet
+
+try:
+    import orjson
+except ImportError:  # the standard library codec is used without it
+    orjson = None
+
+_decoder = json.JSONDecoder()
+
+
+class Encoded:
+    """
+    Payload encoded once, spliced as is into every message that emits it as the only argument of an event
+    """
+    __slots__ = ['json']
+
+    def __init__(self, obj):
+        self.json = JSON.dumps(obj)
+
+
+def _default(o):
+    if isinstance(o, Encoded):
+        # only payloads emitted on their own are spliced, nested ones are decoded back
+        return json.loads(o.json)
+    return o.__dict__
+
+
 class JSON:
-    # no difference from json.loads function
-    def loads(*args, **kwargs):
-        return json.loads(*args, **kwargs)
+    # same as json.loads, with orjson when it is installed and no decoder options are given
+    def loads(s, *args, **kwargs):
+        if orjson is not None and not args and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, *args, **kwargs)
+
+    # JSON document starting at index start of s, without copying s when decoding with the standard library
+    def loads_from(s, start=0):
+        if orjson is not None:
+            return orjson.loads(s[start:])
+        return _decoder.raw_decode(s, start)[0]
 
     # recursively converts input object into dict, allowing for complex json
-    def dumps(*args, **kwargs):
-        return json.dumps(*args, **kwargs, default=lambda o: o.__dict__)
\ No newline at end of file
+    def dumps(obj, *args, **kwargs):
+        if type(obj) is list and len(obj) == 2 and type(obj[1]) is Encoded:
+            # an event emitted with a pre-encoded payload
+            return '[' + JSON.dumps(obj[0]) + ',' + obj[1].json + ']'
+        if orjson is not None and not args and set(kwargs) <= {'separators'} and \
+                tuple(kwargs.get('separators', (',', ':'))) == (',', ':'):
+            try:
+                return orjson.dumps(obj, default=_default).decode()
+            except TypeError:  # e.g. integers beyond 64 bits or non-string keys
+                pass
+        kwargs.setdefault('separators', (',', ':'))
+        return json.dumps(obj, *args, **kwargs, default=_default)
+
+
+class Packet(packet.Packet):
+    """
+    socket.io packet that decodes plain events, such as game_update, straight from the received message
+    """
+    json = JSON
+
+    def decode(self, encoded_packet):
+        if type(encoded_packet) is str and encoded_packet[:2] == '2[':
+            # an event of the default namespace without ack id, the payload starts after the packet type
+            self.packet_type = packet.EVENT
+            self.data = JSON.loads_from(encoded_packet, 1)
+            return 0
+        return super().decode(encoded_packet)
+
+
+if __name__ == "__main__":
+    import time
+    from models.account import Account
+    from models.game_update import _late_game_payload
+
+    account = Account(userName='benchmark')
+    encoded_account = Encoded(account)
+    message = '2' + json.dumps(['game_update', _late_game_payload(num_chats=2000)])
+    for name, run in [
+        ('stdlib sendUser', lambda: json.dumps(['sendUser', account], default=lambda o: o.__dict__)),
+        ('JSON sendUser', lambda: JSON.dumps(['sendUser', account])),
+        ('JSON pre-encoded sendUser', lambda: JSON.dumps(['sendUser', encoded_account])),
+        ('stdlib game_update', lambda: packet.Packet(encoded_packet=message)),
+        ('JSON game_update', lambda: Packet(encoded_packet=message)),
+    ]:
+        start = time.perf_counter()
+        for _ in range(200):
+            run()
+        print(f'{name}: {(time.perf_counter() - start) / 200 * 1e6:.1f}us')